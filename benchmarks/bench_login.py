@@ -0,0 +1,360 @@
+"""
+Benchmarks of LDAPAuthenticator logins against an in-memory LDAP directory.
+
+The directory is served by ldap3's MOCK_SYNC strategy, or with
+`--bundled-server` over TCP by the LDAP server bundled with the tests, and
+generated with a number of users spread over nested OUs under ou=people, and a
+number of groups under ou=groups, each user being a member of one group. Every
+LDAP operation waits for `--latency` seconds, standing in for the round trip
+to a real LDAP server, so that configurations making fewer round trips per
+login, or making them concurrently, show up as faster.
+
+For every configuration mode, the benchmark makes `--logins` logins of random
+users, `--concurrency` at the time, and reports logins per second, the p50 and
+p99 login latency, and the LDAP connections and operations (binds, searches
+and StartTLS) made per login.
+
+Usage:
+
+    python benchmarks/bench_login.py
+    python benchmarks/bench_login.py --users 10000 --groups 50 --latency 0.005
+    python benchmarks/bench_login.py --mode lookup_dn --mode groups
+    python benchmarks/bench_login.py --bundled-server --mode groups
+
+The mock directory's own search cost grows with the number of entries, so
+results are comparable between runs with the same arguments on the same
+machine, such as before and after a change.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from unittest import mock
+
+import ldap3
+from traitlets.config import Config
+
+from ldapauthenticator import LDAPAuthenticator
+from ldapauthenticator.tests.ldapserver import LDAPServer
+
+BASE_DN = "dc=example,dc=org"
+PEOPLE_DN = f"ou=people,{BASE_DN}"
+GROUPS_DN = f"ou=groups,{BASE_DN}"
+SERVICE_DN = f"cn=service,{BASE_DN}"
+SERVICE_PASSWORD = "service"
+
+
+class Directory:
+    """
+    A generated directory served by ldap3's MOCK_SYNC strategy to the
+    connections of LDAPAuthenticator, counting the operations made.
+    """
+
+    def __init__(self, users, groups, ous, latency):
+        self.users = users
+        self.groups = groups
+        self.ous = ous
+        self.latency = latency
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+        # the bundled LDAP server serving the directory, if used
+        self.ldap_server = None
+
+        self.server = ldap3.Server("benchmark")
+        conn = ldap3.Connection(self.server, client_strategy=ldap3.MOCK_SYNC)
+        for dn, attributes in self.entries():
+            conn.strategy.add_entry(dn, attributes)
+
+    def entries(self):
+        """
+        Returns the (dn, attributes) of the entries of the directory.
+        """
+        # the base and OU entries, which the MOCK_SYNC strategy doesn't need
+        entries = [
+            (BASE_DN, {"objectClass": ["dcObject", "organization"], "o": ["example"]})
+        ]
+        ous = [PEOPLE_DN, GROUPS_DN]
+        for ou in self.user_ous():
+            ous += [ou.split(",", 1)[1], ou]
+        entries += [
+            (ou, {"objectClass": ["organizationalUnit"], "ou": [ou[3:].split(",")[0]]})
+            for ou in dict.fromkeys(ous)
+        ]
+        entries += [
+            (
+                SERVICE_DN,
+                {
+                    "objectClass": ["person"],
+                    "cn": ["service"],
+                    "userPassword": [SERVICE_PASSWORD],
+                },
+            )
+        ]
+        for i in range(self.users):
+            entries.append(
+                (
+                    self.user_dn(i),
+                    {
+                        "objectClass": ["inetOrgPerson"],
+                        "uid": [self.username(i)],
+                        "cn": [f"User {i}"],
+                        "sn": [str(i)],
+                        "mail": [f"{self.username(i)}@example.org"],
+                        "userPassword": [self.username(i)],
+                        "memberOf": [self.group_dn(i % self.groups)],
+                    },
+                )
+            )
+        for g in range(self.groups):
+            entries.append(
+                (
+                    self.group_dn(g),
+                    {
+                        "objectClass": ["groupOfNames"],
+                        "cn": [f"group{g}"],
+                        "member": [
+                            self.user_dn(i) for i in range(g, self.users, self.groups)
+                        ],
+                    },
+                )
+            )
+        return entries
+
+    def start_ldap_server(self):
+        """
+        Starts serving the directory with the bundled LDAP server, with the
+        latency added to every operation.
+        """
+        self.ldap_server = LDAPServer(self.entries())
+        self.ldap_server.latency = self.latency
+        self.ldap_server.start()
+
+    def reset_counts(self):
+        self.counts.clear()
+        if self.ldap_server:
+            self.ldap_server.counts.clear()
+
+    def get_counts(self):
+        """
+        Returns the number of connections and operations made.
+        """
+        if self.ldap_server:
+            counts = self.ldap_server.counts
+            operations = counts["bind"] + counts["search"] + counts["start_tls"]
+            return counts["connections"], operations
+        return self.counts["connections"], self.counts["operations"]
+
+    def username(self, i):
+        return f"user{i}"
+
+    def user_ou(self, i):
+        """
+        Returns the DN of the OU of a user, the users being spread over OUs
+        nested two levels deep.
+        """
+        ou = i % self.ous
+        return f"ou=team{ou},ou=division{ou % 4},{PEOPLE_DN}"
+
+    def user_dn(self, i):
+        return f"uid={self.username(i)},{self.user_ou(i)}"
+
+    def group_dn(self, g):
+        return f"cn=group{g},{GROUPS_DN}"
+
+    def user_ous(self):
+        return sorted({self.user_ou(i) for i in range(min(self.users, self.ous))})
+
+    def _operation(self, name):
+        with self._lock:
+            self.counts[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def connection_class(self):
+        """
+        Returns an ldap3 Connection class connecting to this directory, to
+        replace ldap3.Connection with.
+        """
+        directory = self
+
+        class BenchmarkConnection(ldap3.Connection):
+            def __init__(self, server, *args, **kwargs):
+                server.dit = directory.server.dit
+                server.dit_lock = directory.server.dit_lock
+                kwargs["client_strategy"] = ldap3.MOCK_SYNC
+                super().__init__(server, *args, **kwargs)
+                # ldap3 sets open to the strategy's open per connection
+                strategy_open = self.open
+
+                def open(*args, **kwargs):
+                    directory._operation("connections")
+                    return strategy_open(*args, **kwargs)
+
+                self.open = open
+
+            def start_tls(self, *args, **kwargs):
+                directory._operation("operations")
+                return True
+
+            def bind(self, *args, **kwargs):
+                directory._operation("operations")
+                return super().bind(*args, **kwargs)
+
+            def search(self, *args, **kwargs):
+                directory._operation("operations")
+                return super().search(*args, **kwargs)
+
+        return BenchmarkConnection
+
+
+def make_config(mode, directory):
+    """
+    Returns the configuration of LDAPAuthenticator benchmarked by a mode.
+    """
+    c = Config()
+    if directory.ldap_server:
+        c.LDAPAuthenticator.server_address = directory.ldap_server.host
+        c.LDAPAuthenticator.server_port = directory.ldap_server.port
+    else:
+        c.LDAPAuthenticator.server_address = "benchmark"
+    c.LDAPAuthenticator.tls_strategy = "insecure"
+    if mode == "template":
+        # the user's OU is unknown, so a template is tried per OU
+        c.LDAPAuthenticator.bind_dn_template = [
+            f"uid={{username}},{ou}" for ou in directory.user_ous()
+        ]
+        return c
+
+    c.LDAPAuthenticator.lookup_dn = True
+    c.LDAPAuthenticator.lookup_dn_search_user = SERVICE_DN
+    c.LDAPAuthenticator.lookup_dn_search_password = SERVICE_PASSWORD
+    c.LDAPAuthenticator.user_search_base = PEOPLE_DN
+    c.LDAPAuthenticator.user_attribute = "uid"
+    c.LDAPAuthenticator.lookup_dn_user_dn_attribute = "uid"
+    if mode == "groups":
+        c.LDAPAuthenticator.allowed_groups = [
+            directory.group_dn(g) for g in range(directory.groups)
+        ]
+    elif mode == "auth_state":
+        c.LDAPAuthenticator.auth_state_attributes = ["cn", "mail", "memberOf"]
+    return c
+
+
+MODES = ["template", "lookup_dn", "groups", "auth_state"]
+
+
+async def run_mode(mode, directory, logins, concurrency):
+    """
+    Makes logins with the configuration of a mode, returning the results to
+    report.
+    """
+    authenticator = LDAPAuthenticator(config=make_config(mode, directory))
+    rng = random.Random(mode)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def login():
+        nonlocal failures
+        username = directory.username(rng.randrange(directory.users))
+        async with semaphore:
+            start = time.perf_counter()
+            result = await authenticator.authenticate(
+                None, {"username": username, "password": username}
+            )
+            latencies.append(time.perf_counter() - start)
+        if result is None:
+            failures += 1
+
+    directory.reset_counts()
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    duration = time.perf_counter() - start
+    authenticator.executor.shutdown()
+    connections, operations = directory.get_counts()
+
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "mode": mode,
+        "logins/s": logins / duration,
+        "p50 ms": 1e3 * percentiles[49],
+        "p99 ms": 1e3 * percentiles[98],
+        "connections/login": connections / logins,
+        "operations/login": operations / logins,
+        "failures": failures,
+    }
+
+
+def print_results(results):
+    columns = list(results[0])
+    rows = [
+        [f"{v:.2f}" if isinstance(v, float) else str(v) for v in r.values()]
+        for r in results
+    ]
+    widths = [
+        max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)
+    ]
+    print("  ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(v.rjust(w) for v, w in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--users", type=int, default=1000, help="users in the directory"
+    )
+    parser.add_argument(
+        "--groups", type=int, default=20, help="groups in the directory"
+    )
+    parser.add_argument(
+        "--ous", type=int, default=8, help="OUs the users are spread over"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.002,
+        help="seconds every LDAP operation takes, in addition to the mock's own time",
+    )
+    parser.add_argument("--logins", type=int, default=500, help="logins per mode")
+    parser.add_argument(
+        "--concurrency", type=int, default=10, help="logins made at the same time"
+    )
+    parser.add_argument(
+        "--mode",
+        action="append",
+        choices=MODES,
+        help="configuration modes to benchmark, all by default",
+    )
+    parser.add_argument(
+        "--bundled-server",
+        action="store_true",
+        help="serve the directory over TCP with the LDAP server bundled with the tests",
+    )
+    args = parser.parse_args()
+
+    directory = Directory(args.users, args.groups, args.ous, args.latency)
+    results = []
+    if args.bundled_server:
+        directory.start_ldap_server()
+        patch = contextlib.nullcontext()
+    else:
+        patch = mock.patch.object(ldap3, "Connection", directory.connection_class())
+    with patch:
+        for mode in args.mode or MODES:
+            results.append(
+                asyncio.run(run_mode(mode, directory, args.logins, args.concurrency))
+            )
+    if directory.ldap_server:
+        directory.ldap_server.stop()
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
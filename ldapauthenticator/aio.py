@@ -0,0 +1,367 @@
+import asyncio
+import ssl
+
+import ldap3
+from ldap3.core.exceptions import (
+    LDAPSessionTerminatedByServerError,
+    LDAPSocketOpenError,
+    LDAPSocketReceiveError,
+    LDAPStartTLSError,
+)
+from ldap3.core.results import RESULT_SUCCESS
+from ldap3.core.tls import check_hostname
+from ldap3.operation.bind import bind_operation, bind_response_to_dict_fast
+from ldap3.operation.extended import (
+    extended_operation,
+    extended_response_to_dict_fast,
+)
+from ldap3.operation.search import (
+    search_operation,
+    search_result_entry_response_to_dict_fast,
+)
+from ldap3.operation.unbind import unbind_operation
+from ldap3.protocol.convert import build_controls_list
+from ldap3.protocol.rfc2696 import paged_search_control
+from ldap3.protocol.rfc4511 import LDAPMessage, MessageID, ProtocolOp
+from ldap3.strategy.base import BaseStrategy
+from ldap3.utils.asn1 import decode_message_fast, encode, ldap_result_to_dict_fast
+
+START_TLS_OID = "1.3.6.1.4.1.1466.20037"
+
+# protocolOp tags of the responses handled, as decoded by decode_message_fast
+BIND_RESPONSE = 1
+SEARCH_RESULT_ENTRY = 4
+SEARCH_RESULT_DONE = 5
+SEARCH_RESULT_REFERENCE = 19
+EXTENDED_RESPONSE = 24
+
+
+class Attribute:
+    """
+    The values of an entry's attribute, like ldap3's Attribute.
+    """
+
+    def __init__(self, key, values):
+        self.key = key
+        self.values = values
+
+    @property
+    def value(self):
+        if len(self.values) == 1:
+            return self.values[0]
+        return self.values or None
+
+
+class Entry:
+    """
+    An entry found by a search, offering the parts of ldap3's Entry interface
+    that LDAPAuthenticator uses: `entry_dn`, `entry_attributes_as_dict`, and
+    case insensitive access to attributes with `entry[name]`.
+
+    Attribute values are not formatted according to the server's schema, they
+    are strings, or bytes if they can't be decoded as UTF-8.
+    """
+
+    def __init__(self, dn, attributes):
+        self.entry_dn = dn
+        # a ldap3 CaseInsensitiveDict
+        self._attributes = attributes
+
+    @property
+    def entry_attributes_as_dict(self):
+        return {key: list(values or []) for key, values in self._attributes.items()}
+
+    def __contains__(self, name):
+        return bool(self._attributes.get(name))
+
+    def __getitem__(self, name):
+        values = self._attributes.get(name)
+        if not values:
+            raise KeyError(name)
+        return Attribute(name, list(values))
+
+    def __repr__(self):
+        return f"<Entry {self.entry_dn}>"
+
+
+class _LDAPProtocol(asyncio.Protocol):
+    """
+    Splits the data received into LDAP messages, collecting the responses to
+    each outstanding request until its final response resolves its future.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.closed = False
+        self._buffer = bytearray()
+        # message id -> (future, intermediate responses)
+        self._outstanding = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self._fail_outstanding(
+            LDAPSessionTerminatedByServerError(
+                f"connection closed by server: {exc}" if exc else "connection closed"
+            )
+        )
+
+    def expect(self, message_id):
+        future = asyncio.get_running_loop().create_future()
+        self._outstanding[message_id] = (future, [])
+        return future
+
+    def _fail_outstanding(self, exc):
+        outstanding, self._outstanding = self._outstanding, {}
+        for future, _ in outstanding.values():
+            if not future.done():
+                future.set_exception(exc)
+
+    def data_received(self, data):
+        self._buffer += data
+        while True:
+            size = BaseStrategy.compute_ldap_message_size(self._buffer)
+            if size == -1 or len(self._buffer) < size:
+                return
+            message = decode_message_fast(bytes(self._buffer[:size]))
+            del self._buffer[:size]
+            self._handle_message(message)
+
+    def _handle_message(self, message):
+        if message["messageID"] == 0:
+            # an unsolicited notification, the only one defined is the notice
+            # of disconnection, after which the server closes the connection
+            self.closed = True
+            self._fail_outstanding(
+                LDAPSessionTerminatedByServerError("session terminated by server")
+            )
+            self.transport.close()
+            return
+
+        outstanding = self._outstanding.get(message["messageID"])
+        if outstanding is None:
+            # a late response to a request no longer awaited
+            return
+        future, responses = outstanding
+        op = message["protocolOp"]
+        payload = message["payload"]
+        if op == SEARCH_RESULT_ENTRY:
+            responses.append(
+                search_result_entry_response_to_dict_fast(payload, None, None, False)
+            )
+            return
+        if op == SEARCH_RESULT_REFERENCE:
+            # continuation references aren't followed, just like ldap3
+            # doesn't by default
+            return
+
+        del self._outstanding[message["messageID"]]
+        if op == BIND_RESPONSE:
+            result = bind_response_to_dict_fast(payload)
+        elif op == EXTENDED_RESPONSE:
+            result = extended_response_to_dict_fast(payload)
+        else:
+            result = ldap_result_to_dict_fast(payload)
+        if message["controls"]:
+            result["controls"] = dict(
+                BaseStrategy.decode_control_fast(control[3])
+                for control in message["controls"]
+            )
+        if not future.done():
+            future.set_result((responses, result))
+
+
+class AsyncConnection:
+    """
+    A minimal LDAP v3 client running on the asyncio event loop, offering the
+    subset of ldap3's Connection interface used by LDAPAuthenticator, with the
+    operations being coroutines.
+
+    Requests are encoded and responses decoded with ldap3's own protocol
+    implementation. `server` is a ldap3 Server object, its `tls` must be a
+    ReusableTls object if TLS is used. Like with ldap3, connecting times out
+    after the server's `connect_timeout`, and waiting for a response after
+    `receive_timeout`, closing the connection.
+    """
+
+    def __init__(self, server, user=None, password=None, receive_timeout=None):
+        self.server = server
+        self.user = user
+        self.password = password
+        self.receive_timeout = receive_timeout
+        self.bound = False
+        self.tls_started = False
+        self.entries = []
+        self.result = None
+        self._protocol = None
+        self._message_id = 0
+
+    @property
+    def closed(self):
+        return self._protocol is None or self._protocol.closed
+
+    def _check_hostname(self, transport):
+        tls = self.server.tls
+        if tls.validate in (ssl.CERT_REQUIRED, ssl.CERT_OPTIONAL):
+            ssl_object = transport.get_extra_info("ssl_object")
+            check_hostname(ssl_object, self.server.host, tls.valid_names)
+
+    async def open(self):
+        """
+        Connects to the server, establishing TLS directly if the server is
+        configured to use SSL.
+        """
+        loop = asyncio.get_running_loop()
+        ssl_context = None
+        server_hostname = None
+        if self.server.ssl:
+            ssl_context = self.server.tls.ssl_context
+            # like ReusableTls, only send SNI if configured, an empty string
+            # tells asyncio not to default to the host
+            server_hostname = self.server.tls.sni or ""
+        try:
+            transport, self._protocol = await asyncio.wait_for(
+                loop.create_connection(
+                    _LDAPProtocol,
+                    self.server.host,
+                    self.server.port,
+                    ssl=ssl_context,
+                    server_hostname=server_hostname,
+                ),
+                self.server.connect_timeout or None,
+            )
+            if ssl_context:
+                self._check_hostname(transport)
+        except asyncio.TimeoutError as e:
+            raise LDAPSocketOpenError(
+                "socket connection error while opening: timed out"
+            ) from e
+        except ssl.SSLError as e:
+            raise LDAPSocketOpenError(f"socket ssl wrapping error: {e}") from e
+        except OSError as e:
+            raise LDAPSocketOpenError(
+                f"socket connection error while opening: {e}"
+            ) from e
+        except Exception as e:
+            self.unbind()
+            raise LDAPSocketOpenError(f"socket ssl wrapping error: {e}") from e
+
+    def _send(self, message_type, request, controls=None):
+        if self.closed:
+            raise LDAPSocketOpenError("unable to send message, socket is not open")
+        self._message_id += 1
+        message = LDAPMessage()
+        message["messageID"] = MessageID(self._message_id)
+        message["protocolOp"] = ProtocolOp().setComponentByName(message_type, request)
+        if controls:
+            message["controls"] = build_controls_list(controls)
+        self._protocol.transport.write(encode(message))
+        return self._message_id
+
+    async def _request(self, message_type, request, controls=None):
+        message_id = self._send(message_type, request, controls)
+        try:
+            responses, self.result = await asyncio.wait_for(
+                self._protocol.expect(message_id), self.receive_timeout or None
+            )
+        except asyncio.TimeoutError as e:
+            # the response may still arrive, the connection can't be used
+            # for other requests
+            self.unbind()
+            raise LDAPSocketReceiveError("error receiving data: timed out") from e
+        return responses
+
+    async def start_tls(self):
+        """
+        Upgrades the connection to TLS with the StartTLS extended operation.
+        """
+        if self.server.ssl or self.tls_started:
+            return False
+        await self._request("extendedReq", extended_operation(START_TLS_OID))
+        if self.result["result"] != RESULT_SUCCESS:
+            raise LDAPStartTLSError(f"startTLS failed - {self.result['description']}")
+        loop = asyncio.get_running_loop()
+        tls = self.server.tls
+        try:
+            transport = await loop.start_tls(
+                self._protocol.transport,
+                self._protocol,
+                tls.ssl_context,
+                server_hostname=tls.sni or None,
+            )
+            self._check_hostname(transport)
+        except Exception as e:
+            self.unbind()
+            raise LDAPStartTLSError(f"wrap socket error: {e}") from e
+        self._protocol.transport = transport
+        self.tls_started = True
+        return True
+
+    async def bind(self):
+        """
+        Binds as `user` with `password`, or anonymously if there is no user.
+        Returns True if the bind succeeded.
+        """
+        authentication = ldap3.SIMPLE if self.user else ldap3.ANONYMOUS
+        request = bind_operation(3, authentication, self.user, self.password)
+        await self._request("bindRequest", request)
+        self.bound = self.result["result"] == RESULT_SUCCESS
+        return self.bound
+
+    async def search(
+        self,
+        search_base,
+        search_filter,
+        search_scope=ldap3.SUBTREE,
+        attributes=None,
+        paged_size=None,
+        paged_cookie=None,
+    ):
+        """
+        Searches like ldap3's Connection.search, storing the entries found in
+        `entries`. Returns True if any entries were found.
+
+        With `paged_size`, a page of the entries is requested with the simple
+        paged results control (RFC 2696), and the cookie to request the next
+        page with is found in `result["controls"]`, like with ldap3.
+        """
+        if not attributes:
+            attributes = [ldap3.NO_ATTRIBUTES]
+        elif isinstance(attributes, str):
+            attributes = [attributes]
+        request = search_operation(
+            search_base,
+            search_filter,
+            search_scope,
+            ldap3.DEREF_ALWAYS,
+            attributes,
+            0,
+            0,
+            False,
+            True,
+            True,
+        )
+        controls = None
+        if paged_size:
+            controls = [paged_search_control(False, paged_size, paged_cookie)]
+        self.entries = []
+        responses = await self._request("searchRequest", request, controls)
+        self.entries = [Entry(r["dn"], r["attributes"]) for r in responses]
+        return bool(self.entries)
+
+    def unbind(self):
+        """
+        Sends an unbind request, if still connected, and closes the connection.
+        """
+        if not self.closed:
+            try:
+                self._send("unbindRequest", unbind_operation())
+            except Exception:
+                pass
+        if self._protocol is not None and self._protocol.transport is not None:
+            self._protocol.transport.close()
+            self._protocol.closed = True
+        self.bound = False
+        return True
@@ -0,0 +1,72 @@
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    A thread safe circuit breaker, tracking whether a service is failing so
+    that callers can fail fast instead of waiting for it.
+
+    The breaker starts closed, and opens after `threshold` consecutive
+    failures, 0 never opening it. Once open for `cooldown` seconds, it can be
+    turned half-open to probe the service, closing it again if the probe
+    succeeds and reopening it for another `cooldown` if the probe fails.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._failures = 0
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        """
+        Returns the number of seconds until the breaker can be turned
+        half-open, or 0 if it is closed or can be turned half-open now.
+        """
+        with self._lock:
+            if self.state != OPEN:
+                return 0
+            return max(self._opened + self.cooldown - time.monotonic(), 0)
+
+    def half_open(self):
+        """
+        Turns an open breaker half-open if its cooldown has passed, returning
+        True if it did.
+        """
+        with self._lock:
+            if self.state != OPEN or time.monotonic() < self._opened + self.cooldown:
+                return False
+            self.state = HALF_OPEN
+            return True
+
+    def succeeded(self):
+        """
+        Records a success of the service, closing the breaker.
+        """
+        with self._lock:
+            self.state = CLOSED
+            self._failures = 0
+
+    def failed(self):
+        """
+        Records a failure of the service, returning True if it opened the
+        breaker.
+        """
+        if self.threshold <= 0:
+            return False
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self._failures >= self.threshold
+            ):
+                self.state = OPEN
+                self._opened = time.monotonic()
+                return True
+            return False
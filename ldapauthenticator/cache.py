@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+
+class TTLCache:
+    """
+    A thread safe cache holding at most `maxsize` entries, evicting the least
+    recently used entry when full. Entries expire `ttl` seconds after they were
+    set, or never if `ttl` is None.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def get(self, key, default=None):
+        """
+        Returns the value for key if it is cached and hasn't expired, marking
+        it as the most recently used, or default otherwise.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=_missing):
+        """
+        Caches value for key, optionally with a ttl other than the cache's.
+        """
+        if ttl is _missing:
+            ttl = self.ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Removes key from the cache, returning its value if it was cached and
+        hadn't expired, or default otherwise.
+        """
+        with self._lock:
+            item = self._data.pop(key, None)
+        if item is None:
+            return default
+        value, expires = item
+        if expires is not None and expires <= time.monotonic():
+            return default
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
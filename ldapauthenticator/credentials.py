@@ -0,0 +1,82 @@
+import copy
+import hashlib
+import hmac
+import os
+import time
+
+from .cache import TTLCache
+
+# scrypt's parameters recommended for interactive logins, taking tens of
+# milliseconds and 16 MiB of memory per hash
+SCRYPT_PARAMS = {"n": 2**14, "r": 8, "p": 1, "dklen": 32}
+# used if Python's OpenSSL lacks scrypt
+PBKDF2_ITERATIONS = 200_000
+
+
+def hash_password(password, salt):
+    """
+    Returns a slow salted hash of a password, expensive to brute force.
+    """
+    password = password.encode("utf8")
+    if hasattr(hashlib, "scrypt"):
+        return hashlib.scrypt(password, salt=salt, **SCRYPT_PARAMS)
+    return hashlib.pbkdf2_hmac("sha256", password, salt, PBKDF2_ITERATIONS)
+
+
+class CredentialCache:
+    """
+    A thread safe cache of the result of logins verified with the LDAP server,
+    by username, holding at most `maxsize` logins.
+
+    Passwords are only held as slow salted hashes. A cached login can be
+    reused for `ttl` seconds after it was verified, and for another `grace`
+    seconds if `outage` is passed, when the LDAP server can't verify it.
+
+    Hashing passwords is slow on purpose, `get` and `set` should be run in an
+    executor.
+    """
+
+    def __init__(self, maxsize, ttl, grace=0):
+        self.ttl = ttl
+        self.grace = grace
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl + grace)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, username, password, outage=False):
+        """
+        Returns a copy of the cached result of a login, or None if the login
+        isn't cached, its password doesn't match, or it was verified more than
+        `ttl` seconds ago without `outage`.
+        """
+        item = self._cache.get(username)
+        if item is None or not password:
+            return None
+        salt, password_hash, verified, result = item
+        if not outage and time.monotonic() >= verified + self.ttl:
+            return None
+        if not hmac.compare_digest(hash_password(password, salt), password_hash):
+            return None
+        return copy.deepcopy(result)
+
+    def set(self, username, password, result):
+        """
+        Caches the result of a login verified with the LDAP server.
+        """
+        salt = os.urandom(16)
+        self._cache.set(
+            username,
+            (
+                salt,
+                hash_password(password, salt),
+                time.monotonic(),
+                copy.deepcopy(result),
+            ),
+        )
+
+    def pop(self, username):
+        self._cache.pop(username)
+
+    def clear(self):
+        self._cache.clear()
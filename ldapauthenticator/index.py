@@ -0,0 +1,44 @@
+import time
+
+
+class GroupIndex:
+    """
+    An index of the members of groups, mapping the normalized DNs and the uids
+    of members to the groups they are members of. The groups of a member are
+    kept as a bit mask of the groups' positions in `groups`, so that a member
+    costs a single int however many groups it is a member of.
+
+    An index is filled in while it is built and not modified once in use, so
+    that it can be replaced as a whole by a newly built index.
+    """
+
+    def __init__(self, groups):
+        self.groups = tuple(groups)
+        self.created = time.monotonic()
+        self._dns = {}
+        self._uids = {}
+
+    def __len__(self):
+        return len(self._dns) + len(self._uids)
+
+    def add_dn(self, position, dn):
+        """
+        Adds a member by its normalized DN to the group at position.
+        """
+        self._dns[dn] = self._dns.get(dn, 0) | 1 << position
+
+    def add_uid(self, position, uid):
+        """
+        Adds a member by its uid to the group at position.
+        """
+        self._uids[uid] = self._uids.get(uid, 0) | 1 << position
+
+    def get_groups(self, dn, uid=None):
+        """
+        Returns the groups, in order, that a member with the normalized DN or
+        the uid is a member of.
+        """
+        mask = self._dns.get(dn, 0)
+        if uid is not None:
+            mask |= self._uids.get(uid, 0)
+        return [group for i, group in enumerate(self.groups) if mask >> i & 1]
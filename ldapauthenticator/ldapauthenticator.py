@@ -1,14 +1,61 @@
+import asyncio
+import contextvars
+import copy
 import enum
+import math
 import re
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from inspect import isawaitable
 
 import ldap3
 from jupyterhub.auth import Authenticator
-from ldap3.core.exceptions import LDAPBindError, LDAPSocketOpenError
-from ldap3.core.tls import Tls
+from ldap3.core.exceptions import (
+    LDAPBindError,
+    LDAPCommunicationError,
+    LDAPInvalidDnError,
+    LDAPOperationResult,
+    LDAPSocketOpenError,
+    LDAPStartTLSError,
+)
+from ldap3.core.results import RESULT_NO_SUCH_OBJECT, RESULT_SUCCESS
 from ldap3.utils.conv import escape_filter_chars
-from ldap3.utils.dn import escape_rdn
-from traitlets import Bool, Dict, Int, List, Unicode, Union, UseEnum, observe, validate
+from ldap3.utils.dn import escape_rdn, parse_dn
+from tornado import web
+from tornado.ioloop import PeriodicCallback
+from traitlets import (
+    Any,
+    Bool,
+    Dict,
+    Float,
+    Int,
+    List,
+    Set,
+    Unicode,
+    Union,
+    UseEnum,
+    default,
+    observe,
+    validate,
+)
+
+from . import metrics, tracing
+from .breaker import CLOSED, CircuitBreaker
+from .cache import TTLCache
+from .credentials import CredentialCache
+from .index import GroupIndex
+from .pool import ConnectionPool, ServerPool
+from .throttle import FailureThrottle
+from .tls import ReusableTls
+
+# the simple paged results control, RFC 2696
+PAGED_RESULTS_OID = "1.2.840.113556.1.4.319"
+# Active Directory's LDAP_MATCHING_RULE_IN_CHAIN, matching the ancestry of
+# entries, such as groups a member is nested in
+IN_CHAIN_RULE_OID = "1.2.840.113556.1.4.1941"
 
 
 class TlsStrategy(enum.Enum):
@@ -22,15 +69,468 @@ class TlsStrategy(enum.Enum):
     insecure = 3
 
 
+class Backend(enum.Enum):
+    """
+    Represents how LDAPAuthenticator interacts with the LDAP server without
+    blocking JupyterHub's event loop.
+    """
+
+    threads = 1
+    asyncio = 2
+
+
+class ServerPoolStrategy(enum.Enum):
+    """
+    Represents the order in which LDAPAuthenticator tries multiple LDAP servers
+    when connecting.
+    """
+
+    first = 1
+    round_robin = 2
+    random = 3
+
+
+class GroupLookupStrategy(enum.Enum):
+    """
+    Represents how LDAPAuthenticator determines which of the `allowed_groups` a
+    user is a member of.
+    """
+
+    per_group = 1
+    subtree = 2
+    member_of = 3
+
+
+class NestedGroupLookup(enum.Enum):
+    """
+    Represents how LDAPAuthenticator determines if a user is a member of the
+    `allowed_groups` through groups nested in them.
+    """
+
+    disabled = 1
+    in_chain = 2
+    walk = 3
+
+
+class _UnavailableError(web.HTTPError):
+    """
+    A 503 error refusing a login as the LDAP server is unavailable or too
+    slow, as opposed to the authenticator being too busy.
+    """
+
+    def __init__(self, log_message):
+        super().__init__(503, log_message)
+
+
+def split_dn(dn):
+    """
+    Splits a DN into a list of its RDNs, each normalized to be compared with
+    other RDNs by lowercasing attribute types and values and removing
+    insignificant whitespace.
+    """
+    rdns = []
+    rdn = ""
+    for attr_type, attr_value, separator in parse_dn(dn, escape=False, strip=True):
+        rdn += f"{attr_type.lower()}={attr_value.lower()}"
+        if separator == "+":
+            rdn += "+"
+        else:
+            rdns.append(rdn)
+            rdn = ""
+    return rdns
+
+
+def _union(*lists):
+    """
+    Returns the union of lists of attribute names, in order and without
+    duplicates regardless of case.
+    """
+    seen = set()
+    union = []
+    for name in (name for names in lists for name in names):
+        if name.lower() not in seen:
+            seen.add(name.lower())
+            union.append(name)
+    return union
+
+
+def normalize_dn(dn):
+    """
+    Returns a DN normalized to be compared with other DNs.
+    """
+    try:
+        return ",".join(split_dn(dn))
+    except LDAPInvalidDnError:
+        return dn.lower()
+
+
+def _check_search_result(conn, search):
+    """
+    Raises LDAPOperationResult if a search made with a connection failed, such
+    as with the server busy, so that it isn't taken for a search that found
+    no entries. A search whose base entry doesn't exist (noSuchObject) didn't
+    fail, it found no entries.
+    """
+    result = conn.result or {}
+    if result.get("result", RESULT_SUCCESS) in (RESULT_SUCCESS, RESULT_NO_SUCH_OBJECT):
+        return
+    raise LDAPOperationResult(
+        result=result["result"],
+        description=result.get("description"),
+        dn=search.get("search_base"),
+        message=result.get("message"),
+        response_type=result.get("type"),
+    )
+
+
+def _search_result(conn, search):
+    """
+    Returns what a searches generator is sent back for a search made with a
+    connection, see `LDAPAuthenticator._run_searches`.
+    """
+    if not search.get("paged_size"):
+        return conn.entries
+    controls = (conn.result or {}).get("controls") or {}
+    paged = controls.get(PAGED_RESULTS_OID) or {}
+    return conn.entries, (paged.get("value") or {}).get("cookie")
+
+
+def _any_filter(filters):
+    """
+    Returns a search filter matching any of the given filters.
+    """
+    if len(filters) == 1:
+        return filters[0]
+    return f"(|{''.join(filters)})"
+
+
+def _attribute_values(entry, name):
+    """
+    Returns the values of an entry's attribute, looked up regardless of case.
+    """
+    for key, values in entry.entry_attributes_as_dict.items():
+        if key.lower() == name.lower():
+            return values
+    return []
+
+
+def _unescape_dn_value(value):
+    """
+    Returns the value of an attribute in a DN string with its escaped
+    characters (`\\,` or `\\2c`) unescaped.
+    """
+    # hex escapes are of UTF-8 encoded bytes
+    unescaped = re.sub(
+        rb"\\([0-9a-fA-F]{2}|.)",
+        lambda m: bytes([int(m[1], 16)]) if len(m[1]) == 2 else m[1],
+        value.encode(),
+        flags=re.DOTALL,
+    )
+    return unescaped.decode(errors="replace")
+
+
+def _rdn_filter(dn):
+    """
+    Returns (parent_dn, search_filter) for a DN, where the search filter
+    matches the attribute values of the DN's RDN. Searching the parent with
+    scope LEVEL and this filter finds the entry, as an entry has the values of
+    its RDN as attributes. Raises LDAPInvalidDnError for an invalid DN.
+    """
+    components = parse_dn(dn, escape=False, strip=True)
+    assertions = []
+    for i, (attr_type, attr_value, separator) in enumerate(components):
+        value = escape_filter_chars(_unescape_dn_value(attr_value))
+        assertions.append(f"({attr_type}={value})")
+        if separator != "+":
+            break
+    parent = components[i + 1 :]
+    if not parent:
+        raise LDAPInvalidDnError(f"{dn} has no parent entry")
+    parent_dn = "".join(f"{t}={v}{s}" for t, v, s in parent)
+    if len(assertions) == 1:
+        return parent_dn, assertions[0]
+    return parent_dn, f"(&{''.join(assertions)})"
+
+
 class LDAPAuthenticator(Authenticator):
-    server_address = Unicode(
+    server_address = Union(
+        [Unicode(), List(Unicode())],
         config=True,
         help="""
         Address of the LDAP server to contact.
 
-        Could be an IP address or hostname.
+        Could be an IP address or hostname, or a list of them to fail over
+        between multiple LDAP servers, see `server_pool_strategy`.
+        """,
+    )
+
+    server_pool_strategy = UseEnum(
+        ServerPoolStrategy,
+        default_value=ServerPoolStrategy.first,
+        config=True,
+        help="""
+        Only used with multiple `server_address` entries.
+
+        The order in which servers are tried when connecting. Servers that are
+        down are skipped, and the next server is tried if a server can't be
+        connected to.
+
+        Supported `server_pool_strategy` values are:
+        - "first" (default), tries the servers in the order configured.
+        - "round_robin", spreads connections across the servers by starting
+          with the next server every time.
+        - "random", tries the servers in a random order.
+        """,
+    )
+
+    server_down_time = Int(
+        60,
+        config=True,
+        help="""
+        Only used with multiple `server_address` entries.
+
+        Number of seconds a server that couldn't be connected to is skipped
+        when connecting, unless a health check finds it reachable again
+        sooner. If all servers are down, all are tried anyway.
+        """,
+    )
+
+    server_health_check_interval = Int(
+        30,
+        config=True,
+        help="""
+        Only used with multiple `server_address` entries.
+
+        Number of seconds between background checks of whether the servers
+        accept connections, to mark servers down or up again before a login
+        attempts to use them.
+
+        Set to 0 to disable background health checks.
+        """,
+    )
+
+    server_health_check_timeout = Int(
+        5,
+        config=True,
+        help="""
+        Only used with `server_health_check_interval` configured.
+
+        Number of seconds to wait for a server to accept a connection before
+        marking it down during a health check.
+        """,
+    )
+
+    connect_timeout = Float(
+        10,
+        config=True,
+        help="""
+        Number of seconds to wait for an LDAP server to accept a connection
+        before giving up on it, and trying the next server if there are
+        multiple `server_address` entries.
+
+        Set to 0 to wait as long as the operating system allows.
+        """,
+    )
+
+    receive_timeout = Float(
+        30,
+        config=True,
+        help="""
+        Number of seconds to wait for an LDAP server to respond to an
+        operation, such as a bind or a search, before giving up on it and
+        closing the connection. A login waiting for an operation that times out
+        fails with an error.
+
+        Set to 0 to wait indefinitely.
+        """,
+    )
+
+    login_timeout = Float(
+        0,
+        config=True,
+        help="""
+        Number of seconds a login may take in total, across connecting,
+        binding, and all the searches made. When a login takes longer, the
+        rest of its work is cancelled, its connections are closed, and the
+        login fails with a 503 error asking the user to try again later.
+
+        With `backend="threads"`, an LDAP operation already running in the
+        executor when the login times out isn't interrupted, but it completes
+        or times out by `receive_timeout` in the background.
+
+        Set to 0 (default) to not limit the time of logins beyond the
+        timeouts of individual operations.
+        """,
+    )
+
+    circuit_breaker_threshold = Int(
+        0,
+        config=True,
+        help="""
+        Number of consecutive times connecting to the LDAP server has to fail,
+        with every `server_address` entry failing, for the LDAP server to be
+        considered unavailable. Connecting fails if the server can't be
+        reached, or doesn't respond within `receive_timeout`. While
+        unavailable, logins fail right away with a 503 error asking the user
+        to try again later, instead of each of them waiting for the connection
+        attempts to fail.
+
+        After `circuit_breaker_cooldown`, the servers are probed in the
+        background until one of them accepts connections again, and logins
+        are let through again as soon as one does.
+
+        Set to 0 (default) to not consider the LDAP server unavailable.
+        """,
+    )
+
+    circuit_breaker_cooldown = Int(
+        30,
+        config=True,
+        help="""
+        Only used with `circuit_breaker_threshold` configured.
+
+        Number of seconds to wait after the LDAP server has been considered
+        unavailable, or after a probe found it still unavailable, before
+        probing it again.
+        """,
+    )
+
+    _circuit_breaker = Any()
+
+    @default("_circuit_breaker")
+    def _default_circuit_breaker(self):
+        return CircuitBreaker(
+            self.circuit_breaker_threshold, self.circuit_breaker_cooldown
+        )
+
+    _circuit_breaker_probe = Any(None, allow_none=True)
+
+    @observe("circuit_breaker_threshold", "circuit_breaker_cooldown")
+    def _reset_circuit_breaker(self, change):
+        self._circuit_breaker = self._default_circuit_breaker()
+
+    def _check_circuit_breaker(self):
+        """
+        Raises a 503 error if the LDAP server is considered unavailable, making
+        sure it is being probed in the background.
+        """
+        breaker = self._circuit_breaker
+        if breaker.state == CLOSED:
+            return
+        if self._circuit_breaker_probe is None or self._circuit_breaker_probe.done():
+            self._circuit_breaker_probe = self._run_in_background(
+                self._probe_circuit_breaker(breaker)
+            )
+        raise _UnavailableError(
+            "The LDAP server is unavailable, please try again later."
+        )
+
+    async def _probe_circuit_breaker(self, breaker):
+        """
+        Probes the LDAP servers whenever the breaker's cooldown has passed,
+        until one accepts connections, closing the breaker.
+        """
+        while breaker.state != CLOSED:
+            await asyncio.sleep(breaker.retry_after())
+            if not breaker.half_open():
+                continue
+            if await self._check_servers_health():
+                self.log.info("LDAP server is available again")
+                breaker.succeeded()
+            else:
+                breaker.failed()
+
+    credential_cache_ttl = Int(
+        0,
+        config=True,
+        help="""
+        Number of seconds to remember logins verified with the LDAP server, so
+        that logging in again with the same username and password within that
+        time is accepted without contacting the LDAP server, returning the
+        same auth model, with the same `ldap_groups` and `user_attributes`.
+
+        Passwords are only remembered as slow salted hashes (scrypt), held in
+        memory. Logins with a different password, such as a new one, are
+        verified with the LDAP server as usual. Changes in the LDAP server,
+        such as a changed password, a disabled account, or removed group
+        memberships, are only picked up by the user's logins once the login
+        has expired, so keep this short.
+
+        Set to 0 (default) to not remember logins.
+        """,
+    )
+
+    credential_cache_size = Int(
+        1000,
+        config=True,
+        help="""
+        Only used with `credential_cache_ttl` configured.
+
+        Maximum number of logins to remember. When full, the least recently
+        used login is forgotten.
+        """,
+    )
+
+    credential_cache_outage_grace = Int(
+        0,
+        config=True,
+        help="""
+        Only used with `credential_cache_ttl` configured.
+
+        Number of seconds after `credential_cache_ttl` that remembered logins
+        are still accepted if the LDAP server can't be reached to verify them,
+        or is too slow to respond within `login_timeout`, so that users that
+        logged in recently can keep logging in through a short outage of the
+        LDAP server. Logins refused as too many are in progress, per
+        `executor_queue_size`, aren't an outage.
+
+        Set to 0 (default) to not accept remembered logins past
+        `credential_cache_ttl`.
         """,
     )
+
+    _credential_cache = Any()
+
+    @default("_credential_cache")
+    def _default_credential_cache(self):
+        return CredentialCache(
+            maxsize=self.credential_cache_size,
+            ttl=self.credential_cache_ttl,
+            grace=self.credential_cache_outage_grace,
+        )
+
+    @observe(
+        "credential_cache_ttl",
+        "credential_cache_size",
+        "credential_cache_outage_grace",
+        "bind_dn_template",
+        "lookup_dn",
+        "use_lookup_dn_username",
+        "allowed_groups",
+        "auth_state_attributes",
+    )
+    def _reset_credential_cache(self, change):
+        self._credential_cache = self._default_credential_cache()
+
+    def invalidate_credential_cache(self, username=None):
+        """
+        Forgets the remembered logins of the given login username, or of all
+        users if no username is given.
+        """
+        if username is None:
+            self._credential_cache.clear()
+        else:
+            self._credential_cache.pop(username)
+
+    def _get_cached_login(self, data, outage=False):
+        """
+        Returns the remembered auth model of a login, see
+        `credential_cache_ttl`, or None.
+        """
+        result = self._credential_cache.get(data["username"], data["password"], outage)
+        metrics.cache_lookup(metrics.Cache.credential, result is not None)
+        return result
+
     server_port = Int(
         config=True,
         help="""
@@ -165,6 +665,68 @@ class LDAPAuthenticator(Authenticator):
                 "bind_dn_template to be configured"
             )
 
+    bind_dn_template_cache_size = Int(
+        0,
+        config=True,
+        help="""
+        Only used with multiple `bind_dn_template` entries.
+
+        Maximum number of users to remember the `bind_dn_template` entry of
+        their last successful login for, trying that entry first the next time
+        they log in. When full, the least recently used entry is evicted.
+
+        With users spread over multiple organizational units, this saves the
+        failed binds (each establishing a connection to the LDAP server) with
+        the templates preceding the matching one.
+
+        Set to 0 (default) to disable remembering the templates.
+        """,
+    )
+
+    bind_dn_template_reorder = Bool(
+        False,
+        config=True,
+        help="""
+        Only used with multiple `bind_dn_template` entries.
+
+        Try the `bind_dn_template` entries in the order of how many logins
+        succeeded with them so far, instead of in the configured order, for
+        users that have no remembered template (see
+        `bind_dn_template_cache_size`).
+
+        If a username can be bound with multiple templates, which DN the user
+        is bound with can change when the order does.
+        """,
+    )
+
+    bind_dn_template_concurrent = Bool(
+        False,
+        config=True,
+        help="""
+        Only used with more than two `bind_dn_template` entries.
+
+        If binding with the first `bind_dn_template` entry fails, try binding
+        with all the remaining entries concurrently, using the first bind that
+        succeeds, instead of trying them one after another. This shortens
+        logins of users matching the last templates, at the cost of binding
+        concurrently with the LDAP server.
+        """,
+    )
+
+    _bind_dn_template_cache = Any()
+
+    @default("_bind_dn_template_cache")
+    def _default_bind_dn_template_cache(self):
+        return TTLCache(maxsize=self.bind_dn_template_cache_size)
+
+    # bind_dn_template entry -> number of logins bound with it
+    _bind_dn_template_successes = Dict()
+
+    @observe("bind_dn_template", "bind_dn_template_cache_size")
+    def _reset_bind_dn_template_cache(self, change):
+        self._bind_dn_template_cache = self._default_bind_dn_template_cache()
+        self._bind_dn_template_successes = {}
+
     allowed_groups = List(
         config=True,
         allow_none=True,
@@ -204,81 +766,460 @@ class LDAPAuthenticator(Authenticator):
         help="List of attributes in the LDAP group to be searched",
     )
 
-    @observe("allowed_groups", "group_search_filter", "group_attributes")
-    def _ensure_allowed_groups_requirements(self, change):
-        if not self.allowed_groups:
-            return
-        if not self.group_search_filter or not self.group_attributes:
-            raise ValueError(
-                "LDAPAuthenticator.allowed_groups requires both "
-                "group_search_filter and group_attributes to be configured"
-            )
-
-    valid_username_regex = Unicode(
-        r"^[a-z][.a-z0-9_-]*$",
+    group_lookup_strategy = UseEnum(
+        GroupLookupStrategy,
+        default_value=GroupLookupStrategy.per_group,
         config=True,
         help="""
-        Regex for validating usernames - those that do not match this regex will
-        be rejected.
-
-        This config was primarily introduced to prevent LDAP injection
-        (https://www.owasp.org/index.php/LDAP_injection), but that is since 2.0
-        being mitigated by escaping all sensitive characters when interacting
-        with the LDAP server.
+        How to determine which of the `allowed_groups` a user is a member of.
+
+        Supported `group_lookup_strategy` values are:
+        - "per_group" (default), one search per group in `allowed_groups`,
+          checking the group against `group_search_filter`.
+        - "subtree", a single search under `group_search_base` for groups
+          matching `group_search_filter`, whose DNs are then compared to
+          `allowed_groups`.
+        - "member_of", a single read of the user's `member_of_attribute`
+          (requires a server maintaining it, such as Active Directory or
+          OpenLDAP with the memberof overlay), whose values are then compared
+          to `allowed_groups`.
+
+        With "subtree" and "member_of", the number of round trips to the LDAP
+        server doesn't grow with the number of `allowed_groups`.
         """,
     )
 
-    lookup_dn = Bool(
-        False,
+    group_search_base = Unicode(
         config=True,
+        default_value=None,
+        allow_none=True,
         help="""
-        Form user's DN by looking up an entry from directory
+        Only used with `group_lookup_strategy="subtree"`.
 
-        By default, LDAPAuthenticator finds the user's DN by using `bind_dn_template`.
-        However, in some installations, the user's DN does not contain the username, and
-        hence needs to be looked up. You can set this to True and then use `user_search_base`
-        and `user_attribute` to accomplish this.
+        The search base for groups. Defaults to the closest common ancestor of
+        the entries in `allowed_groups`.
         """,
     )
 
-    user_search_base = Unicode(
+    member_of_attribute = Unicode(
+        "memberOf",
         config=True,
-        default_value=None,
-        allow_none=True,
         help="""
-        Only used with `lookup_dn=True` or with a configured `search_filter`.
-
-        Defines the search base for looking up users in the directory.
+        Only used with `group_lookup_strategy="member_of"`.
 
-        ```python
-        c.LDAPAuthenticator.user_search_base = 'ou=People,dc=example,dc=com'
-        ```
+        The user attribute listing the DNs of the groups the user is a member
+        of.
+        """,
+    )
 
-        LDAPAuthenticator will search all objects under this base where
-        the `user_attribute` is set to the current username to form the userdn.
+    nested_group_lookup = UseEnum(
+        NestedGroupLookup,
+        default_value=NestedGroupLookup.disabled,
+        config=True,
+        help="""
+        How to determine if a user is a member of the `allowed_groups` through
+        groups nested in them, not only as a direct member.
+
+        Supported `nested_group_lookup` values are:
+        - "disabled" (default), only direct members of the `allowed_groups`
+          are members.
+        - "in_chain", lets the LDAP server match the chain of nested groups
+          with the LDAP_MATCHING_RULE_IN_CHAIN extensible match rule of Active
+          Directory, following the groups' `member` attribute or, with
+          `group_lookup_strategy="member_of"`, the user's
+          `member_of_attribute`. The searches made are the same as for direct
+          members.
+        - "walk", for servers without that rule, finds the groups the user is
+          a direct member of, and then the groups those groups are members
+          of, and so on. The groups a group is a direct member of are cached
+          for `nested_group_cache_ttl`, so that logins of users sharing the
+          same groups search the LDAP server for them only once. With
+          `group_lookup_strategy="member_of"`, groups are read like users, by
+          their `member_of_attribute`. Otherwise, groups are searched for under
+          `group_search_base` with `nested_group_search_filter`.
+        """,
+    )
 
-        For example, if all users objects existed under the base
-        `ou=people,dc=wikimedia,dc=org`, the username is set with
-        the attribute `uid`, you can use the following config:
+    nested_group_search_filter = Unicode(
+        "(|(member={groupdn})(uniqueMember={groupdn}))",
+        config=True,
+        help="""
+        Only used with `nested_group_lookup="walk"`, and a
+        `group_lookup_strategy` other than "member_of".
 
-        ```python
-        c.LDAPAuthenticator.lookup_dn = True
-        c.LDAPAuthenticator.lookup_dn_search_filter = '({login_attr}={login})'
-        c.LDAPAuthenticator.lookup_dn_search_user = 'ldap_search_user_technical_account'
-        c.LDAPAuthenticator.lookup_dn_search_password = 'secret'
-        c.LDAPAuthenticator.user_search_base = 'ou=people,dc=wikimedia,dc=org'
-        c.LDAPAuthenticator.user_attribute = 'uid'
-        c.LDAPAuthenticator.lookup_dn_user_dn_attribute = 'sAMAccountName'
-        ```
+        The search filter template used to locate the groups that a group is
+        a direct member of. `{groupdn}` will be replaced with the group's DN.
         """,
     )
 
-    user_attribute = Unicode(
+    nested_group_max_depth = Int(
+        10,
         config=True,
-        default_value=None,
-        allow_none=True,
         help="""
-        Only used with `lookup_dn=True` or with a configured `search_filter`.
+        Only used with `nested_group_lookup="walk"`.
+
+        Maximum number of levels of nested groups to follow from the groups a
+        user is a direct member of.
+        """,
+    )
+
+    nested_group_cache_ttl = Int(
+        300,
+        config=True,
+        help="""
+        Only used with `nested_group_lookup="walk"`.
+
+        Number of seconds to cache the groups that a group is a direct member
+        of. Changes to nested groups in the LDAP server are not picked up by
+        logins until the cached entry expires, see also
+        `invalidate_group_cache`.
+
+        Set to 0 to not cache nested groups, searching for them on every
+        login.
+        """,
+    )
+
+    nested_group_cache_size = Int(
+        10000,
+        config=True,
+        help="""
+        Only used with `nested_group_lookup="walk"` and `nested_group_cache_ttl`
+        configured.
+
+        Maximum number of groups to cache the parent groups of. When full, the
+        least recently used entry is evicted.
+        """,
+    )
+
+    # normalized group DN -> DNs of the groups it is a direct member of
+    _group_parents_cache = Any()
+
+    @default("_group_parents_cache")
+    def _default_group_parents_cache(self):
+        return TTLCache(
+            maxsize=self.nested_group_cache_size, ttl=self.nested_group_cache_ttl
+        )
+
+    @observe(
+        "group_lookup_strategy",
+        "group_search_base",
+        "member_of_attribute",
+        "nested_group_lookup",
+        "nested_group_search_filter",
+        "nested_group_cache_ttl",
+        "nested_group_cache_size",
+    )
+    def _reset_group_parents_cache(self, change):
+        self._group_parents_cache = self._default_group_parents_cache()
+
+    group_cache_ttl = Int(
+        0,
+        config=True,
+        help="""
+        Number of seconds to cache which of the `allowed_groups` a user is a
+        member of, saving the group lookup when the user logs in again within
+        that time. Group membership changes in the LDAP server are not picked
+        up by logins until the cached entry expires, see also
+        `invalidate_group_cache`.
+
+        Only the group lookup is cached, the user's credentials are always
+        verified with the LDAP server.
+
+        Set to 0 (default) to disable caching.
+        """,
+    )
+
+    group_cache_size = Int(
+        1000,
+        config=True,
+        help="""
+        Only used with `group_cache_ttl` configured.
+
+        Maximum number of users to cache group memberships for. When full, the
+        least recently used entry is evicted.
+        """,
+    )
+
+    _group_cache = Any()
+
+    @default("_group_cache")
+    def _default_group_cache(self):
+        return TTLCache(maxsize=self.group_cache_size, ttl=self.group_cache_ttl)
+
+    @observe(
+        "allowed_groups",
+        "group_search_filter",
+        "group_lookup_strategy",
+        "group_search_base",
+        "member_of_attribute",
+        "nested_group_lookup",
+        "nested_group_search_filter",
+        "nested_group_max_depth",
+        "group_cache_ttl",
+        "group_cache_size",
+    )
+    def _reset_group_cache(self, change):
+        self._group_cache = self._default_group_cache()
+
+    def invalidate_group_cache(self, userdn=None):
+        """
+        Forgets the cached group memberships of the user with the given DN, or
+        of all users, and the cached nested groups, if no DN is given.
+        """
+        if userdn is None:
+            self._group_cache.clear()
+            self._group_parents_cache.clear()
+        else:
+            self._group_cache.pop(normalize_dn(userdn))
+
+    group_index_interval = Int(
+        0,
+        config=True,
+        help="""
+        Number of seconds between reading the members of all `allowed_groups`
+        in the background, to determine which of them a user is a member of
+        from an in-memory index instead of searching the LDAP server during
+        login. Until the index has been built, and when it couldn't be rebuilt
+        for three intervals, groups are searched as usual.
+
+        The index is built with a connection bound as `lookup_dn_search_user`
+        (anonymously if not configured), which needs to be allowed to read
+        the groups. With `group_lookup_strategy="member_of"`, the members are
+        the entries under `user_search_base` listing a group with their
+        `member_of_attribute`, found with paged searches. Otherwise, the
+        members are the values of the groups' `group_attributes`, compared to
+        the user's DN and uid like the default `group_search_filter` does, and
+        `group_search_filter` isn't used.
+
+        Group membership changes in the LDAP server are picked up by logins
+        once the index has been rebuilt.
+
+        Members of groups nested in the `allowed_groups` aren't indexed, so
+        the index isn't used with `nested_group_lookup` configured.
+
+        Set to 0 (default) to not build an index.
+        """,
+    )
+
+    group_index_page_size = Int(
+        1000,
+        config=True,
+        help="""
+        Only used with `group_index_interval` configured.
+
+        Number of entries requested per page, with the simple paged results
+        control (RFC 2696), when searching for the members of a group.
+        """,
+    )
+
+    _group_index = Any(None, allow_none=True)
+    _group_index_refresh = Any(None, allow_none=True)
+
+    @observe(
+        "allowed_groups",
+        "group_attributes",
+        "group_lookup_strategy",
+        "member_of_attribute",
+        "user_search_base",
+        "group_index_interval",
+        "group_index_page_size",
+        "nested_group_lookup",
+    )
+    def _reset_group_index(self, change):
+        if self._group_index_refresh is not None:
+            self._group_index_refresh.stop()
+            self._group_index_refresh = None
+        self._group_index = None
+
+    def _start_group_index_refresh(self):
+        """
+        Starts building the allowed_groups member index in the background, if
+        configured.
+        """
+        if self._group_index_refresh is not None:
+            return
+        if self.group_index_interval <= 0 or not self.allowed_groups:
+            return
+        if self.nested_group_lookup != NestedGroupLookup.disabled:
+            return
+        self._group_index_refresh = PeriodicCallback(
+            self._build_group_index, 1e3 * self.group_index_interval
+        )
+        self._group_index_refresh.start()
+        # build the first index right away instead of after an interval
+        self._run_in_background(self._build_group_index())
+
+    def _get_group_index(self):
+        """
+        Returns the allowed_groups member index if one has been built recently
+        enough to be used, or None.
+        """
+        index = self._group_index
+        if index is None or index.groups != tuple(self.allowed_groups):
+            return None
+        if time.monotonic() - index.created > 3 * self.group_index_interval:
+            return None
+        return index
+
+    async def _build_group_index(self):
+        """
+        Builds the allowed_groups member index and replaces the previous index
+        with it, unless building it failed, such as with a search answered with
+        an error, which would leave a group's members out of the index.
+        """
+        try:
+            index = await self._run_service_searches_async(
+                self._group_index_searches, metrics.SearchPhase.group_index
+            )
+        except Exception as e:
+            self.log.error(f"Failed to build the allowed_groups member index: {e}")
+            return
+        if index is None or index.groups != tuple(self.allowed_groups):
+            return
+        self._group_index = index
+        self.log.debug(
+            f"Indexed {len(index)} members of {len(index.groups)} allowed_groups"
+        )
+
+    def _group_index_searches(self):
+        """
+        Generator yielding the searches reading the members of the
+        `allowed_groups`, see `_run_searches`, and returning them as a
+        GroupIndex. Members are added to the index page by page, so that the
+        entries of a large group aren't all held at once.
+        """
+        index = GroupIndex(self.allowed_groups)
+        member_of = self.group_lookup_strategy == GroupLookupStrategy.member_of
+        if member_of and not self.user_search_base:
+            raise ValueError(
+                'group_lookup_strategy="member_of" requires user_search_base to '
+                "build the allowed_groups member index"
+            )
+        for position, group in enumerate(index.groups):
+            if member_of:
+                search_filter = (
+                    f"({self.member_of_attribute}={escape_filter_chars(group)})"
+                )
+                cookie = None
+                while True:
+                    entries, cookie = yield dict(
+                        search_base=self.user_search_base,
+                        search_scope=ldap3.SUBTREE,
+                        search_filter=search_filter,
+                        attributes=ldap3.NO_ATTRIBUTES,
+                        paged_size=self.group_index_page_size,
+                        paged_cookie=cookie,
+                    )
+                    for entry in entries:
+                        index.add_dn(position, normalize_dn(entry.entry_dn))
+                    if not cookie:
+                        break
+                continue
+
+            attributes = list(self.group_attributes)
+            while attributes:
+                entries = yield dict(
+                    search_base=group,
+                    search_scope=ldap3.BASE,
+                    search_filter="(objectClass=*)",
+                    attributes=attributes,
+                )
+                if not entries:
+                    self.log.warning(f"allowed_groups entry {group} wasn't found")
+                    break
+                attributes = []
+                for name, values in entries[0].entry_attributes_as_dict.items():
+                    for value in values:
+                        if not isinstance(value, str):
+                            continue
+                        try:
+                            index.add_dn(position, ",".join(split_dn(value)))
+                        except LDAPInvalidDnError:
+                            index.add_uid(position, value)
+                    # servers like Active Directory return the values of large
+                    # attributes in ranges, "member;range=0-1499", until the
+                    # last range, "member;range=1500-*"
+                    name, _, value_range = name.partition(";range=")
+                    end = value_range.rpartition("-")[2]
+                    if end.isdigit():
+                        attributes.append(f"{name};range={int(end) + 1}-*")
+        return index
+
+    @observe("allowed_groups", "group_search_filter", "group_attributes")
+    def _ensure_allowed_groups_requirements(self, change):
+        if not self.allowed_groups:
+            return
+        if not self.group_search_filter or not self.group_attributes:
+            raise ValueError(
+                "LDAPAuthenticator.allowed_groups requires both "
+                "group_search_filter and group_attributes to be configured"
+            )
+
+    valid_username_regex = Unicode(
+        r"^[a-z][.a-z0-9_-]*$",
+        config=True,
+        help="""
+        Regex for validating usernames - those that do not match this regex will
+        be rejected.
+
+        This config was primarily introduced to prevent LDAP injection
+        (https://www.owasp.org/index.php/LDAP_injection), but that is since 2.0
+        being mitigated by escaping all sensitive characters when interacting
+        with the LDAP server.
+        """,
+    )
+
+    lookup_dn = Bool(
+        False,
+        config=True,
+        help="""
+        Form user's DN by looking up an entry from directory
+
+        By default, LDAPAuthenticator finds the user's DN by using `bind_dn_template`.
+        However, in some installations, the user's DN does not contain the username, and
+        hence needs to be looked up. You can set this to True and then use `user_search_base`
+        and `user_attribute` to accomplish this.
+        """,
+    )
+
+    user_search_base = Unicode(
+        config=True,
+        default_value=None,
+        allow_none=True,
+        help="""
+        Only used with `lookup_dn=True` or with a configured `search_filter`.
+
+        Defines the search base for looking up users in the directory.
+
+        ```python
+        c.LDAPAuthenticator.user_search_base = 'ou=People,dc=example,dc=com'
+        ```
+
+        LDAPAuthenticator will search all objects under this base where
+        the `user_attribute` is set to the current username to form the userdn.
+
+        For example, if all users objects existed under the base
+        `ou=people,dc=wikimedia,dc=org`, the username is set with
+        the attribute `uid`, you can use the following config:
+
+        ```python
+        c.LDAPAuthenticator.lookup_dn = True
+        c.LDAPAuthenticator.lookup_dn_search_filter = '({login_attr}={login})'
+        c.LDAPAuthenticator.lookup_dn_search_user = 'ldap_search_user_technical_account'
+        c.LDAPAuthenticator.lookup_dn_search_password = 'secret'
+        c.LDAPAuthenticator.user_search_base = 'ou=people,dc=wikimedia,dc=org'
+        c.LDAPAuthenticator.user_attribute = 'uid'
+        c.LDAPAuthenticator.lookup_dn_user_dn_attribute = 'sAMAccountName'
+        ```
+        """,
+    )
+
+    user_attribute = Unicode(
+        config=True,
+        default_value=None,
+        allow_none=True,
+        help="""
+        Only used with `lookup_dn=True` or with a configured `search_filter`.
 
         Together with `user_search_base`, this attribute will be searched to
         contain the username provided by the user in JupyterHub's login form.
@@ -391,6 +1332,23 @@ class LDAPAuthenticator(Authenticator):
         List of user attributes to be returned in auth_state
 
         Will be available in `auth_state["user_attributes"]`
+
+        `*` requests all user attributes, and `+` all operational attributes.
+        These are read with a separate search for the user's entry, instead
+        of with the searches reading other attributes as well.
+        """,
+    )
+
+    lookup_dn_fetch_auth_state_attributes = Bool(
+        False,
+        config=True,
+        help="""
+        Only used with `lookup_dn=True` and `auth_state_attributes` configured.
+
+        If configured True, `auth_state_attributes` are fetched as part of the
+        search looking up the user's DN, instead of with a separate search
+        after the user has been bound. Note that the attributes are then read
+        with the permissions of `lookup_dn_search_user` instead of the user's.
         """,
     )
 
@@ -413,165 +1371,1822 @@ class LDAPAuthenticator(Authenticator):
         """,
     )
 
-    def resolve_username(self, username_supplied_by_user):
-        """
-        Resolves a username (that could be used to construct a DN through a
-        template), and a DN, based on a username supplied by a user via a login
-        prompt in JupyterHub.
+    refresh_user_interval = Int(
+        0,
+        config=True,
+        help="""
+        Number of seconds after which a user's `ldap_groups` and
+        `user_attributes` in `auth_state` are read again from the LDAP server
+        when JupyterHub refreshes the user, without the user logging in again.
+        A user removed from the `allowed_groups`, or from the LDAP server, has
+        to log in again, which denies access.
+
+        The user's entry is read with a connection bound as
+        `lookup_dn_search_user` (anonymously if not configured), which needs
+        to be allowed to read the entries of users and groups. The user's DN is
+        kept in `auth_state["user_dn"]`, so `Authenticator.enable_auth_state`
+        is required, and users are only refreshed once logged in with a
+        version of LDAPAuthenticator storing it. `search_filter` isn't
+        evaluated again.
+
+        JupyterHub refreshes users at most every `Authenticator.auth_refresh_age`
+        seconds (default 300), so shorter intervals have no effect.
+
+        Set to 0 (default) to not refresh users.
+        """,
+    )
 
-        Returns (username, userdn) if found, or (None, None) if an error occurred,
-        or if `username_supplied_by_user` does not correspond to a unique user.
-        """
-        conn = self.get_connection(
-            userdn=self.lookup_dn_search_user,
-            password=self.lookup_dn_search_password,
-        )
-        if not conn:
-            self.log.error(
-                f"Failed to bind lookup_dn_search_user '{self.lookup_dn_search_user}'"
-            )
-            return (None, None)
+    refresh_user_batch_size = Int(
+        50,
+        config=True,
+        help="""
+        Only used with `refresh_user_interval` configured.
 
-        search_filter = self.lookup_dn_search_filter.format(
-            # A search filter matching against string literals, should
-            # have the string literals escaped with escape_filter_chars.
-            # Escaped characters are `/()*` (and null).
-            #
-            # ref: https://datatracker.ietf.org/doc/html/rfc4515#section-3
-            # ref: https://ldap3.readthedocs.io/en/latest/searches.html?highlight=escape_filter_chars
-            #
-            login_attr=self.user_attribute,
-            login=escape_filter_chars(username_supplied_by_user),
-        )
-        self.log.debug(
-            "Looking up user with:\n"
-            f"    search_base = '{self.user_search_base}'\n"
-            f"    search_filter = '{search_filter}'\n"
-            f"    attributes = '[{self.lookup_dn_user_dn_attribute}]'"
-        )
-        conn.search(
-            search_base=self.user_search_base,
-            search_scope=ldap3.SUBTREE,
-            search_filter=search_filter,
-            attributes=[self.lookup_dn_user_dn_attribute],
-        )
+        Maximum number of users refreshed together, with combined searches
+        reading the entries of all the users under the same parent entry, and
+        the groups of all the users, at once.
+        """,
+    )
 
-        # identify unique search response entry
-        n_entries = len(conn.entries)
-        if n_entries == 0:
-            self.log.warning(f"No response looking up '{username_supplied_by_user}'")
-            return (None, None)
-        if n_entries > 1:
-            self.log.error(
-                f"Looking up '{username_supplied_by_user}' gave multiple entries, "
-                f"expected 0 or 1 search response entries but received {n_entries}. "
-                "Is lookup_dn_search_filter and user_attribute configured to get a "
-                "unique match?"
-            )
-            return (None, None)
-        entry = conn.entries[0]
+    refresh_user_batch_delay = Float(
+        0.1,
+        config=True,
+        help="""
+        Only used with `refresh_user_interval` configured.
 
-        # identify unique attribute value within the entry
-        attribute_values = entry.entry_attributes_as_dict.get(
-            self.lookup_dn_user_dn_attribute
-        )
-        if not attribute_values:
-            if attribute_values is None:
-                self.log.error(
-                    f"No attribute '{self.lookup_dn_user_dn_attribute}' found. "
-                    "Is lookup_dn_user_dn_attribute configured correctly?"
-                )
-            else:
-                self.log.error(
-                    f"No attribute values for '{self.lookup_dn_user_dn_attribute}'. "
-                    "Is lookup_dn_user_dn_attribute configured correctly?"
-                )
-            return (None, None)
-        if len(attribute_values) > 1:
-            self.log.error(
-                f"Attribute '{self.lookup_dn_user_dn_attribute}' had multiple values, "
-                f"expected one attribute value but it had {len(attribute_values)} "
-                f"({';'.join(attribute_values)}). "
-                "Is lookup_dn_user_dn_attribute configured correctly?"
-            )
-            return None, None
+        Number of seconds to wait for other users to refresh before refreshing
+        a user, so that the refreshes of active users are batched together.
+        """,
+    )
 
-        userdn = entry.entry_dn
-        username = attribute_values[0]
-        return (username, userdn)
+    _refreshed_users = Any()
 
-    def get_connection(self, userdn, password):
-        """
-        Returns either an ldap3 Connection object automatically bound to the
-        user, or None if the bind operation failed for some reason.
+    @default("_refreshed_users")
+    def _default_refreshed_users(self):
+        # usernames refreshed (or logged in) within refresh_user_interval,
+        # evicting one just makes it be refreshed early
+        return TTLCache(maxsize=100000, ttl=self.refresh_user_interval)
 
-        Raises errors on connectivity or TLS issues.
+    @observe("refresh_user_interval")
+    def _reset_refreshed_users(self, change):
+        self._refreshed_users = self._default_refreshed_users()
 
-        ldap3 Connection ref:
-        - docs: https://ldap3.readthedocs.io/en/latest/connection.html
+    # normalized user DN -> (user DN, uid, future) of the refreshes to batch
+    _refresh_pending = Dict()
+    _refresh_flush = Any()
+
+    backend = UseEnum(
+        Backend,
+        default_value=Backend.threads,
+        config=True,
+        help="""
+        How LDAP operations (connecting, binding, searching) are performed
+        without blocking JupyterHub's event loop.
+
+        Supported `backend` values are:
+        - "threads" (default), runs the ldap3 package's blocking operations in
+          a pool of `executor_threads` threads, limiting the number of logins
+          talking to the LDAP server concurrently to the number of threads.
+        - "asyncio", runs the operations on JupyterHub's event loop with a
+          minimal asyncio LDAP client built on the ldap3 package's protocol
+          implementation, so that any number of logins can await the LDAP
+          server concurrently without occupying a thread each.
+
+        With "asyncio", TLS sessions aren't resumed, attribute values in
+        `auth_state` aren't formatted according to the LDAP server's schema
+        (they are strings, or bytes if not UTF-8), and the methods
+        `get_connection`, `resolve_username`, `get_ldap_groups` and
+        `get_user_attributes` aren't called, so overriding them in a subclass
+        has no effect. `executor_threads` and `executor_queue_size` only apply
+        to "threads".
+        """,
+    )
+
+    executor = Any(
+        help="""
+        The executor in which blocking ldap3 operations are run, so that slow
+        LDAP round trips don't block JupyterHub's event loop.
+
+        Defaults to a ThreadPoolExecutor with `executor_threads` threads.
+        """,
+    )
+
+    def _executor_default(self):
+        return ThreadPoolExecutor(
+            self.executor_threads, thread_name_prefix="ldapauthenticator"
+        )
+
+    executor_threads = Int(
+        4,
+        config=True,
+        help="""
+        Number of threads used to run blocking LDAP operations (connecting,
+        binding, searching) outside of JupyterHub's event loop. This is also
+        the number of logins that can talk to the LDAP server concurrently.
+
+        Set to 0 to run LDAP operations directly on the event loop, which was
+        the behavior before this option was introduced.
+        """,
+    )
+
+    executor_queue_size = Int(
+        0,
+        config=True,
+        help="""
+        Maximum number of logins allowed to wait for a free executor thread
+        when all `executor_threads` are busy. Logins beyond that are refused
+        with a "503 Service Unavailable" response instead of piling up.
+
+        Set to 0 (default) to not limit the number of waiting logins.
+        """,
+    )
+
+    _pending_logins = 0
+
+    login_throttle_user_burst = Int(
+        0,
+        config=True,
+        help="""
+        Number of failed logins allowed per username before further logins
+        with that username are refused with a "429 Too Many Requests" response,
+        without contacting the LDAP server. One more failed login is allowed
+        every `login_throttle_interval` seconds, and a successful login resets
+        the count. Logins in progress count as failed until they complete, so
+        that concurrent logins can't get past the limit.
+
+        Every time the allowed failed logins are used up again, the username
+        is refused for twice as long as the previous time, starting with
+        `login_throttle_interval` and up to `login_throttle_max_backoff`
+        seconds.
+
+        This protects the LDAP server from password guessing, and accounts
+        from being locked by the LDAP server's own lockout policy.
+
+        Set to 0 (default) to not throttle failed logins per username.
+        """,
+    )
+
+    login_throttle_ip_burst = Int(
+        0,
+        config=True,
+        help="""
+        Like `login_throttle_user_burst`, the number of failed logins allowed
+        per client IP address, regardless of the usernames tried. Successful
+        logins don't reset the count.
+
+        The client IP is the one determined by JupyterHub, which takes the
+        `X-Forwarded-For` header set by a proxy in front of it into account.
+
+        Set to 0 (default) to not throttle failed logins per client IP.
+        """,
+    )
+
+    login_throttle_interval = Int(
+        60,
+        config=True,
+        help="""
+        Only used with `login_throttle_user_burst` or `login_throttle_ip_burst`
+        configured.
+
+        Number of seconds after which one more failed login is allowed again,
+        and for which logins are first refused when the allowed failed logins
+        are used up.
+        """,
+    )
+
+    login_throttle_max_backoff = Int(
+        3600,
+        config=True,
+        help="""
+        Only used with `login_throttle_user_burst` or `login_throttle_ip_burst`
+        configured.
+
+        Maximum number of seconds logins are refused for after the allowed
+        failed logins were used up repeatedly.
+        """,
+    )
+
+    login_throttle_size = Int(
+        10000,
+        config=True,
+        help="""
+        Only used with `login_throttle_user_burst` or `login_throttle_ip_burst`
+        configured.
+
+        Maximum number of usernames, and of client IPs, to keep track of failed
+        logins for. When full, the least recently failed one is forgotten.
+        """,
+    )
+
+    _user_throttle = Any()
+    _ip_throttle = Any()
+
+    @default("_user_throttle")
+    def _default_user_throttle(self):
+        return FailureThrottle(
+            burst=self.login_throttle_user_burst,
+            interval=self.login_throttle_interval,
+            max_backoff=self.login_throttle_max_backoff,
+            maxsize=self.login_throttle_size,
+        )
+
+    @default("_ip_throttle")
+    def _default_ip_throttle(self):
+        return FailureThrottle(
+            burst=self.login_throttle_ip_burst,
+            interval=self.login_throttle_interval,
+            max_backoff=self.login_throttle_max_backoff,
+            maxsize=self.login_throttle_size,
+        )
+
+    @observe(
+        "login_throttle_user_burst",
+        "login_throttle_ip_burst",
+        "login_throttle_interval",
+        "login_throttle_max_backoff",
+        "login_throttle_size",
+    )
+    def _reset_login_throttles(self, change):
+        self._user_throttle = self._default_user_throttle()
+        self._ip_throttle = self._default_ip_throttle()
+
+    def _throttle_keys(self, handler, data):
+        """
+        Returns [(throttle, key)] for the configured login throttles.
+        """
+        keys = []
+        if self.login_throttle_user_burst > 0:
+            keys.append((self._user_throttle, data["username"]))
+        if self.login_throttle_ip_burst > 0 and handler is not None:
+            remote_ip = getattr(handler.request, "remote_ip", None)
+            if remote_ip:
+                keys.append((self._ip_throttle, remote_ip))
+        return keys
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        """
+        Run a blocking function, typically interacting with the LDAP server,
+        in the executor and await its result.
+        """
+        if self.executor_threads <= 0:
+            return func(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        func = partial(func, *args, **kwargs)
+        if tracing.get_tracer() is not None:
+            # make spans started in the executor children of the current span
+            func = partial(contextvars.copy_context().run, func)
+        return await loop.run_in_executor(self.executor, func)
+
+    _background_tasks = Set()
+
+    def _run_in_background(self, coro):
+        """
+        Runs a coroutine as a task in the background, returning the task.
+        """
+        task = asyncio.ensure_future(coro)
+        # the event loop only keeps weak references to tasks
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    # key -> task of a lookup in flight, see _coalesce
+    _lookups_in_flight = Dict()
+
+    async def _coalesce(self, key, lookup, started=None):
+        """
+        Awaits the coroutine returned by calling `lookup`, unless a lookup
+        with the same key is already in flight, in which case its result is
+        awaited instead, so that concurrent logins of the same user make a
+        single directory lookup.
+
+        Lookups are run as tasks, so that they complete even if the login
+        that started them is cancelled. Logins sharing the result of another
+        login's lookup get a copy of it, and run the lookup themselves if it
+        failed, as it may have failed with the other login's connection being
+        closed.
+
+        A task started for the lookup is appended to `started` if given, so
+        that a login whose connection the lookup uses can leave closing it to
+        the lookup, see `_close_connection_after`.
+        """
+        task = self._lookups_in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(lookup())
+            self._lookups_in_flight[key] = task
+            if started is not None:
+                started.append(task)
+
+            def done(task):
+                if self._lookups_in_flight.get(key) is task:
+                    del self._lookups_in_flight[key]
+                if not task.cancelled():
+                    # mark the exception as retrieved, if all logins awaiting
+                    # the lookup were cancelled
+                    task.exception()
+
+            task.add_done_callback(done)
+            return await asyncio.shield(task)
+
+        self.log.debug("Waiting for the lookup %s already in flight", key)
+        try:
+            return copy.deepcopy(await asyncio.shield(task))
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+        except Exception:
+            pass
+        return await lookup()
+
+    async def _close_connection_after(self, conn, tasks):
+        """
+        Closes a connection once the lookups using it are done.
+        """
+        await asyncio.wait(tasks)
+        self._close_connection(conn)
+
+    def _run_searches(self, conn, searches, phase):
+        """
+        Runs the searches requested by a generator with a ldap3 connection and
+        returns the generator's return value.
+
+        The generator yields the keyword arguments of each search, and is sent
+        back the list of entries found, or (entries, cookie) for a paged search
+        with `paged_size`, where cookie requests the next page and is empty for
+        the last page. Writing the logic interpreting search results this way
+        lets both backends share it.
+
+        The duration of the searches is observed labelled with phase, a
+        `metrics.SearchPhase`. A search answered with an error result code
+        raises LDAPOperationResult, see `_check_search_result`, so that the
+        generator and the caches fed by it never take a failed search for one
+        that found nothing.
+        """
+        try:
+            search = next(searches)
+            while True:
+                with metrics.observe_duration(
+                    metrics.LDAP_SEARCH_DURATION_SECONDS,
+                    span="ldap.search",
+                    server=conn.server.host,
+                    phase=phase,
+                ) as outcome:
+                    conn.search(**search)
+                    tracing.set_result(outcome["span"], conn, search)
+                    _check_search_result(conn, search)
+                search = searches.send(_search_result(conn, search))
+        except StopIteration as e:
+            return e.value
+
+    async def _run_searches_native(self, conn, searches, phase):
+        """
+        Like `_run_searches`, with a connection of the asyncio backend.
+        """
+        try:
+            search = next(searches)
+            while True:
+                with metrics.observe_duration(
+                    metrics.LDAP_SEARCH_DURATION_SECONDS,
+                    span="ldap.search",
+                    server=conn.server.host,
+                    phase=phase,
+                ) as outcome:
+                    await conn.search(**search)
+                    tracing.set_result(outcome["span"], conn, search)
+                    _check_search_result(conn, search)
+                search = searches.send(_search_result(conn, search))
+        except StopIteration as e:
+            return e.value
+
+    async def _search_async(self, conn, phase, **search):
+        """
+        Runs a search without blocking the event loop, as configured by
+        `backend`, and returns the entries found.
+        """
+        with metrics.observe_duration(
+            metrics.LDAP_SEARCH_DURATION_SECONDS,
+            span="ldap.search",
+            server=conn.server.host,
+            phase=phase,
+        ) as outcome:
+            if self.backend == Backend.asyncio:
+                await conn.search(**search)
+            else:
+                await self._run_blocking(conn.search, **search)
+            tracing.set_result(outcome["span"], conn, search)
+            _check_search_result(conn, search)
+        return conn.entries
+
+    lookup_dn_pool_size = Int(
+        0,
+        config=True,
+        help="""
+        Only used with `lookup_dn=True`.
+
+        Number of idle connections bound as `lookup_dn_search_user` to keep
+        open for reuse when looking up users' DNs. Reusing a connection saves
+        connecting, negotiating TLS and binding on every login, so that a
+        lookup costs a single search round trip.
+
+        Connections found to be closed by the server are replaced
+        automatically, see also `lookup_dn_pool_max_idle` and
+        `lookup_dn_pool_max_lifetime`.
+
+        Set to 0 (default) to use a new connection for every lookup.
+        """,
+    )
+
+    lookup_dn_pool_max_idle = Int(
+        300,
+        config=True,
+        help="""
+        Only used with `lookup_dn_pool_size` configured.
+
+        Number of seconds a pooled connection may be unused before it is
+        closed instead of being reused. This should be lower than the idle
+        timeout of the LDAP server and any firewall in between.
+
+        Set to 0 to not limit the idle time.
+        """,
+    )
+
+    lookup_dn_pool_max_lifetime = Int(
+        3600,
+        config=True,
+        help="""
+        Only used with `lookup_dn_pool_size` configured.
+
+        Number of seconds after which a pooled connection is closed instead of
+        being reused, regardless of how recently it was used.
+
+        Set to 0 to not limit the lifetime.
+        """,
+    )
+
+    unknown_user_cache_ttl = Int(
+        0,
+        config=True,
+        help="""
+        Only used with `lookup_dn=True`.
+
+        Number of seconds to remember usernames that looking up a user found
+        no entry for, refusing logins with them without contacting the LDAP
+        server until the cached entry expires. This keeps repeated logins with
+        usernames that don't exist, such as from scripted attacks, from
+        loading the LDAP server. Lookups that failed, such as with the LDAP
+        server busy, aren't remembered.
+
+        A user created in the LDAP server after a failed login attempt can
+        only log in once the cached entry has expired, so this should be kept
+        short.
+
+        Set to 0 (default) to disable caching.
+        """,
+    )
+
+    unknown_user_cache_size = Int(
+        10000,
+        config=True,
+        help="""
+        Only used with `unknown_user_cache_ttl` configured.
+
+        Maximum number of unknown usernames to remember. When full, the least
+        recently used entry is evicted.
+        """,
+    )
+
+    _unknown_user_cache = Any()
+
+    @default("_unknown_user_cache")
+    def _default_unknown_user_cache(self):
+        return TTLCache(
+            maxsize=self.unknown_user_cache_size, ttl=self.unknown_user_cache_ttl
+        )
+
+    @observe(
+        "user_search_base",
+        "user_attribute",
+        "lookup_dn_search_filter",
+        "unknown_user_cache_ttl",
+        "unknown_user_cache_size",
+    )
+    def _reset_unknown_user_cache(self, change):
+        self._unknown_user_cache = self._default_unknown_user_cache()
+
+    lookup_dn_cache_ttl = Int(
+        0,
+        config=True,
+        help="""
+        Only used with `lookup_dn=True`.
+
+        Number of seconds to remember the username and DN that looking up a
+        user found, so that logins of returning users skip binding as
+        `lookup_dn_search_user` and searching for the user.
+
+        If the user can't be bound with a remembered DN, such as after the
+        user's entry was renamed or moved, the remembered lookup is forgotten
+        and the user is looked up again. Other changes to the user's entry,
+        such as to the `lookup_dn_user_dn_attribute`, are only picked up once
+        the remembered lookup has expired.
+
+        With `lookup_dn_fetch_auth_state_attributes`, logins using a
+        remembered lookup read the `auth_state_attributes` from the user's
+        entry, as they aren't remembered.
+
+        Set to 0 (default) to disable caching.
+        """,
+    )
+
+    lookup_dn_cache_size = Int(
+        10000,
+        config=True,
+        help="""
+        Only used with `lookup_dn_cache_ttl` configured.
+
+        Maximum number of looked up users to remember. When full, the least
+        recently used entry is evicted.
+        """,
+    )
+
+    _lookup_dn_cache = Any()
+
+    @default("_lookup_dn_cache")
+    def _default_lookup_dn_cache(self):
+        return TTLCache(maxsize=self.lookup_dn_cache_size, ttl=self.lookup_dn_cache_ttl)
+
+    @observe(
+        "user_search_base",
+        "user_attribute",
+        "lookup_dn_search_filter",
+        "lookup_dn_user_dn_attribute",
+        "lookup_dn_cache_ttl",
+        "lookup_dn_cache_size",
+    )
+    def _reset_lookup_dn_cache(self, change):
+        self._lookup_dn_cache = self._default_lookup_dn_cache()
+
+    def _get_cached_lookup(self, username_supplied_by_user):
+        """
+        Returns the remembered (username, userdn) of a looked up user, see
+        `lookup_dn_cache_ttl`, or None.
+        """
+        if self.lookup_dn_cache_ttl <= 0:
+            return None
+        cached = self._lookup_dn_cache.get(username_supplied_by_user)
+        metrics.cache_lookup(metrics.Cache.lookup_dn, cached is not None)
+        return cached
+
+    _lookup_dn_pool = Any()
+
+    @default("_lookup_dn_pool")
+    def _default_lookup_dn_pool(self):
+        if self.backend == Backend.asyncio:
+            connect = self._get_connection_native
+        else:
+            connect = self.get_connection
+        return ConnectionPool(
+            connect=partial(
+                connect,
+                userdn=self.lookup_dn_search_user,
+                password=self.lookup_dn_search_password,
+            ),
+            size=self.lookup_dn_pool_size,
+            max_idle=self.lookup_dn_pool_max_idle,
+            max_lifetime=self.lookup_dn_pool_max_lifetime,
+            log=self.log,
+        )
+
+    def resolve_username(self, username_supplied_by_user):
+        """
+        Resolves a username (that could be used to construct a DN through a
+        template), and a DN, based on a username supplied by a user via a login
+        prompt in JupyterHub.
+
+        Returns (username, userdn) if found, or (None, None) if an error occurred,
+        or if `username_supplied_by_user` does not correspond to a unique user.
+        """
+        cached = self._get_cached_lookup(username_supplied_by_user)
+        if cached is not None:
+            return cached
+        username, userdn, _ = self._lookup_user(username_supplied_by_user)
+        return (username, userdn)
+
+    def _lookup_user(self, username_supplied_by_user):
+        """
+        Like `resolve_username`, but returns (username, userdn, user_attributes)
+        where user_attributes are the `auth_state_attributes` if configured to
+        be fetched with `lookup_dn_fetch_auth_state_attributes`, and None
+        otherwise.
+        """
+        result = self._run_service_searches(
+            partial(self._lookup_user_searches, username_supplied_by_user),
+            metrics.SearchPhase.lookup,
+        )
+        return result or (None, None, None)
+
+    async def _lookup_user_async(self, username_supplied_by_user):
+        """
+        Awaitable `_lookup_user`, run in the executor or natively on the event
+        loop as configured by `backend`.
+        """
+        with tracing.start_span("ldap.resolve_username") as span:
+            result = await self._run_service_searches_async(
+                partial(self._lookup_user_searches, username_supplied_by_user),
+                metrics.SearchPhase.lookup,
+            )
+            tracing.set_attributes(span, user_dn=result and result[1])
+        return result or (None, None, None)
+
+    def _run_service_searches(self, searches, phase):
+        """
+        Runs the searches of a generator, created by calling `searches`, with a
+        connection bound as `lookup_dn_search_user`, taken from the lookup
+        pool if `lookup_dn_pool_size` is configured. Returns the generator's
+        return value, or None if the connection couldn't be bound.
+        """
+
+        def run(conn):
+            if not conn:
+                self.log.error(
+                    f"Failed to bind lookup_dn_search_user '{self.lookup_dn_search_user}'"
+                )
+                return None
+            return self._run_searches(conn, searches(), phase)
+
+        if self.lookup_dn_pool_size > 0:
+            return self._lookup_dn_pool.run(run)
+        conn = self.get_connection(
+            userdn=self.lookup_dn_search_user,
+            password=self.lookup_dn_search_password,
+        )
+        try:
+            return run(conn)
+        finally:
+            if conn:
+                conn.unbind()
+
+    async def _run_service_searches_native(self, searches, phase):
+        """
+        Like `_run_service_searches`, with a connection of the asyncio backend.
+        """
+
+        async def run(conn):
+            if not conn:
+                self.log.error(
+                    f"Failed to bind lookup_dn_search_user '{self.lookup_dn_search_user}'"
+                )
+                return None
+            return await self._run_searches_native(conn, searches(), phase)
+
+        if self.lookup_dn_pool_size > 0:
+            return await self._lookup_dn_pool.run_async(run)
+        conn = await self._get_connection_native(
+            userdn=self.lookup_dn_search_user,
+            password=self.lookup_dn_search_password,
+        )
+        try:
+            return await run(conn)
+        finally:
+            if conn:
+                conn.unbind()
+
+    async def _run_service_searches_async(self, searches, phase):
+        """
+        Awaitable `_run_service_searches`, run in the executor or natively on
+        the event loop as configured by `backend`.
+        """
+        if self.backend == Backend.asyncio:
+            return await self._run_service_searches_native(searches, phase)
+        return await self._run_blocking(self._run_service_searches, searches, phase)
+
+    def _lookup_user_searches(self, username_supplied_by_user):
+        """
+        Generator yielding the search looking up a user, see `_run_searches`,
+        and returning (username, userdn, user_attributes) like `_lookup_user`.
+        """
+        fetch_auth_state_attributes = (
+            self.lookup_dn_fetch_auth_state_attributes
+            and self._merge_auth_state_attributes()
+        )
+        attributes = [self.lookup_dn_user_dn_attribute]
+        if fetch_auth_state_attributes:
+            attributes = _union(attributes, self.auth_state_attributes)
+
+        search_filter = self.lookup_dn_search_filter.format(
+            # A search filter matching against string literals, should
+            # have the string literals escaped with escape_filter_chars.
+            # Escaped characters are `/()*` (and null).
+            #
+            # ref: https://datatracker.ietf.org/doc/html/rfc4515#section-3
+            # ref: https://ldap3.readthedocs.io/en/latest/searches.html?highlight=escape_filter_chars
+            #
+            login_attr=self.user_attribute,
+            login=escape_filter_chars(username_supplied_by_user),
+        )
+        self.log.debug(
+            "Looking up user with:\n"
+            f"    search_base = '{self.user_search_base}'\n"
+            f"    search_filter = '{search_filter}'\n"
+            f"    attributes = '{attributes}'"
+        )
+        entries = yield dict(
+            search_base=self.user_search_base,
+            search_scope=ldap3.SUBTREE,
+            search_filter=search_filter,
+            attributes=attributes,
+        )
+
+        # identify unique search response entry
+        n_entries = len(entries)
+        if n_entries == 0:
+            self.log.warning(f"No response looking up '{username_supplied_by_user}'")
+            if self.unknown_user_cache_ttl > 0:
+                self._unknown_user_cache.set(username_supplied_by_user, True)
+            return (None, None, None)
+        if n_entries > 1:
+            self.log.error(
+                f"Looking up '{username_supplied_by_user}' gave multiple entries, "
+                f"expected 0 or 1 search response entries but received {n_entries}. "
+                "Is lookup_dn_search_filter and user_attribute configured to get a "
+                "unique match?"
+            )
+            return (None, None, None)
+        entry = entries[0]
+
+        # identify unique attribute value within the entry
+        attribute_values = entry.entry_attributes_as_dict.get(
+            self.lookup_dn_user_dn_attribute
+        )
+        if not attribute_values:
+            if attribute_values is None:
+                self.log.error(
+                    f"No attribute '{self.lookup_dn_user_dn_attribute}' found. "
+                    "Is lookup_dn_user_dn_attribute configured correctly?"
+                )
+            else:
+                self.log.error(
+                    f"No attribute values for '{self.lookup_dn_user_dn_attribute}'. "
+                    "Is lookup_dn_user_dn_attribute configured correctly?"
+                )
+            return (None, None, None)
+        if len(attribute_values) > 1:
+            self.log.error(
+                f"Attribute '{self.lookup_dn_user_dn_attribute}' had multiple values, "
+                f"expected one attribute value but it had {len(attribute_values)} "
+                f"({';'.join(attribute_values)}). "
+                "Is lookup_dn_user_dn_attribute configured correctly?"
+            )
+            return (None, None, None)
+
+        userdn = entry.entry_dn
+        username = attribute_values[0]
+        user_attributes = None
+        if fetch_auth_state_attributes:
+            user_attributes = self._get_auth_state_attributes(entry)
+        if self.lookup_dn_cache_ttl > 0:
+            self._lookup_dn_cache.set(username_supplied_by_user, (username, userdn))
+        return (username, userdn, user_attributes)
+
+    _server_pool = Any(None, allow_none=True)
+
+    @observe(
+        "server_address",
+        "server_port",
+        "server_pool_strategy",
+        "server_down_time",
+        "connect_timeout",
+        "tls_strategy",
+        "tls_kwargs",
+    )
+    def _reset_server_pool(self, change):
+        self._server_pool = None
+
+    def _get_server_pool(self):
+        """
+        Returns a pool of ldap3 Server objects to connect to, created once and
+        reused by all connections until relevant config changes. Reusing the
+        Server and its Tls object saves creating a SSLContext and loading CA
+        certificates for every connection, and allows TLS sessions to be
+        resumed.
+
+        ldap3 Server ref:
+        - docs: https://ldap3.readthedocs.io/en/latest/server.html
+        """
+        server_pool = self._server_pool
+        if server_pool is None:
+            server_addresses = self.server_address
+            if isinstance(server_addresses, str):
+                server_addresses = [server_addresses]
+            tls = ReusableTls(**self.tls_kwargs)
+            servers = [
+                ldap3.Server(
+                    server_address,
+                    port=self.server_port,
+                    use_ssl=self.tls_strategy == TlsStrategy.on_connect,
+                    tls=tls,
+                    connect_timeout=self.connect_timeout or None,
+                )
+                for server_address in server_addresses
+            ]
+            server_pool = ServerPool(
+                servers,
+                strategy=self.server_pool_strategy.name,
+                down_time=self.server_down_time,
+            )
+            self._server_pool = server_pool
+        return server_pool
+
+    _schema_lock = Any()
+
+    @default("_schema_lock")
+    def _default_schema_lock(self):
+        return threading.Lock()
+
+    _server_health_checks = Any(None, allow_none=True)
+
+    def _start_server_health_checks(self):
+        """
+        Starts checking the health of the LDAP servers in the background, if
+        there are multiple servers to fail over between.
+        """
+        if self._server_health_checks is not None:
+            return
+        if self.server_health_check_interval <= 0:
+            return
+        if isinstance(self.server_address, str) or len(self.server_address) < 2:
+            return
+        self._server_health_checks = PeriodicCallback(
+            self._check_servers_health, 1e3 * self.server_health_check_interval
+        )
+        self._server_health_checks.start()
+
+    async def _check_servers_health(self):
+        """
+        Checks whether the servers accept connections, marking them down or
+        up, and returns True if any server does.
+        """
+        server_pool = self._get_server_pool()
+
+        async def check_server_health(server):
+            try:
+                if self.backend == Backend.asyncio:
+                    _, writer = await asyncio.wait_for(
+                        asyncio.open_connection(server.host, server.port),
+                        self.server_health_check_timeout,
+                    )
+                    writer.close()
+                else:
+                    sock = await self._run_blocking(
+                        socket.create_connection,
+                        (server.host, server.port),
+                        timeout=self.server_health_check_timeout,
+                    )
+                    sock.close()
+            except (OSError, asyncio.TimeoutError) as e:
+                if server_pool.mark_down(server):
+                    self.log.warning(f"LDAP server {server.host} is down: {e}")
+                return False
+            else:
+                if server_pool.mark_up(server):
+                    self.log.info(f"LDAP server {server.host} is up again")
+                return True
+
+        healthy = await asyncio.gather(
+            *(check_server_health(server) for server in server_pool.servers)
+        )
+        return any(healthy)
+
+    warm_up = Bool(
+        False,
+        config=True,
+        help="""
+        Prepare for logins in the background when JupyterHub starts, instead
+        of during the first logins, without delaying JupyterHub's startup.
+
+        Warming up resolves and connects to the `server_address` entries,
+        marking unreachable servers down, creates the TLS context, reads the
+        servers' schema, binds as `lookup_dn_search_user` to verify the
+        configured credentials, and fills the connection pools configured by
+        `lookup_dn_pool_size` and `bind_pool_size`. Problems found are logged,
+        so that misconfigurations show up in JupyterHub's log right away
+        rather than when a user tries to log in.
+        """,
+    )
+
+    _warm_up_task = Any(None, allow_none=True)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.warm_up:
+            self._start_warm_up()
+
+    def _start_warm_up(self):
+        """
+        Starts warming up in the background, if there is a running event
+        loop, as when JupyterHub creates the authenticator.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.log.warning("Not warming up LDAPAuthenticator without an event loop")
+            return
+        self._warm_up_task = self._run_in_background(self._warm_up())
+
+    async def _warm_up(self):
+        """
+        Prepares for logins, see `warm_up`, logging problems found instead of
+        raising them.
+        """
+        start = time.perf_counter()
+        server_pool = self._get_server_pool()
+        if self.tls_strategy != TlsStrategy.insecure:
+            tls = server_pool.servers[0].tls
+            try:
+                await self._run_blocking(lambda: tls.ssl_context)
+            except Exception as e:
+                self.log.error(f"Failed to create the TLS context: {e}")
+                return
+        if not await self._check_servers_health():
+            self.log.error("Failed to connect to any LDAP server while warming up")
+            return
+
+        try:
+            # binding as lookup_dn_search_user, or anonymously if not
+            # configured, also reads the servers' schema
+            if self.lookup_dn_pool_size > 0:
+                if self.backend == Backend.asyncio:
+                    bound = await self._lookup_dn_pool.fill_async() > 0
+                else:
+                    bound = await self._run_blocking(self._lookup_dn_pool.fill) > 0
+            elif self.backend == Backend.asyncio:
+                conn = await self._get_connection_native(
+                    self.lookup_dn_search_user, self.lookup_dn_search_password
+                )
+                bound = conn is not None
+                if conn:
+                    conn.unbind()
+            else:
+                conn = await self._run_blocking(
+                    self.get_connection,
+                    self.lookup_dn_search_user,
+                    self.lookup_dn_search_password,
+                )
+                bound = conn is not None
+                if conn:
+                    await self._run_blocking(conn.unbind)
+            if not bound:
+                if self.lookup_dn_search_user:
+                    self.log.error(
+                        "Failed to bind lookup_dn_search_user "
+                        f"'{self.lookup_dn_search_user}' while warming up"
+                    )
+                else:
+                    self.log.error("Failed to bind anonymously while warming up")
+            if self.bind_pool_size > 0:
+                if self.backend == Backend.asyncio:
+                    await self._bind_pool.fill_async()
+                else:
+                    await self._run_blocking(self._bind_pool.fill)
+        except Exception as e:
+            self.log.error(
+                f"Failed to connect to the LDAP server while warming up: {e}"
+            )
+            return
+        self.log.info(
+            f"LDAPAuthenticator warmed up in {time.perf_counter() - start:.3f} seconds"
+        )
+
+    def get_connection(self, userdn, password):
+        """
+        Returns either an ldap3 Connection object automatically bound to the
+        user, or None if the bind operation failed for some reason.
+
+        Raises errors on connectivity or TLS issues.
+
+        ldap3 Connection ref:
+        - docs: https://ldap3.readthedocs.io/en/latest/connection.html
         - code: https://github.com/cannatag/ldap3/blob/dev/ldap3/core/connection.py
         """
-        if self.tls_strategy == TlsStrategy.on_connect:
-            use_ssl = True
-            auto_bind = ldap3.AUTO_BIND_NO_TLS
-        elif self.tls_strategy == TlsStrategy.before_bind:
-            use_ssl = False
-            auto_bind = ldap3.AUTO_BIND_TLS_BEFORE_BIND
-        else:  # TlsStrategy.insecure
-            use_ssl = False
-            auto_bind = ldap3.AUTO_BIND_NO_TLS
-
-        tls = Tls(**self.tls_kwargs)
-        server = ldap3.Server(
-            self.server_address,
-            port=self.server_port,
-            use_ssl=use_ssl,
-            tls=tls,
+        if self._circuit_breaker.state != CLOSED:
+            raise LDAPSocketOpenError("the LDAP server is considered unavailable")
+        server_pool = self._get_server_pool()
+        servers = server_pool.get_servers()
+        for server in servers:
+            try:
+                self.log.debug(f"Attempting to bind {userdn} with {server.host}")
+                conn = self._connect(server, userdn, password)
+            except LDAPCommunicationError as e:
+                # including servers not responding within receive_timeout
+                if not self._server_failed(server_pool, server, e):
+                    raise
+                if server is servers[-1]:
+                    self._connect_failed()
+                    raise
+                continue
+            except LDAPBindError as e:
+                self._circuit_breaker.succeeded()
+                self._bind_failed(userdn, e)
+                return None
+            else:
+                self._circuit_breaker.succeeded()
+                self._server_bound(server_pool, server, userdn)
+                return conn
+
+    async def _get_connection_native(self, userdn, password):
+        """
+        Like `get_connection`, but returns a connection of the asyncio backend.
+        """
+        if self._circuit_breaker.state != CLOSED:
+            raise LDAPSocketOpenError("the LDAP server is considered unavailable")
+        server_pool = self._get_server_pool()
+        servers = server_pool.get_servers()
+        for server in servers:
+            try:
+                self.log.debug(f"Attempting to bind {userdn} with {server.host}")
+                conn = await self._connect_native(server, userdn, password)
+            except LDAPCommunicationError as e:
+                # including servers not responding within receive_timeout
+                if not self._server_failed(server_pool, server, e):
+                    raise
+                if server is servers[-1]:
+                    self._connect_failed()
+                    raise
+                continue
+            except LDAPBindError as e:
+                self._circuit_breaker.succeeded()
+                self._bind_failed(userdn, e)
+                return None
+            else:
+                self._circuit_breaker.succeeded()
+                self._server_bound(server_pool, server, userdn)
+                return conn
+
+    def _connect(self, server, userdn, password):
+        """
+        Returns a ldap3 Connection to the server bound as userdn, like
+        ldap3's Connection does when passed `auto_bind`, observing the
+        duration of each step.
+
+        Raises LDAPSocketOpenError if the server can't be connected to,
+        LDAPStartTLSError if the connection can't be upgraded to TLS, and
+        LDAPBindError if the bind failed.
+        """
+        conn = ldap3.Connection(
+            server,
+            user=userdn,
+            password=password,
+            # ldap3 sets the socket's receive timeout in whole seconds
+            receive_timeout=math.ceil(self.receive_timeout) or None,
+        )
+        with metrics.observe_duration(
+            metrics.LDAP_CONNECT_DURATION_SECONDS,
+            span="ldap.connect",
+            server=server.host,
+        ):
+            conn.open(read_server_info=False)
+        try:
+            if self.tls_strategy == TlsStrategy.before_bind:
+                with metrics.observe_duration(
+                    metrics.LDAP_START_TLS_DURATION_SECONDS,
+                    span="ldap.start_tls",
+                    server=server.host,
+                ):
+                    started = conn.start_tls(read_server_info=False)
+                if not started:
+                    raise LDAPStartTLSError(
+                        "automatic start_tls befored bind not successful"
+                        + (f" - {conn.last_error}" if conn.last_error else "")
+                    )
+            with metrics.observe_duration(
+                metrics.LDAP_BIND_DURATION_SECONDS, span="ldap.bind", server=server.host
+            ) as outcome:
+                # the server's schema, used to format attribute values, is
+                # only read once per Server object, by one connection at the
+                # time as ldap3 clears it while reading it
+                read_schema = server.schema is None and self._schema_lock.acquire(
+                    blocking=False
+                )
+                try:
+                    bound = conn.bind(read_server_info=read_schema)
+                finally:
+                    if read_schema:
+                        self._schema_lock.release()
+                tracing.set_attributes(outcome["span"], bind_dn=userdn)
+                tracing.set_result(outcome["span"], conn)
+                if not bound:
+                    outcome["status"] = metrics.OperationStatus.rejected
+                    raise LDAPBindError(
+                        "automatic bind not successful"
+                        + (f" - {conn.last_error}" if conn.last_error else "")
+                    )
+        except BaseException:
+            conn.unbind()
+            raise
+        return conn
+
+    async def _connect_native(self, server, userdn, password):
+        """
+        Like `_connect`, but returns a connection of the asyncio backend.
+        """
+        # the asyncio backend's client is only imported if used
+        from . import aio
+
+        conn = aio.AsyncConnection(
+            server,
+            user=userdn,
+            password=password,
+            receive_timeout=self.receive_timeout or None,
         )
+        with metrics.observe_duration(
+            metrics.LDAP_CONNECT_DURATION_SECONDS,
+            span="ldap.connect",
+            server=server.host,
+        ):
+            await conn.open()
         try:
-            self.log.debug(f"Attempting to bind {userdn}")
-            conn = ldap3.Connection(
-                server,
-                user=userdn,
-                password=password,
-                auto_bind=auto_bind,
-            )
-        except LDAPSocketOpenError as e:
-            if "handshake" in str(e).lower():
-                self.log.error(
-                    "A TLS handshake failure has occurred. "
-                    "It could be an indication that no cipher suite accepted by "
-                    "LDAPAuthenticator was accepted by the LDAP server. For "
-                    "guidance on how to handle this, refer to documentation at "
-                    "https://github.com/consideRatio/ldapauthenticator/tree/main?tab=readme-ov-file#handling-ssltls-handshake-errors"
-                )
+            if self.tls_strategy == TlsStrategy.before_bind:
+                with metrics.observe_duration(
+                    metrics.LDAP_START_TLS_DURATION_SECONDS,
+                    span="ldap.start_tls",
+                    server=server.host,
+                ):
+                    await conn.start_tls()
+            with metrics.observe_duration(
+                metrics.LDAP_BIND_DURATION_SECONDS, span="ldap.bind", server=server.host
+            ) as outcome:
+                bound = await conn.bind()
+                tracing.set_attributes(outcome["span"], bind_dn=userdn)
+                tracing.set_result(outcome["span"], conn)
+                if not bound:
+                    outcome["status"] = metrics.OperationStatus.rejected
+                    raise LDAPBindError(
+                        f"automatic bind not successful - {conn.result['description']}"
+                    )
+        except BaseException:
+            conn.unbind()
             raise
-        except LDAPBindError as e:
-            self.log.debug(
-                "Failed to bind {userdn}\n{e_type}: {e_msg}".format(
-                    userdn=userdn,
-                    e_type=e.__class__.__name__,
-                    e_msg=e.args[0] if e.args else "",
+        return conn
+
+    bind_pool_size = Int(
+        0,
+        config=True,
+        help="""
+        Number of idle connections to keep open for reuse when binding users,
+        already connected, upgraded to TLS and bound anonymously. A login
+        binds the user on an idle connection, saving connecting and
+        negotiating TLS, and once done with it, binds it anonymously again in
+        the background and returns it to the pool. When there is no idle
+        connection, a new connection is made as usual, and returned to the
+        pool after the login.
+
+        The LDAP server needs to allow anonymous binds. Connections found to
+        be closed by the server are replaced automatically, see also
+        `bind_pool_max_idle` and `bind_pool_max_lifetime`.
+
+        Set to 0 (default) to use a new connection for every bind.
+        """,
+    )
+
+    bind_pool_max_idle = Int(
+        300,
+        config=True,
+        help="""
+        Only used with `bind_pool_size` configured.
+
+        Number of seconds a pooled connection may be unused before it is
+        closed instead of being reused. This should be lower than the idle
+        timeout of the LDAP server and any firewall in between.
+
+        Set to 0 to not limit the idle time.
+        """,
+    )
+
+    bind_pool_max_lifetime = Int(
+        3600,
+        config=True,
+        help="""
+        Only used with `bind_pool_size` configured.
+
+        Number of seconds after which a pooled connection is closed instead of
+        being reused, regardless of how recently it was used.
+
+        Set to 0 to not limit the lifetime.
+        """,
+    )
+
+    _bind_pool = Any()
+
+    @default("_bind_pool")
+    def _default_bind_pool(self):
+        if self.backend == Backend.asyncio:
+            connect = self._get_connection_native
+        else:
+            connect = self.get_connection
+        return ConnectionPool(
+            connect=partial(connect, userdn=None, password=None),
+            size=self.bind_pool_size,
+            max_idle=self.bind_pool_max_idle,
+            max_lifetime=self.bind_pool_max_lifetime,
+            log=self.log,
+        )
+
+    def _rebind(self, conn, userdn, password):
+        """
+        Binds a pooled connection as userdn, returning True if the bind
+        succeeded. Raises LDAPCommunicationError if the connection turned out
+        to be unusable.
+        """
+        conn.user = userdn
+        conn.password = password
+        conn.authentication = ldap3.SIMPLE
+        with metrics.observe_duration(
+            metrics.LDAP_BIND_DURATION_SECONDS,
+            span="ldap.bind",
+            server=conn.server.host,
+        ) as outcome:
+            bound = conn.bind(read_server_info=False)
+            tracing.set_attributes(outcome["span"], bind_dn=userdn, pooled=True)
+            tracing.set_result(outcome["span"], conn)
+            if not bound:
+                outcome["status"] = metrics.OperationStatus.rejected
+                return False
+        return True
+
+    async def _rebind_native(self, conn, userdn, password):
+        """
+        Like `_rebind`, with a connection of the asyncio backend.
+        """
+        conn.user = userdn
+        conn.password = password
+        with metrics.observe_duration(
+            metrics.LDAP_BIND_DURATION_SECONDS,
+            span="ldap.bind",
+            server=conn.server.host,
+        ) as outcome:
+            bound = await conn.bind()
+            tracing.set_attributes(outcome["span"], bind_dn=userdn, pooled=True)
+            tracing.set_result(outcome["span"], conn)
+            if not bound:
+                outcome["status"] = metrics.OperationStatus.rejected
+                return False
+        return True
+
+    def _get_pooled_connection(self, userdn, password):
+        """
+        Like `get_connection`, but binding an idle connection of the bind
+        pool if there is one, see `bind_pool_size`.
+        """
+        conn = self._bind_pool.acquire()
+        if conn is None:
+            return self.get_connection(userdn, password)
+        try:
+            bound = self._rebind(conn, userdn, password)
+        except LDAPCommunicationError as e:
+            self._bind_pool.discard(conn)
+            self.log.debug(f"Reconnecting after failing to bind pooled connection: {e}")
+            return self.get_connection(userdn, password)
+        if not bound:
+            self._bind_failed(userdn, LDAPBindError(conn.last_error))
+            self._close_connection(conn)
+            return None
+        self.log.debug(f"Successfully bound {userdn} with a pooled connection")
+        return conn
+
+    async def _get_pooled_connection_native(self, userdn, password):
+        """
+        Like `_get_pooled_connection`, with a connection of the asyncio
+        backend.
+        """
+        conn = self._bind_pool.acquire()
+        if conn is None:
+            return await self._get_connection_native(userdn, password)
+        try:
+            bound = await self._rebind_native(conn, userdn, password)
+        except LDAPCommunicationError as e:
+            self._bind_pool.discard(conn)
+            self.log.debug(f"Reconnecting after failing to bind pooled connection: {e}")
+            return await self._get_connection_native(userdn, password)
+        if not bound:
+            self._bind_failed(userdn, LDAPBindError(conn.result["description"]))
+            self._close_connection(conn)
+            return None
+        self.log.debug(f"Successfully bound {userdn} with a pooled connection")
+        return conn
+
+    def _reset_connection(self, conn):
+        """
+        Binds a connection anonymously and returns it to the bind pool, or
+        unbinds it if that failed.
+        """
+        conn.user = None
+        conn.password = None
+        conn.authentication = ldap3.ANONYMOUS
+        try:
+            bound = conn.bind(read_server_info=False)
+        except Exception as e:
+            self.log.debug(f"Failed to reset pooled connection: {e}")
+            bound = False
+        if bound:
+            self._bind_pool.release(conn)
+        else:
+            self._bind_pool.discard(conn)
+
+    async def _reset_connection_native(self, conn):
+        """
+        Like `_reset_connection`, with a connection of the asyncio backend.
+        """
+        conn.user = None
+        conn.password = None
+        try:
+            bound = await conn.bind()
+        except Exception as e:
+            self.log.debug(f"Failed to reset pooled connection: {e}")
+            bound = False
+        if bound:
+            self._bind_pool.release(conn)
+        else:
+            self._bind_pool.discard(conn)
+
+    def _close_connection(self, conn):
+        """
+        Unbinds a connection, closing its socket instead of leaving it open
+        until garbage collected. With `backend="threads"`, the blocking unbind
+        runs in the executor, where it waits for any operation of the
+        connection still running there.
+
+        With `bind_pool_size` configured, the connection is instead reset and
+        returned to the bind pool, in the executor or in the background.
+        """
+        if self.bind_pool_size > 0:
+            if self.backend == Backend.asyncio:
+                self._run_in_background(self._reset_connection_native(conn))
+            elif self.executor_threads > 0:
+                self.executor.submit(self._reset_connection, conn)
+            else:
+                self._reset_connection(conn)
+        elif self.backend == Backend.threads and self.executor_threads > 0:
+            self.executor.submit(conn.unbind)
+        else:
+            conn.unbind()
+
+    async def _get_connection_async(self, userdn, password):
+        """
+        Awaitable `get_connection`, run in the executor or natively on the
+        event loop as configured by `backend`, binding a pooled connection
+        with `bind_pool_size` configured.
+        """
+        if self.backend == Backend.asyncio:
+            if self.bind_pool_size > 0:
+                return await self._get_pooled_connection_native(userdn, password)
+            return await self._get_connection_native(userdn, password)
+        if self.bind_pool_size > 0:
+            return await self._run_blocking(
+                self._get_pooled_connection, userdn, password
+            )
+        return await self._run_blocking(self.get_connection, userdn, password)
+
+    def _order_bind_dn_templates(self, bind_dn_template, username):
+        """
+        Returns the bind_dn_template entries in the order to try them for the
+        username, the one most likely to succeed first.
+        """
+        templates = list(bind_dn_template)
+        if len(templates) < 2:
+            return templates
+        if self.bind_dn_template_reorder:
+            successes = self._bind_dn_template_successes
+            # sorted is stable, so ties keep the configured order
+            templates.sort(key=lambda t: -successes.get(t, 0))
+        if self.bind_dn_template_cache_size > 0:
+            remembered = self._bind_dn_template_cache.get(username)
+            metrics.cache_lookup(metrics.Cache.bind_dn_template, remembered is not None)
+            if remembered in templates:
+                templates.remove(remembered)
+                templates.insert(0, remembered)
+        return templates
+
+    def _bind_dn_template_succeeded(self, template, username):
+        if self.bind_dn_template_reorder:
+            successes = self._bind_dn_template_successes
+            successes[template] = successes.get(template, 0) + 1
+        if self.bind_dn_template_cache_size > 0:
+            self._bind_dn_template_cache.set(username, template)
+
+    def _discard_bind_task(self, task):
+        """
+        Unbinds the connection of a concurrent bind that lost the race.
+        """
+        if task.cancelled() or task.exception() is not None:
+            return
+        conn = task.result()
+        if conn:
+            self._close_connection(conn)
+
+    async def _bind_first(self, templates, username, password):
+        """
+        Binds with the DNs of the templates concurrently. Returns (template,
+        userdn, conn) of the first bind that succeeded, or (None, None, None)
+        if none did.
+        """
+        # A DN represented as a string should have its attribute values
+        # escaped with escape_rdn. Escaped characters are `\,+"<>;=` (and
+        # null).
+        #
+        # ref: https://datatracker.ietf.org/doc/html/rfc4514#section-2.4.
+        # ref: https://ldap3.readthedocs.io/en/latest/connection.html?highlight=escape_rdn
+        #
+        userdns = [t.format(username=escape_rdn(username)) for t in templates]
+        if len(templates) == 1:
+            conn = await self._get_connection_async(userdns[0], password)
+            return (templates[0], userdns[0], conn) if conn else (None, None, None)
+
+        pending = {
+            asyncio.ensure_future(self._get_connection_async(userdn, password)): (
+                template,
+                userdn,
+            )
+            for template, userdn in zip(templates, userdns)
+        }
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                # prefer the earliest template among binds completing together
+                for task in sorted(done, key=list(pending).index):
+                    template, userdn = pending.pop(task)
+                    conn = task.result()
+                    if conn:
+                        return template, userdn, conn
+            return None, None, None
+        finally:
+            # binds still in progress are left to complete, and unbound if
+            # they succeeded
+            for task in pending:
+                task.add_done_callback(self._discard_bind_task)
+
+    async def _bind_user(self, bind_dn_template, username, password):
+        """
+        Binds the user with the first bind_dn_template entry that results in a
+        successful bind, trying the entries in the order decided by
+        `_order_bind_dn_templates`. Returns (userdn, conn), or (None, None) if
+        no bind succeeded.
+        """
+        templates = self._order_bind_dn_templates(bind_dn_template, username)
+        if self.bind_dn_template_concurrent and len(templates) > 2:
+            attempts = [templates[:1], templates[1:]]
+        else:
+            attempts = [[template] for template in templates]
+        tried = 0
+        with tracing.start_span("ldap.bind_user", templates=len(templates)) as span:
+            for candidates in attempts:
+                tried += len(candidates)
+                template, userdn, conn = await self._bind_first(
+                    candidates, username, password
                 )
+                if conn:
+                    metrics.LDAP_BIND_DN_TEMPLATE_ATTEMPTS.labels(
+                        status=metrics.OperationStatus.success
+                    ).observe(tried)
+                    tracing.set_attributes(span, attempts=tried, user_dn=userdn)
+                    if len(templates) > 1:
+                        self._bind_dn_template_succeeded(template, username)
+                    return userdn, conn
+            metrics.LDAP_BIND_DN_TEMPLATE_ATTEMPTS.labels(
+                status=metrics.OperationStatus.rejected
+            ).observe(tried)
+            tracing.set_attributes(span, attempts=tried)
+        return None, None
+
+    def _server_failed(self, server_pool, server, e):
+        """
+        Handles a failure to connect to a server, or to hear back from it
+        within `receive_timeout` while connecting. Returns True if the server
+        was marked down so that the next server can be tried, or False if the
+        failure isn't specific to the server.
+        """
+        if "handshake" in str(e).lower():
+            self.log.error(
+                "A TLS handshake failure has occurred. "
+                "It could be an indication that no cipher suite accepted by "
+                "LDAPAuthenticator was accepted by the LDAP server. For "
+                "guidance on how to handle this, refer to documentation at "
+                "https://github.com/consideRatio/ldapauthenticator/tree/main?tab=readme-ov-file#handling-ssltls-handshake-errors"
+            )
+            return False
+        metrics.LDAP_SERVER_FAILOVERS.labels(server=server.host).inc()
+        if server_pool.mark_down(server):
+            self.log.warning(f"LDAP server {server.host} is down: {e}")
+        return True
+
+    def _connect_failed(self):
+        """
+        Handles a failure to connect to every server.
+        """
+        if self._circuit_breaker.failed():
+            self.log.error(
+                "LDAP server considered unavailable after failing to connect "
+                f"{self.circuit_breaker_threshold} times in a row, failing logins "
+                "until it accepts connections again"
+            )
+
+    def _bind_failed(self, userdn, e):
+        self.log.debug(
+            "Failed to bind {userdn}\n{e_type}: {e_msg}".format(
+                userdn=userdn,
+                e_type=e.__class__.__name__,
+                e_msg=e.args[0] if e.args else "",
+            )
+        )
+
+    def _server_bound(self, server_pool, server, userdn):
+        if server_pool.mark_up(server):
+            self.log.info(f"LDAP server {server.host} is up again")
+        self.log.debug(f"Successfully bound {userdn}")
+
+    def _get_group_search_base(self):
+        """
+        Returns `group_search_base`, or the closest common ancestor of the
+        entries in `allowed_groups`, or None if they have none.
+        """
+        if self.group_search_base:
+            return self.group_search_base
+        # compare the groups' RDNs from the root of the tree, stopping at the
+        # group's own RDN
+        parents = [split_dn(group)[1:] for group in self.allowed_groups]
+        common = []
+        for rdns in zip(*(reversed(p) for p in parents)):
+            if len(set(rdns)) != 1:
+                break
+            common.insert(0, rdns[0])
+        return ",".join(common) or None
+
+    def _filter_allowed_groups(self, dns):
+        """
+        Returns the entries of `allowed_groups`, in their configured order,
+        that are found among the given DNs.
+        """
+        found = {normalize_dn(dn) for dn in dns}
+        return [group for group in self.allowed_groups if normalize_dn(group) in found]
+
+    def _get_member_of_groups(self, entry):
+        """
+        Returns the entries of `allowed_groups` listed by a user entry's
+        `member_of_attribute`.
+        """
+        member_of = []
+        if self.member_of_attribute in entry:
+            member_of = entry[self.member_of_attribute].values
+        return self._filter_allowed_groups(member_of)
+
+    def get_ldap_groups(self, conn, userdn, uid):
+        """
+        Returns the entries of `allowed_groups` that the user is a member of,
+        determined as configured by `group_lookup_strategy`.
+        """
+        return self._run_searches(
+            conn, self._ldap_groups_searches(userdn, uid), metrics.SearchPhase.groups
+        )
+
+    async def _get_ldap_groups_async(self, conn, userdn, uid):
+        """
+        Awaitable `get_ldap_groups`, run in the executor or natively on the
+        event loop as configured by `backend`.
+        """
+        with tracing.start_span("ldap.groups", user_dn=userdn) as span:
+            if self.backend == Backend.asyncio:
+                groups = await self._run_searches_native(
+                    conn,
+                    self._ldap_groups_searches(userdn, uid),
+                    metrics.SearchPhase.groups,
+                )
+            else:
+                groups = await self._run_blocking(
+                    self.get_ldap_groups, conn, userdn, uid
+                )
+            tracing.set_attributes(span, groups=len(groups))
+        return groups
+
+    def _ldap_groups_searches(self, userdn, uid):
+        """
+        Generator yielding the searches determining the user's groups, see
+        `_run_searches`, and returning them like `get_ldap_groups`.
+        """
+        if not self.allowed_groups:
+            return []
+
+        strategy = self.group_lookup_strategy
+        nested = self.nested_group_lookup
+        if strategy == GroupLookupStrategy.member_of:
+            if nested == NestedGroupLookup.in_chain:
+                ldap_groups = []
+                for group in self.allowed_groups:
+                    entries = yield dict(
+                        search_base=userdn,
+                        search_scope=ldap3.BASE,
+                        search_filter=(
+                            f"({self.member_of_attribute}:{IN_CHAIN_RULE_OID}:="
+                            f"{escape_filter_chars(group)})"
+                        ),
+                        attributes=ldap3.NO_ATTRIBUTES,
+                    )
+                    if entries:
+                        ldap_groups.append(group)
+                return ldap_groups
+            entries = yield dict(
+                search_base=userdn,
+                search_scope=ldap3.BASE,
+                search_filter="(objectClass=*)",
+                attributes=[self.member_of_attribute],
+            )
+            if len(entries) != 1:
+                return []
+            if nested == NestedGroupLookup.walk:
+                return (
+                    yield from self._nested_groups_searches(
+                        _attribute_values(entries[0], self.member_of_attribute)
+                    )
+                )
+            return self._get_member_of_groups(entries[0])
+
+        if nested == NestedGroupLookup.in_chain:
+            group_search_filter = (
+                f"(member:{IN_CHAIN_RULE_OID}:={escape_filter_chars(userdn)})"
             )
-            return None
         else:
-            self.log.debug(f"Successfully bound {userdn}")
-            return conn
+            group_search_filter = self.group_search_filter.format(
+                # A search filter matching against string literals, should
+                # have the string literals escaped with escape_filter_chars.
+                # Escaped characters are `/()*` (and null).
+                #
+                # ref: https://datatracker.ietf.org/doc/html/rfc4515#section-3
+                # ref: https://ldap3.readthedocs.io/en/latest/searches.html?highlight=escape_filter_chars
+                #
+                userdn=escape_filter_chars(userdn),
+                uid=escape_filter_chars(uid),
+            )
+
+        if strategy == GroupLookupStrategy.subtree or nested == NestedGroupLookup.walk:
+            # walking nested groups starts from all the user's groups, not
+            # only the allowed_groups
+            group_search_base = self._get_group_search_base()
+            if group_search_base:
+                entries = yield dict(
+                    search_base=group_search_base,
+                    search_scope=ldap3.SUBTREE,
+                    search_filter=group_search_filter,
+                    attributes=ldap3.NO_ATTRIBUTES,
+                )
+                dns = [e.entry_dn for e in entries]
+                if nested == NestedGroupLookup.walk:
+                    return (yield from self._nested_groups_searches(dns))
+                return self._filter_allowed_groups(dns)
+            if nested == NestedGroupLookup.walk:
+                self.log.warning(
+                    "The allowed_groups entries have no common ancestor, configure "
+                    "group_search_base to find the groups nested in them. Only "
+                    "direct members of allowed_groups are found instead."
+                )
+            else:
+                self.log.warning(
+                    "The allowed_groups entries have no common ancestor, configure "
+                    "group_search_base to search for them with a single search. "
+                    "Searching for one group at the time instead."
+                )
+
+        ldap_groups = []
+        for group in self.allowed_groups:
+            entries = yield dict(
+                search_base=group,
+                search_scope=ldap3.BASE,
+                search_filter=group_search_filter,
+                attributes=self.group_attributes,
+            )
+            if entries:
+                ldap_groups.append(group)
+        return ldap_groups
+
+    def _nested_groups_searches(self, dns):
+        """
+        Generator yielding the searches for the groups that the groups with
+        the given DNs are nested in, level by level, see `_run_searches`, and
+        returning the entries of `allowed_groups` among all those groups.
+
+        The parent groups of a group are cached, so that walking a group graph
+        shared by many users only searches the LDAP server once per group.
+        """
+        allowed = {normalize_dn(group) for group in self.allowed_groups}
+        # normalized DN -> DN of the groups found so far
+        found = {normalize_dn(dn): dn for dn in dns}
+        level = list(found.items())
+        for _ in range(self.nested_group_max_depth):
+            if not level or allowed.issubset(found):
+                break
+            next_level = []
+            for key, dn in level:
+                parents = None
+                if self.nested_group_cache_ttl > 0:
+                    parents = self._group_parents_cache.get(key)
+                    metrics.cache_lookup(
+                        metrics.Cache.group_parents, parents is not None
+                    )
+                if parents is None:
+                    parents = yield from self._group_parents_searches(dn)
+                    if self.nested_group_cache_ttl > 0:
+                        self._group_parents_cache.set(key, tuple(parents))
+                for parent in parents:
+                    parent_key = normalize_dn(parent)
+                    if parent_key not in found:
+                        found[parent_key] = parent
+                        next_level.append((parent_key, parent))
+            level = next_level
+        return self._filter_allowed_groups(found.values())
+
+    def _group_parents_searches(self, groupdn):
+        """
+        Generator yielding the search for the groups that a group is a direct
+        member of, see `_run_searches`, and returning their DNs.
+        """
+        if self.group_lookup_strategy == GroupLookupStrategy.member_of:
+            entries = yield dict(
+                search_base=groupdn,
+                search_scope=ldap3.BASE,
+                search_filter="(objectClass=*)",
+                attributes=[self.member_of_attribute],
+            )
+            if len(entries) != 1:
+                return []
+            return list(_attribute_values(entries[0], self.member_of_attribute))
+
+        entries = yield dict(
+            search_base=self._get_group_search_base(),
+            search_scope=ldap3.SUBTREE,
+            search_filter=self.nested_group_search_filter.format(
+                groupdn=escape_filter_chars(groupdn)
+            ),
+            attributes=ldap3.NO_ATTRIBUTES,
+        )
+        return [e.entry_dn for e in entries]
+
+    def _merge_auth_state_attributes(self):
+        """
+        Returns whether `auth_state_attributes` can be read by searches for
+        other attributes as well, which they can't if they include `*` (all
+        user attributes) or `+` (all operational attributes), as the other
+        attributes couldn't be told apart from them.
+        """
+        return not any(
+            name in (ldap3.ALL_ATTRIBUTES, ldap3.ALL_OPERATIONAL_ATTRIBUTES)
+            for name in self.auth_state_attributes
+        )
+
+    def _get_auth_state_attributes(self, entry):
+        """
+        Returns the `auth_state_attributes` of an entry found by a search that
+        may have requested other attributes as well.
+        """
+        auth_state_attributes = {a.lower() for a in self.auth_state_attributes}
+        return {
+            k: v
+            for k, v in entry.entry_attributes_as_dict.items()
+            if k.lower() in auth_state_attributes
+        }
 
     def get_user_attributes(self, conn, userdn):
+        return self._run_searches(
+            conn, self._user_attributes_searches(userdn), metrics.SearchPhase.attributes
+        )
+
+    async def _get_user_attributes_async(self, conn, userdn):
+        """
+        Awaitable `get_user_attributes`, run in the executor or natively on the
+        event loop as configured by `backend`.
+        """
+        with tracing.start_span("ldap.user_attributes", user_dn=userdn):
+            if self.backend == Backend.asyncio:
+                return await self._run_searches_native(
+                    conn,
+                    self._user_attributes_searches(userdn),
+                    metrics.SearchPhase.attributes,
+                )
+            return await self._run_blocking(self.get_user_attributes, conn, userdn)
+
+    def _user_attributes_searches(self, userdn):
+        """
+        Generator yielding the search reading the `auth_state_attributes` of
+        a user, see `_run_searches`, and returning them.
+        """
         if self.auth_state_attributes:
-            conn.search(
+            entries = yield dict(
                 search_base=userdn,
-                search_scope=ldap3.SUBTREE,
+                search_scope=ldap3.BASE,
                 search_filter="(objectClass=*)",
                 attributes=self.auth_state_attributes,
             )
 
             # identify unique search response entry
-            n_entries = len(conn.entries)
+            n_entries = len(entries)
             if n_entries == 1:
-                return conn.entries[0].entry_attributes_as_dict
+                return entries[0].entry_attributes_as_dict
             self.log.error(
                 f"Expected 1 but got {n_entries} search response entries for DN '{userdn}' "
                 "when looking up attributes configured via auth_state_attributes. The user's "
@@ -588,6 +3203,133 @@ class LDAPAuthenticator(Authenticator):
 
         ref: https://jupyterhub.readthedocs.io/en/latest/reference/authenticators.html#authenticator-authenticate
         """
+        with tracing.start_span("ldap.authenticate") as span:
+            throttle_keys = self._throttle_keys(handler, data)
+            acquired = []
+            for throttle, key in throttle_keys:
+                retry_after = throttle.try_acquire(key)
+                if retry_after > 0:
+                    for acquired_throttle, acquired_key in acquired:
+                        acquired_throttle.release(acquired_key)
+                    self.log.warning(
+                        "username:%s Login refused after too many failed logins for %s, "
+                        "retry in %d seconds",
+                        data["username"],
+                        key,
+                        retry_after,
+                    )
+                    raise web.HTTPError(
+                        429, "Too many failed logins, please try again later."
+                    )
+                acquired.append((throttle, key))
+
+            try:
+                result = await self._authenticate_remembered(handler, data)
+            except BaseException:
+                # errors aren't failed logins
+                for throttle, key in throttle_keys:
+                    throttle.release(key)
+                raise
+
+            for throttle, key in throttle_keys:
+                if result is None:
+                    throttle.failed(key)
+                elif throttle is self._user_throttle:
+                    throttle.reset(key)
+                else:
+                    throttle.release(key)
+            tracing.set_attributes(span, authenticated=result is not None)
+            return result
+
+    async def _authenticate_remembered(self, handler, data):
+        """
+        Returns the result of a login remembered by the credential cache, or
+        otherwise of `_authenticate_limited`, falling back to a remembered
+        login within `credential_cache_outage_grace` if the LDAP server is
+        unavailable.
+        """
+        result = None
+        if self.credential_cache_ttl > 0:
+            result = await self._run_blocking(self._get_cached_login, data)
+            if result is not None:
+                self.log.debug("username:%s Using remembered login", data["username"])
+                return result
+        try:
+            result = await self._authenticate_limited(handler, data)
+        except (LDAPCommunicationError, _UnavailableError) as e:
+            # the LDAP server couldn't be reached, or is considered unavailable
+            # or too slow, but not when too many logins are in progress
+            if self.credential_cache_outage_grace <= 0:
+                raise
+            result = await self._run_blocking(self._get_cached_login, data, outage=True)
+            if result is None:
+                raise
+            self.log.warning(
+                "username:%s Using remembered login, the LDAP server is unavailable: %s",
+                data["username"],
+                e,
+            )
+            return result
+        if result is not None and self.credential_cache_ttl > 0:
+            # hashing the password is slow, don't delay the login
+            self._run_in_background(
+                self._run_blocking(
+                    self._credential_cache.set,
+                    data["username"],
+                    data["password"],
+                    result,
+                )
+            )
+        return result
+
+    async def _authenticate_limited(self, handler, data):
+        """
+        Runs `_authenticate` unless the LDAP server is considered unavailable
+        or too many logins are in progress, limiting its duration to
+        `login_timeout`.
+        """
+        self._check_circuit_breaker()
+
+        if (
+            self.backend == Backend.threads
+            and self.executor_threads > 0
+            and self.executor_queue_size > 0
+        ):
+            max_pending = self.executor_threads + self.executor_queue_size
+            if self._pending_logins >= max_pending:
+                self.log.warning(
+                    "username:%s Login refused, %s logins are already in progress",
+                    data["username"],
+                    self._pending_logins,
+                )
+                raise web.HTTPError(
+                    503, "Too many concurrent logins, please try again later."
+                )
+        self._pending_logins += 1
+        try:
+            if self.login_timeout > 0:
+                try:
+                    result = await asyncio.wait_for(
+                        self._authenticate(handler, data), self.login_timeout
+                    )
+                except asyncio.TimeoutError:
+                    self.log.warning(
+                        "username:%s Login cancelled after login_timeout of %s seconds",
+                        data["username"],
+                        self.login_timeout,
+                    )
+                    raise _UnavailableError(
+                        "The login took too long, please try again later."
+                    )
+            else:
+                result = await self._authenticate(handler, data)
+        finally:
+            self._pending_logins -= 1
+        return result
+
+    async def _authenticate(self, handler, data):
+        self._start_server_health_checks()
+        self._start_group_index_refresh()
         login_username = data["username"]
         password = data["password"]
 
@@ -609,30 +3351,56 @@ class LDAPAuthenticator(Authenticator):
 
         bind_dn_template = self.bind_dn_template
         resolved_username = login_username
+        resolved_dn = None
+        user_attributes = None
+        cached_lookup = None
         if self.lookup_dn:
-            resolved_username, resolved_dn = self.resolve_username(login_username)
+            if self.unknown_user_cache_ttl > 0 and metrics.cache_lookup(
+                metrics.Cache.unknown_user, login_username in self._unknown_user_cache
+            ):
+                self.log.warning(
+                    "username:%s Login denied for recently failed lookup",
+                    login_username,
+                )
+                return None
+            cached_lookup = self._get_cached_lookup(login_username)
+            if cached_lookup is not None:
+                resolved_username, resolved_dn = cached_lookup
+            else:
+                resolved_username, resolved_dn, user_attributes = await self._coalesce(
+                    ("lookup", login_username),
+                    partial(self._lookup_user_async, login_username),
+                )
             if not resolved_dn:
                 self.log.warning(
                     "username:%s Login denied for failed lookup", login_username
                 )
                 return None
-            if not bind_dn_template:
-                bind_dn_template = [resolved_dn]
 
         # bind to ldap user
-        conn = None
-        for dn in bind_dn_template:
-            # A DN represented as a string should have its attribute values
-            # escaped with escape_rdn. Escaped characters are `\,+"<>;=` (and
-            # null).
-            #
-            # ref: https://datatracker.ietf.org/doc/html/rfc4514#section-2.4.
-            # ref: https://ldap3.readthedocs.io/en/latest/connection.html?highlight=escape_rdn
-            #
-            userdn = dn.format(username=escape_rdn(resolved_username))
-            conn = self.get_connection(userdn, password)
-            if conn:
-                break
+        userdn, conn = await self._bind_user(
+            bind_dn_template or [resolved_dn], resolved_username, password
+        )
+        if not conn and cached_lookup is not None:
+            # the remembered lookup may be outdated, such as if the user's
+            # entry was renamed or moved
+            self._lookup_dn_cache.pop(login_username)
+            lookup = await self._coalesce(
+                ("lookup", login_username),
+                partial(self._lookup_user_async, login_username),
+            )
+            if lookup[1] and lookup[:2] != cached_lookup:
+                self.log.debug(
+                    "username:%s Binding with the looked up dn %s instead of "
+                    "the remembered dn %s",
+                    login_username,
+                    lookup[1],
+                    resolved_dn,
+                )
+                resolved_username, resolved_dn, user_attributes = lookup
+                userdn, conn = await self._bind_user(
+                    bind_dn_template or [resolved_dn], resolved_username, password
+                )
         if not conn:
             if login_username == resolved_username:
                 self.log.warning(
@@ -645,42 +3413,36 @@ class LDAPAuthenticator(Authenticator):
                     "to an LDAP user."
                 )
             return None
-
-        if self.search_filter:
-            conn.search(
-                search_base=self.user_search_base,
-                search_scope=ldap3.SUBTREE,
-                search_filter=self.search_filter.format(
-                    # A search filter matching against string literals, should
-                    # have the string literals escaped with escape_filter_chars.
-                    # Escaped characters are `/()*` (and null).
-                    #
-                    # ref: https://datatracker.ietf.org/doc/html/rfc4515#section-3
-                    # ref: https://ldap3.readthedocs.io/en/latest/searches.html?highlight=escape_filter_chars
-                    #
-                    userattr=self.user_attribute,
-                    username=escape_filter_chars(resolved_username),
-                ),
-                attributes=self.attributes,
-            )
-            n_entries = len(conn.entries)
-            if n_entries != 1:
-                self.log.warning(
-                    f"Login of '{login_username}' denied. Configured search_filter "
-                    f"found {n_entries} users associated with "
-                    f"userattr='{self.user_attribute}' and username='{resolved_username}', "
-                    "and a unique match is required."
-                )
-                return None
-
-        ldap_groups = []
-        if self.allowed_groups:
-            self.log.debug("username:%s Using dn %s", resolved_username, userdn)
-            for group in self.allowed_groups:
-                found = conn.search(
-                    search_base=group,
-                    search_scope=ldap3.BASE,
-                    search_filter=self.group_search_filter.format(
+        # lookups with the user's connection, which other logins may share
+        lookups = []
+        try:
+            if resolved_dn and normalize_dn(userdn) != normalize_dn(resolved_dn):
+                # attributes fetched while looking up the user's DN are only of
+                # use if the user was bound with that DN
+                user_attributes = None
+
+            # the user's entry, if read with the search_filter search
+            user_entry = None
+            merge_auth_state_attributes = self._merge_auth_state_attributes()
+            use_member_of = (
+                self.allowed_groups
+                and self.group_lookup_strategy == GroupLookupStrategy.member_of
+                and self.nested_group_lookup == NestedGroupLookup.disabled
+            )
+            if self.search_filter:
+                # The search_filter search can read all user attributes needed,
+                # so that the user's entry doesn't have to be read again.
+                attributes = list(self.attributes)
+                if merge_auth_state_attributes:
+                    attributes = _union(attributes, self.auth_state_attributes)
+                if use_member_of:
+                    attributes = _union(attributes, [self.member_of_attribute])
+                entries = await self._search_async(
+                    conn,
+                    metrics.SearchPhase.search_filter,
+                    search_base=self.user_search_base,
+                    search_scope=ldap3.SUBTREE,
+                    search_filter=self.search_filter.format(
                         # A search filter matching against string literals, should
                         # have the string literals escaped with escape_filter_chars.
                         # Escaped characters are `/()*` (and null).
@@ -688,24 +3450,94 @@ class LDAPAuthenticator(Authenticator):
                         # ref: https://datatracker.ietf.org/doc/html/rfc4515#section-3
                         # ref: https://ldap3.readthedocs.io/en/latest/searches.html?highlight=escape_filter_chars
                         #
-                        userdn=escape_filter_chars(userdn),
-                        uid=escape_filter_chars(resolved_username),
+                        userattr=self.user_attribute,
+                        username=escape_filter_chars(resolved_username),
                     ),
-                    attributes=self.group_attributes,
+                    attributes=attributes,
                 )
-                if found:
-                    ldap_groups.append(group)
-                    # Returned in auth_state, so fetch the full list
-
-        user_attributes = self.get_user_attributes(conn, userdn)
-        self.log.debug("username:%s attributes:%s", login_username, user_attributes)
+                n_entries = len(entries)
+                if n_entries != 1:
+                    self.log.warning(
+                        f"Login of '{login_username}' denied. Configured search_filter "
+                        f"found {n_entries} users associated with "
+                        f"userattr='{self.user_attribute}' and username='{resolved_username}', "
+                        "and a unique match is required."
+                    )
+                    return None
+                if normalize_dn(entries[0].entry_dn) == normalize_dn(userdn):
+                    user_entry = entries[0]
+
+            ldap_groups = []
+            if self.allowed_groups:
+                self.log.debug("username:%s Using dn %s", resolved_username, userdn)
+                cache_key = normalize_dn(userdn)
+                group_index = self._get_group_index()
+                cached = None
+                if group_index is None and self.group_cache_ttl > 0:
+                    cached = self._group_cache.get(cache_key)
+                    metrics.cache_lookup(metrics.Cache.group, cached is not None)
+                if group_index is not None:
+                    self.log.debug(
+                        "username:%s Using the allowed_groups member index",
+                        resolved_username,
+                    )
+                    ldap_groups = group_index.get_groups(cache_key, resolved_username)
+                elif cached is not None:
+                    self.log.debug("username:%s Using cached groups", resolved_username)
+                    ldap_groups = list(cached)
+                elif use_member_of and user_entry is not None:
+                    ldap_groups = self._get_member_of_groups(user_entry)
+                    if self.group_cache_ttl > 0:
+                        self._group_cache.set(cache_key, tuple(ldap_groups))
+                else:
+
+                    async def get_ldap_groups():
+                        groups = await self._get_ldap_groups_async(
+                            conn, userdn, resolved_username
+                        )
+                        if self.group_cache_ttl > 0:
+                            self._group_cache.set(cache_key, tuple(groups))
+                        return groups
+
+                    ldap_groups = await self._coalesce(
+                        ("groups", cache_key, resolved_username),
+                        get_ldap_groups,
+                        lookups,
+                    )
+
+            if (
+                user_attributes is None
+                and user_entry is not None
+                and merge_auth_state_attributes
+            ):
+                user_attributes = self._get_auth_state_attributes(user_entry)
+            if user_attributes is None:
+                user_attributes = await self._coalesce(
+                    ("attributes", normalize_dn(userdn)),
+                    partial(self._get_user_attributes_async, conn, userdn),
+                    lookups,
+                )
+            self.log.debug("username:%s attributes:%s", login_username, user_attributes)
 
-        username = resolved_username if self.use_lookup_dn_username else login_username
-        auth_state = {
-            "ldap_groups": ldap_groups,
-            "user_attributes": user_attributes,
-        }
-        return {"name": username, "auth_state": auth_state}
+            username = (
+                resolved_username if self.use_lookup_dn_username else login_username
+            )
+            auth_state = {
+                "ldap_groups": ldap_groups,
+                "user_attributes": user_attributes,
+                "user_dn": userdn,
+            }
+            if self.refresh_user_interval > 0:
+                self._refreshed_users.set(username, True)
+            return {"name": username, "auth_state": auth_state}
+        finally:
+            lookups = [task for task in lookups if not task.done()]
+            if lookups:
+                # the login was cancelled while other logins may still be
+                # waiting for its lookups
+                self._run_in_background(self._close_connection_after(conn, lookups))
+            else:
+                self._close_connection(conn)
 
     async def check_allowed(self, username, auth_model):
         if not hasattr(self, "allow_all"):
@@ -735,3 +3567,259 @@ class LDAPAuthenticator(Authenticator):
                 self.search_filter,
             )
         return False
+
+    async def refresh_user(self, user, handler=None):
+        """
+        Reads the user's `ldap_groups` and `user_attributes` again from the
+        LDAP server, if `refresh_user_interval` has passed since the user
+        logged in or was refreshed.
+
+        Returns True if the user doesn't need to or can't be refreshed now,
+        False if the user has to log in again as the user's entry no longer
+        exists or the user is no longer allowed, and the refreshed auth model
+        otherwise.
+
+        ref: https://jupyterhub.readthedocs.io/en/latest/reference/api/auth.html#jupyterhub.auth.Authenticator.refresh_user
+        """
+        if self.refresh_user_interval <= 0 or user.name in self._refreshed_users:
+            return True
+        auth_state = await user.get_auth_state()
+        userdn = (auth_state or {}).get("user_dn")
+        if not userdn:
+            return True
+
+        refreshed = await self._refresh_user_entry(userdn, user.name)
+        if refreshed is None:
+            # the LDAP server couldn't be asked, try again next time
+            return True
+        if refreshed is False:
+            self.log.warning(
+                "username:%s Login required, the user's entry %s no longer exists",
+                user.name,
+                userdn,
+            )
+            return False
+
+        ldap_groups, user_attributes = refreshed
+        auth_state = dict(
+            auth_state, ldap_groups=ldap_groups, user_attributes=user_attributes
+        )
+        auth_model = {"name": user.name, "auth_state": auth_state}
+        if not await self.check_allowed(user.name, auth_model):
+            self.log.warning(
+                "username:%s Login required, the user is no longer allowed",
+                user.name,
+            )
+            return False
+        self._refreshed_users.set(user.name, True)
+        if self.allowed_groups and self.group_cache_ttl > 0:
+            self._group_cache.set(normalize_dn(userdn), tuple(ldap_groups))
+        return auth_model
+
+    async def _refresh_user_entry(self, userdn, uid):
+        """
+        Returns (ldap_groups, user_attributes) read again for a user, False if
+        the user's entry no longer exists, or None if it couldn't be read.
+
+        Refreshes requested within `refresh_user_batch_delay` of each other
+        are batched together.
+        """
+        key = normalize_dn(userdn)
+        pending = self._refresh_pending.get(key)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = self._refresh_pending[key] = (userdn, uid, loop.create_future())
+            if len(self._refresh_pending) >= self.refresh_user_batch_size:
+                self._flush_refreshes()
+            elif self._refresh_flush is None:
+                self._refresh_flush = loop.call_later(
+                    self.refresh_user_batch_delay, self._flush_refreshes
+                )
+        # shielded as other refreshes of the same user may await it as well
+        return await asyncio.shield(pending[2])
+
+    def _flush_refreshes(self):
+        """
+        Starts refreshing the batch of pending refreshes.
+        """
+        if self._refresh_flush is not None:
+            self._refresh_flush.cancel()
+            self._refresh_flush = None
+        batch, self._refresh_pending = self._refresh_pending, {}
+        if batch:
+            self._run_in_background(self._refresh_batch(batch))
+
+    async def _refresh_batch(self, batch):
+        users = [(userdn, uid) for userdn, uid, _ in batch.values()]
+        try:
+            results = await self._run_service_searches_async(
+                partial(self._refresh_searches, users), metrics.SearchPhase.refresh
+            )
+        except Exception as e:
+            self.log.error(f"Failed to refresh {len(users)} users: {e}")
+            results = None
+        for key, (_, _, future) in batch.items():
+            if not future.done():
+                future.set_result(None if results is None else results.get(key, False))
+
+    def _refresh_searches(self, users):
+        """
+        Generator yielding the combined searches reading the entries and
+        groups of users given as (userdn, uid), see `_run_searches`, and
+        returning {normalized userdn: (ldap_groups, user_attributes)} for the
+        users whose entry was found.
+        """
+        batch_size = max(self.refresh_user_batch_size, 1)
+        merge_auth_state_attributes = self._merge_auth_state_attributes()
+        attributes = []
+        if merge_auth_state_attributes:
+            attributes = list(self.auth_state_attributes)
+        if self.allowed_groups and (
+            self.group_lookup_strategy == GroupLookupStrategy.member_of
+        ):
+            attributes = _union(attributes, [self.member_of_attribute])
+        if self.lookup_dn and self.lookup_dn_user_dn_attribute:
+            attributes = _union(attributes, [self.lookup_dn_user_dn_attribute])
+        attributes = attributes or ldap3.NO_ATTRIBUTES
+
+        # the entries of users under the same parent entry are read with one
+        # search for their RDNs
+        parents = {}
+        for userdn, _ in users:
+            try:
+                parent_dn, rdn_filter = _rdn_filter(userdn)
+            except LDAPInvalidDnError:
+                continue
+            parents.setdefault(normalize_dn(parent_dn), (parent_dn, []))[1].append(
+                rdn_filter
+            )
+        entries = {}
+        for parent_dn, rdn_filters in parents.values():
+            for i in range(0, len(rdn_filters), batch_size):
+                chunk = rdn_filters[i : i + batch_size]
+                found = yield dict(
+                    search_base=parent_dn,
+                    search_scope=ldap3.LEVEL,
+                    search_filter=_any_filter(chunk),
+                    attributes=attributes,
+                )
+                for entry in found:
+                    entries[normalize_dn(entry.entry_dn)] = entry
+        for userdn, _ in users:
+            if normalize_dn(userdn) not in entries:
+                # make sure an entry not found by its RDN doesn't exist, as
+                # RDN values can be matched differently by a search filter
+                found = yield dict(
+                    search_base=userdn,
+                    search_scope=ldap3.BASE,
+                    search_filter="(objectClass=*)",
+                    attributes=attributes,
+                )
+                if found:
+                    entries[normalize_dn(userdn)] = found[0]
+
+        found_users = []
+        for userdn, uid in users:
+            entry = entries.get(normalize_dn(userdn))
+            if entry is None:
+                continue
+            if self.lookup_dn and self.lookup_dn_user_dn_attribute:
+                # like when logging in, the uid is the looked up username
+                values = _attribute_values(entry, self.lookup_dn_user_dn_attribute)
+                if len(values) == 1:
+                    uid = values[0]
+            found_users.append((userdn, uid, entry))
+
+        ldap_groups = yield from self._refresh_groups_searches(found_users)
+        results = {}
+        for userdn, _, entry in found_users:
+            if merge_auth_state_attributes:
+                user_attributes = self._get_auth_state_attributes(entry)
+            else:
+                user_attributes = yield from self._user_attributes_searches(userdn)
+            results[normalize_dn(userdn)] = (
+                ldap_groups.get(normalize_dn(userdn), []),
+                user_attributes,
+            )
+        return results
+
+    def _refresh_groups_searches(self, users):
+        """
+        Generator yielding the combined searches determining the groups of
+        users given as (userdn, uid, entry), see `_run_searches`, and
+        returning {normalized userdn: ldap_groups}.
+        """
+        if not self.allowed_groups or not users:
+            return {}
+        if self.nested_group_lookup != NestedGroupLookup.disabled:
+            # nested groups are looked up per user, with their parent groups
+            # cached across users
+            found_groups = {}
+            for userdn, uid, _ in users:
+                found_groups[normalize_dn(userdn)] = yield from (
+                    self._ldap_groups_searches(userdn, uid)
+                )
+            return found_groups
+        if self.group_lookup_strategy == GroupLookupStrategy.member_of:
+            return {
+                normalize_dn(userdn): self._get_member_of_groups(entry)
+                for userdn, _, entry in users
+            }
+
+        group_search_base = None
+        if self.group_lookup_strategy == GroupLookupStrategy.subtree:
+            group_search_base = self._get_group_search_base()
+        if group_search_base:
+            bases = [(group_search_base, ldap3.SUBTREE)]
+        else:
+            bases = [(group, ldap3.BASE) for group in self.allowed_groups]
+
+        batch_size = max(self.refresh_user_batch_size, 1)
+        found_groups = {normalize_dn(userdn): [] for userdn, _, _ in users}
+        for i in range(0, len(users), batch_size):
+            chunk = users[i : i + batch_size]
+            search_filter = _any_filter(
+                [
+                    self.group_search_filter.format(
+                        userdn=escape_filter_chars(userdn),
+                        uid=escape_filter_chars(uid),
+                    )
+                    for userdn, uid, _ in chunk
+                ]
+            )
+            for search_base, search_scope in bases:
+                found = yield dict(
+                    search_base=search_base,
+                    search_scope=search_scope,
+                    search_filter=search_filter,
+                    attributes=self.group_attributes,
+                )
+                for group_entry in found:
+                    for userdn, _, _ in self._group_members(group_entry, chunk):
+                        found_groups[normalize_dn(userdn)].append(group_entry.entry_dn)
+        return {
+            key: self._filter_allowed_groups(dns) for key, dns in found_groups.items()
+        }
+
+    def _group_members(self, group_entry, users):
+        """
+        Returns the users, given as (userdn, uid, entry), whose part of a
+        combined `group_search_filter` matched a group entry found by it.
+        """
+        if len(users) == 1 or not re.search(
+            r"{(userdn|uid)}", self.group_search_filter
+        ):
+            # the group matched the filter of all the users
+            return users
+        # tell the users apart by the group's group_attributes values, like
+        # the default group_search_filter matches them
+        values = {
+            value
+            for values in group_entry.entry_attributes_as_dict.values()
+            for value in values
+            if isinstance(value, str)
+        }
+        dns = {normalize_dn(value) for value in values}
+        return [
+            user for user in users if normalize_dn(user[0]) in dns or user[1] in values
+        ]
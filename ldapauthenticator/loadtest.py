@@ -0,0 +1,382 @@
+"""
+Load test of LDAPAuthenticator logins against an LDAP server
+
+Builds an LDAPAuthenticator from a jupyterhub_config.py file, and makes logins
+with a mix of good credentials, read from a CSV file of username,password
+lines, bad credentials, being the good usernames with a wrong password, and
+unknown usernames. Logins are started at a target rate, with at most a number
+of them in progress at the same time, for a duration.
+
+Reports the logins made per second and their latency per kind of credentials,
+and the latency of the LDAP operations per phase of the logins, estimated from
+LDAPAuthenticator's Prometheus metrics.
+
+Usage:
+
+    python -m ldapauthenticator.loadtest --credentials users.csv
+    python -m ldapauthenticator.loadtest --config /etc/jupyterhub/jupyterhub_config.py \\
+        --credentials users.csv --rate 50 --concurrency 20 --duration 60 \\
+        --mix good=0.8,bad=0.15,unknown=0.05
+
+Logins are made against the LDAP server as configured, so use test accounts,
+and mind that the LDAP server may lock accounts after failed logins. Login
+throttling, if configured, applies as usual.
+"""
+
+import argparse
+import asyncio
+import csv
+import random
+import statistics
+import time
+from collections import defaultdict
+
+from traitlets.config.loader import PyFileConfigLoader
+
+from . import metrics
+from .ldapauthenticator import LDAPAuthenticator
+
+KINDS = ["good", "bad", "unknown"]
+
+# histograms of LDAP operations reported per phase, and the label telling
+# phases apart, if any
+PHASE_HISTOGRAMS = [
+    ("connect", metrics.LDAP_CONNECT_DURATION_SECONDS, None),
+    ("start_tls", metrics.LDAP_START_TLS_DURATION_SECONDS, None),
+    ("bind", metrics.LDAP_BIND_DURATION_SECONDS, None),
+    ("search", metrics.LDAP_SEARCH_DURATION_SECONDS, "phase"),
+]
+
+
+def load_config(path, server_address=None):
+    """
+    Returns the traitlets Config loaded from a jupyterhub_config.py file,
+    optionally overriding `server_address`.
+    """
+    config = PyFileConfigLoader(path).load_config()
+    if server_address:
+        config.LDAPAuthenticator.server_address = server_address
+    return config
+
+
+def load_credentials(path):
+    """
+    Returns the (username, password) pairs of a CSV file.
+    """
+    with open(path, newline="") as f:
+        return [(row[0], row[1]) for row in csv.reader(f) if len(row) >= 2]
+
+
+def parse_mix(mix):
+    """
+    Parses a mix like "good=0.8,bad=0.15,unknown=0.05" into a dict of weights.
+    """
+    weights = dict.fromkeys(KINDS, 0.0)
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in weights:
+            raise ValueError(f"Unknown kind of credentials {kind!r} in {mix!r}")
+        weights[kind] = float(weight)
+    if sum(weights.values()) <= 0:
+        raise ValueError(f"No credentials to use in {mix!r}")
+    return weights
+
+
+def _positive(type_):
+    """
+    Returns an argparse type converting to `type_` values greater than 0.
+    """
+
+    def convert(value):
+        converted = type_(value)
+        if converted <= 0:
+            raise argparse.ArgumentTypeError(f"{value!r} must be greater than 0")
+        return converted
+
+    convert.__name__ = type_.__name__
+    return convert
+
+
+def _histogram_snapshot(histogram, phase_label):
+    """
+    Returns {phase: {"count", "sum", "buckets"}} of a histogram, summed over
+    its other labels, with cumulative bucket counts by upper bound.
+    """
+    snapshot = defaultdict(lambda: {"count": 0, "sum": 0, "buckets": defaultdict(int)})
+    for metric in histogram.collect():
+        for sample in metric.samples:
+            phase = sample.labels.get(phase_label) if phase_label else None
+            totals = snapshot[phase]
+            if sample.name.endswith("_bucket"):
+                totals["buckets"][float(sample.labels["le"])] += sample.value
+            elif sample.name.endswith("_count"):
+                totals["count"] += sample.value
+            elif sample.name.endswith("_sum"):
+                totals["sum"] += sample.value
+    return snapshot
+
+
+def metrics_snapshot():
+    """
+    Returns the totals of the histograms reported per phase.
+    """
+    return {
+        name: _histogram_snapshot(histogram, phase_label)
+        for name, histogram, phase_label in PHASE_HISTOGRAMS
+    }
+
+
+def _bucket_quantile(q, buckets, count):
+    """
+    Estimates a quantile from cumulative bucket counts, interpolating within
+    the bucket like Prometheus' histogram_quantile does.
+    """
+    rank = q * count
+    lower_bound, lower_count = 0.0, 0
+    for bound in sorted(buckets):
+        cumulative = buckets[bound]
+        if cumulative >= rank:
+            if bound == float("inf"):
+                return lower_bound
+            if cumulative == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (
+                cumulative - lower_count
+            )
+        lower_bound, lower_count = bound, cumulative
+    return lower_bound
+
+
+def phase_results(before, after, duration):
+    """
+    Returns rows reporting the LDAP operations made per phase between two
+    snapshots of the metrics.
+    """
+    rows = []
+    for name, _, _ in PHASE_HISTOGRAMS:
+        for phase, totals in sorted(after[name].items(), key=lambda i: str(i[0])):
+            previous = before[name].get(phase)
+            count = totals["count"] - (previous["count"] if previous else 0)
+            if count <= 0:
+                continue
+            total = totals["sum"] - (previous["sum"] if previous else 0)
+            buckets = {
+                bound: value - (previous["buckets"].get(bound, 0) if previous else 0)
+                for bound, value in totals["buckets"].items()
+            }
+            rows.append(
+                {
+                    "phase": f"{name}:{phase}" if phase else name,
+                    "ops": int(count),
+                    "ops/s": count / duration,
+                    "mean ms": 1e3 * total / count,
+                    "~p50 ms": 1e3 * _bucket_quantile(0.5, buckets, count),
+                    "~p99 ms": 1e3 * _bucket_quantile(0.99, buckets, count),
+                }
+            )
+    return rows
+
+
+def login_results(latencies, outcomes, duration):
+    """
+    Returns rows reporting the logins made per kind of credentials.
+    """
+    rows = []
+    for kind in KINDS:
+        values = latencies[kind]
+        if not values:
+            continue
+        if len(values) > 1:
+            percentiles = statistics.quantiles(values, n=100, method="inclusive")
+            p50, p90, p99 = percentiles[49], percentiles[89], percentiles[98]
+        else:
+            p50 = p90 = p99 = values[0]
+        rows.append(
+            {
+                "credentials": kind,
+                "logins": len(values),
+                "logins/s": len(values) / duration,
+                "p50 ms": 1e3 * p50,
+                "p90 ms": 1e3 * p90,
+                "p99 ms": 1e3 * p99,
+                "max ms": 1e3 * max(values),
+                "accepted": outcomes[kind]["accepted"],
+                "denied": outcomes[kind]["denied"],
+                "errors": outcomes[kind]["errors"],
+            }
+        )
+    return rows
+
+
+async def run_loadtest(
+    authenticator,
+    credentials,
+    mix,
+    rate,
+    concurrency,
+    duration,
+    seed=None,
+):
+    """
+    Makes logins with the authenticator at `rate` logins per second, at most
+    `concurrency` at the time, for `duration` seconds, and returns the rows
+    of the report of the logins and of the phases.
+
+    Logins that can't start on time, because `concurrency` logins are in
+    progress, start as soon as one completes, so that a lower rate than the
+    target shows that the target couldn't be kept up with.
+    """
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = defaultdict(list)
+    outcomes = defaultdict(lambda: dict.fromkeys(["accepted", "denied", "errors"], 0))
+    errors = defaultdict(int)
+
+    def make_data(kind):
+        if kind == "unknown":
+            username = f"loadtest-unknown-{rng.randrange(10**9)}"
+            return {"username": username, "password": username}
+        username, password = rng.choice(credentials)
+        if kind == "bad":
+            password = f"{password}-wrong-{rng.randrange(10**9)}"
+        return {"username": username, "password": password}
+
+    async def login(kind, data):
+        try:
+            start = time.perf_counter()
+            try:
+                # like JupyterHub, so that logins not allowed are denied
+                result = await authenticator.get_authenticated_user(None, data)
+            except Exception as e:
+                outcomes[kind]["errors"] += 1
+                errors[f"{e.__class__.__name__}: {e}"] += 1
+            else:
+                outcomes[kind]["accepted" if result else "denied"] += 1
+            latencies[kind].append(time.perf_counter() - start)
+        finally:
+            semaphore.release()
+
+    before = metrics_snapshot()
+    tasks = []
+    start = time.perf_counter()
+    n = 0
+    while True:
+        # start logins at the target rate, relative to the start
+        next_start = start + n / rate
+        now = time.perf_counter()
+        if next_start - start >= duration:
+            break
+        if next_start > now:
+            await asyncio.sleep(next_start - now)
+        await semaphore.acquire()
+        kind = rng.choices(kinds, weights)[0]
+        tasks.append(asyncio.ensure_future(login(kind, make_data(kind))))
+        n += 1
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    after = metrics_snapshot()
+    return (
+        login_results(latencies, outcomes, elapsed),
+        phase_results(before, after, elapsed),
+        dict(errors),
+    )
+
+
+def print_table(rows):
+    if not rows:
+        return
+    columns = list(rows[0])
+    cells = [
+        [f"{v:.2f}" if isinstance(v, float) else str(v) for v in row.values()]
+        for row in rows
+    ]
+    widths = [
+        max(len(c), *(len(row[i]) for row in cells)) for i, c in enumerate(columns)
+    ]
+    print("  ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    for row in cells:
+        print("  ".join(v.rjust(w) for v, w in zip(row, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m ldapauthenticator.loadtest",
+        description=__doc__.split("\n\n")[0],
+    )
+    parser.add_argument(
+        "--config",
+        default="jupyterhub_config.py",
+        help="JupyterHub config file configuring LDAPAuthenticator",
+    )
+    parser.add_argument(
+        "--server-address", help="LDAP server to use instead of the configured one"
+    )
+    parser.add_argument(
+        "--credentials",
+        required=True,
+        help="CSV file of username,password lines of accounts that can log in",
+    )
+    parser.add_argument(
+        "--mix",
+        default="good=0.8,bad=0.15,unknown=0.05",
+        help="weights of good, bad and unknown credentials",
+    )
+    parser.add_argument(
+        "--rate",
+        type=_positive(float),
+        default=10,
+        help="target logins started per second",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=_positive(int),
+        default=10,
+        help="maximum logins in progress",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="seconds to start logins for"
+    )
+    parser.add_argument("--seed", type=int, help="seed of the random credentials")
+    args = parser.parse_args(argv)
+
+    credentials = load_credentials(args.credentials)
+    if not credentials:
+        parser.error(f"No credentials found in {args.credentials}")
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    config = load_config(args.config, args.server_address)
+    authenticator = LDAPAuthenticator(config=config)
+
+    logins, phases, errors = asyncio.run(
+        run_loadtest(
+            authenticator,
+            credentials,
+            mix,
+            rate=args.rate,
+            concurrency=args.concurrency,
+            duration=args.duration,
+            seed=args.seed,
+        )
+    )
+    if authenticator.trait_has_value("executor"):
+        # the executor is only created once used, which it isn't with
+        # executor_threads=0
+        authenticator.executor.shutdown()
+
+    print_table(logins)
+    print()
+    print_table(phases)
+    if errors:
+        print()
+        print("errors:")
+        for error, count in sorted(errors.items(), key=lambda i: -i[1]):
+            print(f"  {count:6d}  {error}")
+
+
+if __name__ == "__main__":
+    main()
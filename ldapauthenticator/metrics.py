@@ -0,0 +1,198 @@
+"""
+Prometheus metrics exported by LDAPAuthenticator
+
+The metrics are registered with prometheus_client's default registry, like
+JupyterHub's own metrics, so they are exported by JupyterHub's /metrics
+endpoint with the same namespace prefix, for example as
+`jupyterhub_ldap_bind_duration_seconds`.
+
+Metrics labelled by `server` are labelled by the host of the LDAP server, as
+configured by `server_address`.
+"""
+
+import time
+from contextlib import contextmanager, nullcontext
+from enum import Enum
+
+from jupyterhub.metrics import metrics_prefix
+from prometheus_client import Counter, Histogram
+
+from . import tracing
+
+# LDAP operations are expected to take milliseconds, not seconds
+ldap_duration_buckets = [
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    float("inf"),
+]
+
+LDAP_CONNECT_DURATION_SECONDS = Histogram(
+    "ldap_connect_duration_seconds",
+    "Time taken to open a connection to an LDAP server, including TLS with use_ssl",
+    ["server", "status"],
+    buckets=ldap_duration_buckets,
+    namespace=metrics_prefix,
+)
+
+LDAP_START_TLS_DURATION_SECONDS = Histogram(
+    "ldap_start_tls_duration_seconds",
+    "Time taken to upgrade a connection to an LDAP server with StartTLS",
+    ["server", "status"],
+    buckets=ldap_duration_buckets,
+    namespace=metrics_prefix,
+)
+
+LDAP_BIND_DURATION_SECONDS = Histogram(
+    "ldap_bind_duration_seconds",
+    "Time taken to bind to an LDAP server",
+    ["server", "status"],
+    buckets=ldap_duration_buckets,
+    namespace=metrics_prefix,
+)
+
+LDAP_SEARCH_DURATION_SECONDS = Histogram(
+    "ldap_search_duration_seconds",
+    "Time taken by searches of an LDAP server, per phase of a login or background task",
+    ["server", "phase", "status"],
+    buckets=ldap_duration_buckets,
+    namespace=metrics_prefix,
+)
+
+LDAP_BIND_DN_TEMPLATE_ATTEMPTS = Histogram(
+    "ldap_bind_dn_template_attempts",
+    "Number of bind_dn_template entries bound with per login",
+    ["status"],
+    buckets=[1, 2, 3, 5, 10, float("inf")],
+    namespace=metrics_prefix,
+)
+
+LDAP_SERVER_FAILOVERS = Counter(
+    "ldap_server_failovers",
+    "Number of times connecting to an LDAP server failed, failing over to the next server if any",
+    ["server"],
+    namespace=metrics_prefix,
+)
+
+LDAP_CACHE_REQUESTS = Counter(
+    "ldap_cache_requests",
+    "Number of lookups in the caches of LDAPAuthenticator",
+    ["cache", "status"],
+    namespace=metrics_prefix,
+)
+
+
+class OperationStatus(Enum):
+    """
+    Possible values for 'status' label of the LDAP operation metrics
+    """
+
+    success = "success"
+    # the LDAP server rejected the operation, such as a bind with invalid
+    # credentials
+    rejected = "rejected"
+    error = "error"
+
+    def __str__(self):
+        return self.value
+
+
+class SearchPhase(Enum):
+    """
+    Possible values for 'phase' label of LDAP_SEARCH_DURATION_SECONDS
+    """
+
+    lookup = "lookup"
+    search_filter = "search_filter"
+    groups = "groups"
+    attributes = "attributes"
+    refresh = "refresh"
+    group_index = "group_index"
+
+    def __str__(self):
+        return self.value
+
+
+class Cache(Enum):
+    """
+    Possible values for 'cache' label of LDAP_CACHE_REQUESTS
+    """
+
+    group = "group"
+    group_parents = "group_parents"
+    unknown_user = "unknown_user"
+    lookup_dn = "lookup_dn"
+    bind_dn_template = "bind_dn_template"
+    credential = "credential"
+
+    def __str__(self):
+        return self.value
+
+
+class CacheStatus(Enum):
+    """
+    Possible values for 'status' label of LDAP_CACHE_REQUESTS
+    """
+
+    hit = "hit"
+    miss = "miss"
+
+    def __str__(self):
+        return self.value
+
+
+for s in OperationStatus:
+    LDAP_BIND_DN_TEMPLATE_ATTEMPTS.labels(status=s)
+
+for c in Cache:
+    for s in CacheStatus:
+        LDAP_CACHE_REQUESTS.labels(cache=c, status=s)
+
+
+def cache_lookup(cache, hit):
+    """
+    Counts a lookup in a cache, returning whether it was a hit.
+    """
+    LDAP_CACHE_REQUESTS.labels(
+        cache=cache, status=CacheStatus.hit if hit else CacheStatus.miss
+    ).inc()
+    return hit
+
+
+@contextmanager
+def observe_duration(histogram, span=None, **labels):
+    """
+    Observes the duration of a with block with the histogram, labelled with
+    labels and the operation's status, the value of the yielded dict's
+    "status" key. The status is "success" unless set otherwise, or "error" if
+    the block raised without setting it.
+
+    With `span`, the block is also traced as a span with that name, see
+    `tracing.start_span`, with the labels as attributes. The span is the
+    yielded dict's "span", None if not tracing.
+    """
+    outcome = {"status": OperationStatus.success, "span": None}
+    start = time.perf_counter()
+    with tracing.start_span(span, **labels) if span else nullcontext() as traced:
+        outcome["span"] = traced
+        try:
+            yield outcome
+        except BaseException:
+            if outcome["status"] == OperationStatus.success:
+                outcome["status"] = OperationStatus.error
+            raise
+        finally:
+            histogram.labels(status=outcome["status"], **labels).observe(
+                time.perf_counter() - start
+            )
+            tracing.set_attributes(traced, status=outcome["status"])
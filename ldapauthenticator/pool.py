@@ -0,0 +1,284 @@
+import random
+import select
+import threading
+import time
+from collections import deque
+
+from ldap3.core.exceptions import LDAPCommunicationError
+
+
+class ConnectionPool:
+    """
+    A thread safe pool of long-lived ldap3 connections, all established and
+    bound the same way by calling `connect`.
+
+    Idle connections are handed out again as long as they are still alive and
+    within the `max_idle` and `max_lifetime` limits (in seconds, 0 disables a
+    limit), otherwise they are unbound and replaced by a new connection. At
+    most `size` idle connections are kept, surplus connections are unbound
+    when returned to the pool.
+    """
+
+    def __init__(self, connect, size, max_idle=0, max_lifetime=0, log=None):
+        self.connect = connect
+        self.size = size
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.log = log
+        self._idle = deque()
+        # connection -> creation time, of connections handed out by acquire
+        self._acquired = {}
+        self._lock = threading.Lock()
+
+    def _is_alive(self, conn):
+        """
+        Checks without a round trip to the server that the connection is
+        still open and bound. A socket that is readable while we await no
+        response has either been closed by the server or received a notice of
+        disconnection, so it is considered dead.
+        """
+        if conn.closed or not conn.bound:
+            return False
+        sock = getattr(conn, "socket", None)
+        if sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def _is_usable(self, item, now):
+        conn, created, last_used = item
+        if self.max_lifetime and now - created > self.max_lifetime:
+            return False
+        if self.max_idle and now - last_used > self.max_idle:
+            return False
+        return self._is_alive(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.unbind()
+        except Exception as e:
+            if self.log:
+                self.log.debug(f"Failed to unbind discarded pooled connection: {e}")
+
+    def _checkout_idle(self):
+        """
+        Returns (conn, created) for an idle usable connection, or None if
+        there is none.
+        """
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                item = self._idle.pop() if self._idle else None
+            if item is None:
+                return None
+            if self._is_usable(item, now):
+                return item[0], item[1]
+            self._discard(item[0])
+
+    def _checkout(self):
+        """
+        Returns (conn, created, reused) for an idle usable connection if there
+        is one, or for a newly established connection. conn is None if a new
+        connection couldn't be bound.
+        """
+        item = self._checkout_idle()
+        if item is not None:
+            return item[0], item[1], True
+        return self.connect(), time.monotonic(), False
+
+    def _checkin(self, conn, created):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((conn, created, time.monotonic()))
+                return
+        self._discard(conn)
+
+    def run(self, func):
+        """
+        Calls `func(conn)` with a pooled connection and returns its result.
+
+        If a reused connection turns out to have been disconnected by the
+        server, it is discarded and `func` is retried once with a newly
+        established connection.
+        """
+        conn, created, reused = self._checkout()
+        while True:
+            if conn is None:
+                return func(None)
+            try:
+                result = func(conn)
+            except LDAPCommunicationError as e:
+                self._discard(conn)
+                if not reused:
+                    raise
+                if self.log:
+                    self.log.debug(f"Reconnecting pooled connection after: {e}")
+                conn, created, reused = self.connect(), time.monotonic(), False
+                continue
+            except BaseException:
+                self._checkin(conn, created)
+                raise
+            self._checkin(conn, created)
+            return result
+
+    async def run_async(self, func):
+        """
+        Like `run`, for a pool whose `connect` and `func` are coroutine
+        functions, such as a pool of AsyncConnection objects.
+        """
+        item = self._checkout_idle()
+        if item is not None:
+            conn, created, reused = item[0], item[1], True
+        else:
+            conn, created, reused = await self.connect(), time.monotonic(), False
+        while True:
+            if conn is None:
+                return await func(None)
+            try:
+                result = await func(conn)
+            except LDAPCommunicationError as e:
+                self._discard(conn)
+                if not reused:
+                    raise
+                if self.log:
+                    self.log.debug(f"Reconnecting pooled connection after: {e}")
+                conn, created, reused = await self.connect(), time.monotonic(), False
+                continue
+            except BaseException:
+                self._checkin(conn, created)
+                raise
+            self._checkin(conn, created)
+            return result
+
+    def fill(self):
+        """
+        Establishes connections until `size` connections are idle, returning
+        the number of connections established. Raises like `connect` does, and
+        stops early if a connection couldn't be bound.
+        """
+        established = 0
+        while len(self._idle) < self.size:
+            conn = self.connect()
+            if conn is None:
+                break
+            self._checkin(conn, time.monotonic())
+            established += 1
+        return established
+
+    async def fill_async(self):
+        """
+        Like `fill`, for a pool whose `connect` is a coroutine function.
+        """
+        established = 0
+        while len(self._idle) < self.size:
+            conn = await self.connect()
+            if conn is None:
+                break
+            self._checkin(conn, time.monotonic())
+            established += 1
+        return established
+
+    def acquire(self):
+        """
+        Returns an idle usable connection, or None if there is none, for the
+        caller to use until handing it back with `release` or `discard`.
+        """
+        item = self._checkout_idle()
+        if item is None:
+            return None
+        conn, created = item
+        with self._lock:
+            self._acquired[conn] = created
+        return conn
+
+    def release(self, conn):
+        """
+        Hands back a connection to the pool, be it acquired from the pool or
+        established by the caller the same way `connect` does.
+        """
+        with self._lock:
+            created = self._acquired.pop(conn, None)
+        if created is None:
+            created = time.monotonic()
+        self._checkin(conn, created)
+
+    def discard(self, conn):
+        """
+        Unbinds a connection acquired from the pool instead of releasing it.
+        """
+        with self._lock:
+            self._acquired.pop(conn, None)
+        self._discard(conn)
+
+    def close(self):
+        """
+        Unbinds all idle connections.
+        """
+        with self._lock:
+            items = list(self._idle)
+            self._idle.clear()
+        for conn, _, _ in items:
+            self._discard(conn)
+
+
+class ServerPool:
+    """
+    A thread safe pool of ldap3 Server objects to fail over between.
+
+    `get_servers` returns the servers to try connecting to in order, as
+    decided by `strategy` ("first", "round_robin" or "random"). Servers marked
+    down are skipped for `down_time` seconds, or until marked up again, unless
+    all servers are marked down.
+    """
+
+    def __init__(self, servers, strategy="first", down_time=60):
+        self.servers = list(servers)
+        self.strategy = strategy
+        self.down_time = down_time
+        self._down_since = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(server):
+        return (server.host, server.port)
+
+    def is_down(self, server, now=None):
+        now = time.monotonic() if now is None else now
+        down_since = self._down_since.get(self._key(server))
+        return down_since is not None and now - down_since < self.down_time
+
+    def get_servers(self):
+        now = time.monotonic()
+        with self._lock:
+            up = [s for s in self.servers if not self.is_down(s, now)]
+            if not up:
+                return list(self.servers)
+            if self.strategy == "round_robin":
+                start = self._next % len(up)
+                self._next = start + 1
+                up = up[start:] + up[:start]
+            elif self.strategy == "random":
+                random.shuffle(up)
+            return up
+
+    def mark_down(self, server):
+        """
+        Marks a server as down, returning True if it wasn't already.
+        """
+        with self._lock:
+            was_down = self.is_down(server)
+            self._down_since[self._key(server)] = time.monotonic()
+            return not was_down
+
+    def mark_up(self, server):
+        """
+        Marks a server as up, returning True if it was marked down.
+        """
+        with self._lock:
+            was_down = self.is_down(server)
+            self._down_since.pop(self._key(server), None)
+            return was_down
@@ -1,16 +1,50 @@
 import os
+from types import SimpleNamespace
 
+import ldap3
 import pytest
 from traitlets.config import Config
 
+from .ldapserver import LDAPServer
+
+
+@pytest.fixture(scope="session")
+def ldap_address():
+    """
+    The host, port and ssl_port of the LDAP server to test against.
+
+    If LDAP_HOST is set, that's the server at LDAP_HOST on the standard ports,
+    like the OpenLDAP server started in a docker container by
+    ci/docker-ldap.sh. Otherwise, it's a bundled in-process LDAP server
+    serving the same directory.
+    """
+    if "LDAP_HOST" in os.environ:
+        yield SimpleNamespace(host=os.environ["LDAP_HOST"], port=389, ssl_port=636)
+        return
+    with LDAPServer() as server:
+        yield SimpleNamespace(
+            host=server.host, port=server.port, ssl_port=server.ssl_port
+        )
+
+
+@pytest.fixture()
+def ldap_server():
+    """
+    A bundled in-process LDAP server started for a test, whose hooks add
+    latency, disconnects and errors.
+    """
+    with LDAPServer() as server:
+        yield server
+
 
 @pytest.fixture()
-def c():
+def c(ldap_address):
     """
     A base configuration for LDAPAuthenticator that individual tests can adjust.
     """
     c = Config()
-    c.LDAPAuthenticator.server_address = os.environ.get("LDAP_HOST", "localhost")
+    c.LDAPAuthenticator.server_address = ldap_address.host
+    c.LDAPAuthenticator.server_port = ldap_address.port
     c.LDAPAuthenticator.lookup_dn = True
     c.LDAPAuthenticator.bind_dn_template = (
         "cn={username},ou=people,dc=planetexpress,dc=com"
@@ -26,3 +60,21 @@ def c():
     ]
 
     return c
+
+
+@pytest.fixture()
+def search_bases(monkeypatch):
+    """
+    Records the search base of every search made, except for searches ldap3
+    makes on its own to read server info and schema.
+    """
+    search_bases = []
+    search = ldap3.Connection.search
+
+    def recording_search(self, search_base, *args, **kwargs):
+        if search_base and not search_base.lower().startswith("cn=subschema"):
+            search_bases.append(search_base)
+        return search(self, search_base, *args, **kwargs)
+
+    monkeypatch.setattr(ldap3.Connection, "search", recording_search)
+    return search_bases
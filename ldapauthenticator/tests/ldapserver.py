@@ -0,0 +1,1005 @@
+"""
+A small in-process LDAPv3 server to test LDAPAuthenticator against
+
+The server runs an asyncio event loop in a background thread, and serves a
+directory held in memory, by default the planetexpress directory of the
+rroemhild/docker-test-openldap image that `ci/docker-ldap.sh` starts. It
+implements what LDAPAuthenticator and ldap3 use:
+
+- simple and anonymous binds, and unbind
+- the StartTLS extended operation, and LDAPS, with a generated self-signed
+  certificate
+- searches with base, one level and subtree scopes, the filters of RFC 4511
+  including extensible matches with Active Directory's LDAP_MATCHING_RULE_IN_CHAIN,
+  size limits, and the simple paged results control of RFC 2696
+- compare
+- the root DSE, and the schema of OpenLDAP 2.4 that ldap3 bundles, read by
+  ldap3 when binding
+
+Hooks add latency to operations, drop connections, and answer operations
+with errors, so that performance and resilience features can be tested
+deterministically:
+
+    with LDAPServer() as server:
+        server.latency = 0.01  # or per operation, {"bind": 0.05}
+        server.fail("bind", result_code=51, times=2)  # busy
+        server.disconnect("search")
+        ...
+        assert server.counts["bind"] == 3
+
+Matching is simplified: values are compared case insensitively with
+whitespace collapsed, DN valued attributes like `member` are compared as
+normalized DNs, and `userPassword` is only used to verify binds and is never
+returned.
+"""
+
+import asyncio
+import datetime
+import ipaddress
+import json
+import os
+import re
+import ssl
+import tempfile
+import threading
+from collections import Counter
+
+START_TLS_OID = "1.3.6.1.4.1.1466.20037"
+PAGED_RESULTS_OID = "1.2.840.113556.1.4.319"
+IN_CHAIN_RULE_OID = "1.2.840.113556.1.4.1941"
+SUBSCHEMA_DN = "cn=Subschema"
+
+# result codes of RFC 4511
+SUCCESS = 0
+OPERATIONS_ERROR = 1
+PROTOCOL_ERROR = 2
+SIZE_LIMIT_EXCEEDED = 4
+COMPARE_FALSE = 5
+COMPARE_TRUE = 6
+AUTH_METHOD_NOT_SUPPORTED = 7
+NO_SUCH_OBJECT = 32
+INVALID_CREDENTIALS = 49
+BUSY = 51
+UNAVAILABLE = 52
+UNWILLING_TO_PERFORM = 53
+
+# protocolOp tags of requests, and of their responses
+BIND_REQUEST = 0x60
+BIND_RESPONSE = 0x61
+UNBIND_REQUEST = 0x42
+SEARCH_REQUEST = 0x63
+SEARCH_RESULT_ENTRY = 0x64
+SEARCH_RESULT_DONE = 0x65
+COMPARE_REQUEST = 0x6E
+COMPARE_RESPONSE = 0x6F
+ABANDON_REQUEST = 0x50
+EXTENDED_REQUEST = 0x77
+EXTENDED_RESPONSE = 0x78
+
+OPERATIONS = {
+    BIND_REQUEST: "bind",
+    UNBIND_REQUEST: "unbind",
+    SEARCH_REQUEST: "search",
+    COMPARE_REQUEST: "compare",
+    ABANDON_REQUEST: "abandon",
+    EXTENDED_REQUEST: "extended",
+}
+
+# attributes whose values are DNs
+DN_ATTRIBUTES = {"member", "uniquemember", "memberof", "owner", "manager", "seealso"}
+# operational attributes, only returned if requested by name or with "+"
+OPERATIONAL_ATTRIBUTES = {"memberof"}
+
+PEOPLE_DN = "ou=people,dc=planetexpress,dc=com"
+ADMIN_DN = "cn=admin,dc=planetexpress,dc=com"
+ADMIN_PASSWORD = "GoodNewsEveryone"
+
+
+def _person(cn, uid, sn, description, employee_type, ou, groups, mail=None):
+    return (
+        f"cn={cn},{PEOPLE_DN}",
+        {
+            "objectClass": ["inetOrgPerson", "organizationalPerson", "person", "top"],
+            "cn": [cn],
+            "sn": [sn],
+            "description": [description],
+            "employeeType": employee_type,
+            "mail": mail or [f"{uid}@planetexpress.com"],
+            "ou": [ou],
+            "uid": [uid],
+            "userPassword": [uid],
+            "memberOf": [f"cn={group},{PEOPLE_DN}" for group in groups],
+        },
+    )
+
+
+def _group(cn, members):
+    return (
+        f"cn={cn},{PEOPLE_DN}",
+        {
+            "objectClass": ["groupOfNames", "top"],
+            "cn": [cn],
+            "member": [f"cn={member},{PEOPLE_DN}" for member in members],
+        },
+    )
+
+
+# the directory of ghcr.io/rroemhild/docker-test-openldap, without photos
+PLANETEXPRESS = [
+    (
+        "dc=planetexpress,dc=com",
+        {
+            "objectClass": ["top", "dcObject", "organization"],
+            "dc": ["planetexpress"],
+            "o": ["Planet Express"],
+        },
+    ),
+    (
+        ADMIN_DN,
+        {
+            "objectClass": ["simpleSecurityObject", "organizationalRole"],
+            "cn": ["admin"],
+            "userPassword": [ADMIN_PASSWORD],
+        },
+    ),
+    (PEOPLE_DN, {"objectClass": ["top", "organizationalUnit"], "ou": ["people"]}),
+    _person(
+        "Hubert J. Farnsworth",
+        "professor",
+        "Farnsworth",
+        "Human",
+        ["Owner", "Founder"],
+        "Office Management",
+        ["admin_staff"],
+        mail=["professor@planetexpress.com", "hubert@planetexpress.com"],
+    ),
+    _person(
+        "Philip J. Fry",
+        "fry",
+        "Fry",
+        "Human",
+        ["Delivery boy"],
+        "Delivering Crew",
+        ["ship_crew"],
+    ),
+    _person(
+        "John A. Zoidberg",
+        "zoidberg",
+        "Zoidberg",
+        "Decapodian",
+        ["Doctor"],
+        "Staff",
+        [],
+    ),
+    _person(
+        "Hermes Conrad",
+        "hermes",
+        "Conrad",
+        "Human",
+        ["Bureaucrat", "Accountant"],
+        "Office Management",
+        ["admin_staff"],
+    ),
+    _person(
+        "Turanga Leela",
+        "leela",
+        "Turanga",
+        "Mutant",
+        ["Captain", "Pilot"],
+        "Delivering Crew",
+        ["ship_crew"],
+    ),
+    _person(
+        "Bender Bending Rodríguez",
+        "bender",
+        "Rodríguez",
+        "Robot",
+        ["Ship's Robot"],
+        "Delivering Crew",
+        ["ship_crew"],
+    ),
+    _person(
+        "Amy Wong+sn=Kroker",
+        "amy",
+        "Kroker",
+        "Human",
+        ["Intern"],
+        "Intern",
+        [],
+    ),
+    _group("admin_staff", ["Hubert J. Farnsworth", "Hermes Conrad"]),
+    _group("ship_crew", ["Turanga Leela", "Philip J. Fry", "Bender Bending Rodríguez"]),
+]
+
+
+# BER encoding of the parts of LDAP messages used, RFC 4511 section 5.1
+
+
+def _encode_length(length):
+    if length < 0x80:
+        return bytes([length])
+    octets = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(octets)]) + octets
+
+
+def _tlv(tag, value):
+    return bytes([tag]) + _encode_length(len(value)) + value
+
+
+def _integer(value, tag=0x02):
+    return _tlv(tag, value.to_bytes((value.bit_length() + 8) // 8, "big", signed=True))
+
+
+def _enumerated(value):
+    return _integer(value, tag=0x0A)
+
+
+def _octets(value, tag=0x04):
+    if isinstance(value, str):
+        value = value.encode("utf8")
+    return _tlv(tag, value)
+
+
+def _sequence(*values, tag=0x30):
+    return _tlv(tag, b"".join(values))
+
+
+def _message_size(data):
+    """
+    Returns the size of the BER element at the start of data, or None if
+    its header hasn't been received in full yet.
+    """
+    if len(data) < 2:
+        return None
+    length = data[1]
+    if not length & 0x80:
+        return 2 + length
+    count = length & 0x7F
+    if len(data) < 2 + count:
+        return None
+    return 2 + count + int.from_bytes(data[2 : 2 + count], "big")
+
+
+def _read(data, offset=0):
+    """
+    Returns (tag, value, end) of the BER element at offset in data.
+    """
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        count = length & 0x7F
+        length = int.from_bytes(data[offset : offset + count], "big")
+        offset += count
+    return tag, data[offset : offset + length], offset + length
+
+
+def _elements(data):
+    """
+    Returns the (tag, value) of the BER elements of a constructed value.
+    """
+    elements = []
+    offset = 0
+    while offset < len(data):
+        tag, value, offset = _read(data, offset)
+        elements.append((tag, value))
+    return elements
+
+
+def _int(value):
+    return int.from_bytes(value, "big", signed=True)
+
+
+def _str(value):
+    return bytes(value).decode("utf8", errors="replace")
+
+
+def _decode_filter(tag, value):
+    """
+    Returns a filter as nested tuples, like ("equality", "uid", "fry").
+    """
+    if tag in (0xA0, 0xA1):
+        return (
+            "and" if tag == 0xA0 else "or",
+            [_decode_filter(*element) for element in _elements(value)],
+        )
+    if tag == 0xA2:
+        return ("not", _decode_filter(*_elements(value)[0]))
+    if tag == 0x87:
+        return ("present", _str(value))
+    if tag in (0xA3, 0xA5, 0xA6, 0xA8):
+        (_, attribute), (_, assertion) = _elements(value)
+        kind = {0xA3: "equality", 0xA5: "ge", 0xA6: "le", 0xA8: "equality"}[tag]
+        return (kind, _str(attribute), _str(assertion))
+    if tag == 0xA4:
+        (_, attribute), (_, substrings) = _elements(value)
+        initial, middle, final = None, [], None
+        for substring_tag, substring in _elements(substrings):
+            if substring_tag == 0x80:
+                initial = _str(substring)
+            elif substring_tag == 0x81:
+                middle.append(_str(substring))
+            else:
+                final = _str(substring)
+        return ("substrings", _str(attribute), initial, middle, final)
+    if tag == 0xA9:
+        parts = dict(_elements(value))
+        return (
+            "extensible",
+            _str(parts[0x81]) if 0x81 in parts else None,
+            _str(parts[0x82]) if 0x82 in parts else None,
+            _str(parts[0x83]),
+        )
+    raise ValueError(f"Unknown filter tag {tag:#x}")
+
+
+def _decode_controls(value):
+    """
+    Returns {oid: value} of the controls of a request.
+    """
+    controls = {}
+    for _, control in _elements(value):
+        parts = _elements(control)
+        control_value = parts[-1][1] if parts[-1][0] == 0x04 and len(parts) > 1 else b""
+        controls[_str(parts[0][1])] = control_value
+    return controls
+
+
+def decode_request(data):
+    """
+    Returns (message_id, operation, request) of a LDAP message, where
+    request is a dict of the fields of the operation used by the server.
+    """
+    _, message, _ = _read(data)
+    elements = _elements(message)
+    message_id = _int(elements[0][1])
+    tag, value = elements[1]
+    controls = {}
+    if len(elements) > 2 and elements[2][0] == 0xA0:
+        controls = _decode_controls(elements[2][1])
+    operation = OPERATIONS.get(tag, "unknown")
+    request = {"controls": controls}
+    if tag == BIND_REQUEST:
+        (_, version), (_, name), (auth_tag, credentials) = _elements(value)[:3]
+        request.update(
+            version=_int(version),
+            name=_str(name),
+            simple=auth_tag == 0x80,
+            password=_str(credentials) if auth_tag == 0x80 else None,
+        )
+    elif tag == SEARCH_REQUEST:
+        fields = _elements(value)
+        request.update(
+            base=_str(fields[0][1]),
+            scope=_int(fields[1][1]),
+            size_limit=_int(fields[3][1]),
+            filter=_decode_filter(*fields[6]),
+            attributes=[_str(a) for _, a in _elements(fields[7][1])],
+        )
+    elif tag == COMPARE_REQUEST:
+        (_, dn), (_, assertion) = _elements(value)
+        (_, attribute), (_, assertion_value) = _elements(assertion)
+        request.update(
+            dn=_str(dn), attribute=_str(attribute), value=_str(assertion_value)
+        )
+    elif tag == EXTENDED_REQUEST:
+        parts = dict(_elements(value))
+        request.update(name=_str(parts.get(0x80, b"")))
+        if request["name"] == START_TLS_OID:
+            operation = "start_tls"
+    return message_id, operation, request
+
+
+def encode_response(message_id, tag, *values, controls=None):
+    """
+    Returns a LDAP message with a response, and optionally response controls
+    as {oid: value}.
+    """
+    parts = [_integer(message_id), _sequence(*values, tag=tag)]
+    if controls:
+        parts.append(
+            _sequence(
+                *(
+                    _sequence(_octets(oid), _octets(value))
+                    for oid, value in controls.items()
+                ),
+                tag=0xA0,
+            )
+        )
+    return _sequence(*parts)
+
+
+def _result(result_code, matched_dn="", message=""):
+    return (_enumerated(result_code), _octets(matched_dn), _octets(message))
+
+
+# matching of values, much simplified from the matching rules of LDAP schemas
+
+
+def _unescape_dn_value(value):
+    return re.sub(
+        r"\\([0-9a-fA-F]{2}|.)",
+        lambda m: chr(int(m[1], 16)) if len(m[1]) == 2 else m[1],
+        value,
+    )
+
+
+def normalize_dn(dn):
+    """
+    Returns a DN normalized to be compared with other DNs.
+    """
+    rdns = []
+    for rdn in re.split(r"(?<!\\),", dn):
+        if not rdn.strip():
+            continue
+        avas = []
+        for ava in re.split(r"(?<!\\)\+", rdn):
+            attribute, _, value = ava.partition("=")
+            value = _normalize_value(_unescape_dn_value(value.strip()))
+            avas.append(f"{attribute.strip().lower()}={value}")
+        rdns.append("+".join(sorted(avas)))
+    return ",".join(rdns)
+
+
+def _normalize_value(value):
+    return " ".join(value.split()).casefold()
+
+
+def _normalize(attribute, value):
+    if attribute.lower() in DN_ATTRIBUTES:
+        return normalize_dn(value)
+    return _normalize_value(value)
+
+
+class Entry:
+    """
+    An entry of the directory, with case insensitive access to attributes.
+    """
+
+    def __init__(self, dn, attributes):
+        self.dn = dn
+        self.normalized_dn = normalize_dn(dn)
+        self.attributes = {name: list(values) for name, values in attributes.items()}
+        self._names = {name.lower(): name for name in self.attributes}
+
+    def get(self, attribute):
+        name = self._names.get(attribute.lower())
+        return self.attributes[name] if name else []
+
+    def normalized(self, attribute):
+        return {_normalize(attribute, value) for value in self.get(attribute)}
+
+    def select(self, attributes):
+        """
+        Returns the (name, values) of requested attributes to return.
+        """
+        requested = {attribute.lower() for attribute in attributes}
+        all_user = not requested or "*" in requested
+        all_operational = "+" in requested
+        selected = []
+        for name, values in self.attributes.items():
+            key = name.lower()
+            if not values or key == "userpassword":
+                continue
+            if key in requested or (
+                all_operational if key in OPERATIONAL_ATTRIBUTES else all_user
+            ):
+                selected.append((name, values))
+        return selected
+
+
+class LDAPServer:
+    """
+    A LDAPv3 server serving a directory in memory, on localhost, with plain
+    LDAP on `port` and LDAPS on `ssl_port`, by default on free ports.
+
+    `start` runs the server in a background thread and `stop` stops it, or
+    the server can be used as a context manager.
+
+    `counts` counts connections and operations, by operation name: "bind",
+    "search", "compare", "start_tls" and "unbind".
+    """
+
+    def __init__(self, entries=PLANETEXPRESS, host="127.0.0.1", port=0, ssl_port=0):
+        self.host = host
+        self.port = port
+        self.ssl_port = ssl_port
+        self.entries = {}
+        for dn, attributes in entries:
+            self.add_entry(dn, attributes)
+        self.counts = Counter()
+        # seconds to wait before answering an operation, for every operation
+        # or by operation name
+        self.latency = 0
+        self._faults = []
+        self._loop = None
+        self._thread = None
+        self._servers = []
+        self._connections = set()
+        self.ssl_context = make_ssl_context(host)
+
+    def add_entry(self, dn, attributes):
+        entry = Entry(dn, attributes)
+        self.entries[entry.normalized_dn] = entry
+        return entry
+
+    # hooks
+
+    def fail(self, operation, result_code=UNAVAILABLE, times=None, match=None):
+        """
+        Answers the next `times` operations, or all of them if None, with an
+        error result code instead of performing them.
+
+        `match` is optionally a function passed the request, a dict like
+        {"name": dn, "password": password} for a bind, returning whether the
+        fault applies to it.
+        """
+        self._faults.append([operation, result_code, times, match])
+
+    def disconnect(self, operation, times=None, match=None):
+        """
+        Drops the connection when receiving the next `times` operations, or
+        all of them if None, instead of answering them. The operation
+        "connect" drops connections as soon as they are accepted.
+        """
+        self.fail(operation, result_code=None, times=times, match=match)
+
+    def reset(self):
+        """
+        Removes all latency and faults, and resets the counts.
+        """
+        self.latency = 0
+        self._faults.clear()
+        self.counts.clear()
+
+    def _fault(self, operation, request):
+        """
+        Returns whether there is a fault for an operation, and its result
+        code, or None to disconnect.
+        """
+        for fault in self._faults:
+            fault_operation, result_code, times, match = fault
+            if fault_operation != operation or times == 0:
+                continue
+            if match is not None and not match(request):
+                continue
+            if times is not None:
+                fault[2] -= 1
+            return True, result_code
+        return False, None
+
+    def _latency(self, operation):
+        if isinstance(self.latency, dict):
+            return self.latency.get(operation, 0)
+        return self.latency
+
+    # lifecycle
+
+    def start(self):
+        """
+        Starts serving in a background thread, returning once listening.
+        """
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        async def serve():
+            for tls in (False, True):
+                server = await self._loop.create_server(
+                    lambda tls=tls: _Connection(self, tls),
+                    self.host,
+                    self.ssl_port if tls else self.port,
+                    ssl=self.ssl_context if tls else None,
+                )
+                self._servers.append(server)
+            self.port = self._servers[0].sockets[0].getsockname()[1]
+            self.ssl_port = self._servers[1].sockets[0].getsockname()[1]
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(serve())
+            finally:
+                started.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="ldapserver", daemon=True)
+        self._thread.start()
+        started.wait()
+        if len(self._servers) < 2:
+            self.stop()
+            raise RuntimeError(f"Failed to listen on {self.host}")
+        return self
+
+    def stop(self):
+        """
+        Stops serving, dropping open connections.
+        """
+        if self._thread is None:
+            return
+
+        async def stop():
+            for server in self._servers:
+                server.close()
+            tasks = []
+            for connection in list(self._connections):
+                connection.close()
+                if connection._task is not None:
+                    connection._task.cancel()
+                    tasks.append(connection._task)
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._loop.stop()
+
+        asyncio.run_coroutine_threadsafe(stop(), self._loop)
+        self._thread.join()
+        self._thread = None
+        self._servers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # operations, returning the messages to answer with
+
+    def _root_dse(self):
+        naming_contexts = [
+            entry.dn for entry in self.entries.values() if "," not in entry.dn
+        ]
+        return Entry(
+            "",
+            {
+                "objectClass": ["top"],
+                "namingContexts": naming_contexts,
+                "subschemaSubentry": [SUBSCHEMA_DN],
+                "supportedLDAPVersion": ["3"],
+                "supportedExtension": [START_TLS_OID],
+                "supportedControl": [PAGED_RESULTS_OID],
+                "vendorName": ["ldapauthenticator tests"],
+            },
+        )
+
+    def _subschema(self):
+        global _schema
+        if _schema is None:
+            from ldap3.protocol.schemas.slapd24 import slapd_2_4_schema
+
+            _schema = json.loads(slapd_2_4_schema)["raw"]
+        return Entry(SUBSCHEMA_DN, _schema)
+
+    def bind(self, message_id, request):
+        if not request["simple"]:
+            return [
+                encode_response(
+                    message_id, BIND_RESPONSE, *_result(AUTH_METHOD_NOT_SUPPORTED)
+                )
+            ]
+        name, password = request["name"], request["password"]
+        if not name and not password:
+            result_code = SUCCESS
+        elif not password:
+            # unauthenticated binds are refused, like OpenLDAP does
+            result_code = UNWILLING_TO_PERFORM
+        else:
+            entry = self.entries.get(normalize_dn(name))
+            if entry is not None and password in entry.get("userPassword"):
+                result_code = SUCCESS
+            else:
+                result_code = INVALID_CREDENTIALS
+        return [encode_response(message_id, BIND_RESPONSE, *_result(result_code))]
+
+    def _scoped(self, base, scope):
+        """
+        Returns the entries within a search's scope, or None if the base
+        doesn't exist.
+        """
+        if base.lower() == SUBSCHEMA_DN.lower() and scope == 0:
+            return [self._subschema()]
+        if not base and scope == 0:
+            return [self._root_dse()]
+        base = normalize_dn(base)
+        if base and base not in self.entries:
+            return None
+        if scope == 0:
+            return [self.entries[base]]
+        entries = []
+        for dn, entry in self.entries.items():
+            if scope == 1:
+                in_scope = dn.partition(",")[2] == base
+            else:
+                in_scope = not base or dn == base or dn.endswith("," + base)
+            if in_scope:
+                entries.append(entry)
+        return entries
+
+    def search(self, message_id, request):
+        entries = self._scoped(request["base"], request["scope"])
+        if entries is None:
+            return [
+                encode_response(
+                    message_id, SEARCH_RESULT_DONE, *_result(NO_SUCH_OBJECT)
+                )
+            ]
+        entries = [e for e in entries if self.matches(e, request["filter"])]
+
+        result_code = SUCCESS
+        controls = None
+        paged = request["controls"].get(PAGED_RESULTS_OID)
+        if paged is not None:
+            (_, size), (_, cookie) = _elements(_read(paged)[1])
+            size = _int(size)
+            offset = int(cookie or b"0")
+            end = offset + size if size else len(entries)
+            # like OpenLDAP, a full page is followed by another page, even if
+            # it's empty
+            next_cookie = str(end).encode() if size and end <= len(entries) else b""
+            entries = entries[offset:end]
+            controls = {PAGED_RESULTS_OID: _sequence(_integer(0), _octets(next_cookie))}
+        size_limit = request["size_limit"]
+        if size_limit and len(entries) > size_limit:
+            entries = entries[:size_limit]
+            result_code = SIZE_LIMIT_EXCEEDED
+
+        messages = []
+        for entry in entries:
+            # "1.1" requests no attributes
+            attributes = []
+            if "1.1" not in request["attributes"]:
+                attributes = entry.select(request["attributes"])
+            messages.append(
+                encode_response(
+                    message_id,
+                    SEARCH_RESULT_ENTRY,
+                    _octets(entry.dn),
+                    _sequence(
+                        *(
+                            _sequence(
+                                _octets(name),
+                                _sequence(*(_octets(v) for v in values), tag=0x31),
+                            )
+                            for name, values in attributes
+                        )
+                    ),
+                )
+            )
+        messages.append(
+            encode_response(
+                message_id,
+                SEARCH_RESULT_DONE,
+                *_result(result_code),
+                controls=controls,
+            )
+        )
+        return messages
+
+    def compare(self, message_id, request):
+        entry = self.entries.get(normalize_dn(request["dn"]))
+        if entry is None:
+            result_code = NO_SUCH_OBJECT
+        elif _normalize(request["attribute"], request["value"]) in entry.normalized(
+            request["attribute"]
+        ):
+            result_code = COMPARE_TRUE
+        else:
+            result_code = COMPARE_FALSE
+        return [encode_response(message_id, COMPARE_RESPONSE, *_result(result_code))]
+
+    def matches(self, entry, search_filter):
+        """
+        Returns whether an entry matches a filter decoded by `decode_request`.
+        """
+        kind = search_filter[0]
+        if kind == "and":
+            return all(self.matches(entry, f) for f in search_filter[1])
+        if kind == "or":
+            return any(self.matches(entry, f) for f in search_filter[1])
+        if kind == "not":
+            return not self.matches(entry, search_filter[1])
+        if kind == "present":
+            return bool(entry.get(search_filter[1]))
+
+        attribute = search_filter[1] if kind != "extensible" else search_filter[2]
+        if attribute is None or attribute.lower() == "userpassword":
+            return False
+        values = entry.normalized(attribute)
+        if kind == "equality":
+            return _normalize(attribute, search_filter[2]) in values
+        if kind in ("ge", "le"):
+            assertion = _normalize(attribute, search_filter[2])
+            if kind == "ge":
+                return any(value >= assertion for value in values)
+            return any(value <= assertion for value in values)
+        if kind == "substrings":
+            initial, middle, final = search_filter[2:]
+            pattern = "".join(
+                [
+                    re.escape(_normalize_value(initial or "")),
+                    ".*",
+                    *(re.escape(_normalize_value(part)) + ".*" for part in middle),
+                    re.escape(_normalize_value(final or "")),
+                ]
+            )
+            return any(re.fullmatch(pattern, value, re.DOTALL) for value in values)
+        if kind == "extensible":
+            rule, assertion = search_filter[1], _normalize(attribute, search_filter[3])
+            if rule == IN_CHAIN_RULE_OID:
+                return assertion in self._chain(entry, attribute)
+            return assertion in values
+        return False
+
+    def _chain(self, entry, attribute):
+        """
+        Returns the normalized DNs reached by following the DN valued
+        attribute of entries, from an entry.
+        """
+        reached = set()
+        todo = [entry]
+        while todo:
+            for dn in todo.pop().normalized(attribute):
+                if dn not in reached:
+                    reached.add(dn)
+                    if dn in self.entries:
+                        todo.append(self.entries[dn])
+        return reached
+
+
+class _Connection(asyncio.Protocol):
+    """
+    A client connection, answering its operations in order.
+    """
+
+    def __init__(self, server, tls):
+        self.server = server
+        self.tls = tls
+        self.transport = None
+        self._buffer = bytearray()
+        self._requests = asyncio.Queue()
+        self._task = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        server = self.server
+        server.counts["connections"] += 1
+        server._connections.add(self)
+        faulted, _ = server._fault("connect", {})
+        if faulted:
+            self.close()
+            return
+        self._task = asyncio.ensure_future(self._serve())
+
+    def connection_lost(self, exc):
+        self.server._connections.discard(self)
+        if self._task is not None:
+            self._task.cancel()
+
+    def close(self):
+        self.transport.abort()
+
+    def data_received(self, data):
+        self._buffer += data
+        while True:
+            size = _message_size(self._buffer)
+            if size is None or len(self._buffer) < size:
+                return
+            message = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            self._requests.put_nowait(message)
+
+    async def _serve(self):
+        server = self.server
+        while True:
+            message = await self._requests.get()
+            try:
+                message_id, operation, request = decode_request(message)
+            except (IndexError, ValueError):
+                self.close()
+                return
+            if operation == "abandon":
+                continue
+            if operation == "unknown":
+                # operations modifying the directory aren't supported
+                self.close()
+                return
+            server.counts[operation] += 1
+            if operation == "unbind":
+                self.close()
+                return
+
+            latency = server._latency(operation)
+            if latency:
+                await asyncio.sleep(latency)
+            faulted, result_code = server._fault(operation, request)
+            if faulted and result_code is None:
+                self.close()
+                return
+            if faulted:
+                tag = {
+                    "bind": BIND_RESPONSE,
+                    "search": SEARCH_RESULT_DONE,
+                    "compare": COMPARE_RESPONSE,
+                }.get(operation, EXTENDED_RESPONSE)
+                messages = [encode_response(message_id, tag, *_result(result_code))]
+            elif operation in ("bind", "search", "compare"):
+                messages = getattr(server, operation)(message_id, request)
+            elif operation == "start_tls" and not self.tls:
+                self.transport.write(
+                    encode_response(
+                        message_id,
+                        EXTENDED_RESPONSE,
+                        *_result(SUCCESS),
+                        _octets(START_TLS_OID, tag=0x8A),
+                    )
+                )
+                # data sent after the response is the TLS handshake, which
+                # start_tls reads before any more messages are received
+                self.transport = await asyncio.get_running_loop().start_tls(
+                    self.transport, self, server.ssl_context, server_side=True
+                )
+                self.tls = True
+                continue
+            else:
+                messages = [
+                    encode_response(
+                        message_id,
+                        EXTENDED_RESPONSE,
+                        *_result(OPERATIONS_ERROR if self.tls else PROTOCOL_ERROR),
+                    )
+                ]
+            self.transport.write(b"".join(messages))
+
+
+# the raw attributes of the schema entry, loaded once
+_schema = None
+_ssl_contexts = {}
+
+
+def make_ssl_context(host="127.0.0.1"):
+    """
+    Returns a server SSLContext with a self-signed certificate for localhost
+    and host, generated once per process.
+    """
+    if host in _ssl_contexts:
+        return _ssl_contexts[host]
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, host)])
+    names = [x509.DNSName("localhost")]
+    try:
+        names.append(x509.IPAddress(ipaddress.ip_address(host)))
+    except ValueError:
+        names.append(x509.DNSName(host))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .add_extension(x509.SubjectAlternativeName(names), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    # load_cert_chain only loads files
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cert.pem")
+        with open(path, "wb") as f:
+            f.write(certificate.public_bytes(serialization.Encoding.PEM))
+            f.write(
+                key.private_bytes(
+                    serialization.Encoding.PEM,
+                    serialization.PrivateFormat.PKCS8,
+                    serialization.NoEncryption(),
+                )
+            )
+        context.load_cert_chain(path)
+    _ssl_contexts[host] = context
+    return context
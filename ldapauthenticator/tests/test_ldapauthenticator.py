@@ -2,13 +2,31 @@
 Inspired by https://github.com/jupyterhub/jupyterhub/blob/main/jupyterhub/tests/test_auth.py
 
 Testing data is hardcoded in docker-test-openldap, described at
-https://github.com/rroemhild/docker-test-openldap?tab=readme-ov-file#ldap-structure
+https://github.com/rroemhild/docker-test-openldap?tab=readme-ov-file#ldap-structure,
+and served by the bundled LDAP server in ldapserver.py unless LDAP_HOST is set.
 """
 
+import asyncio
+import re
+from collections import Counter
+from types import SimpleNamespace
+
+import ldap3
 import pytest
-from ldap3.core.exceptions import LDAPSSLConfigurationError
+from jupyterhub.metrics import metrics_prefix
+from ldap3.core.exceptions import (
+    LDAPCommunicationError,
+    LDAPOperationResult,
+    LDAPSocketOpenError,
+    LDAPSocketReceiveError,
+    LDAPSSLConfigurationError,
+)
+from prometheus_client import REGISTRY
+from tornado import web
 
-from ..ldapauthenticator import LDAPAuthenticator, TlsStrategy
+from .. import loadtest
+from ..ldapauthenticator import LDAPAuthenticator, TlsStrategy, normalize_dn
+from . import ldapserver
 
 
 async def test_ldap_auth_allowed(c):
@@ -85,12 +103,13 @@ async def test_ldap_use_ssl_deprecation(c):
     assert authenticator.tls_strategy == TlsStrategy.on_connect
 
 
-async def test_ldap_auth_tls_strategy_on_connect(c):
+async def test_ldap_auth_tls_strategy_on_connect(c, ldap_address):
     """
     Verifies basic function of the authenticator with a given tls_strategy
     without actually confirming use of that strategy.
     """
     c.LDAPAuthenticator.tls_strategy = "on_connect"
+    c.LDAPAuthenticator.server_port = ldap_address.ssl_port
     authenticator = LDAPAuthenticator(config=c)
 
     # proper username and password in allowed group
@@ -234,3 +253,1456 @@ async def test_ldap_tls_kwargs_config_passthrough(c):
         await authenticator.get_authenticated_user(
             None, {"username": "leela", "password": "leela"}
         )
+
+
+@pytest.mark.parametrize("executor_threads", [0, 2])
+async def test_ldap_auth_executor_threads(c, executor_threads):
+    c.LDAPAuthenticator.executor_threads = executor_threads
+    authenticator = LDAPAuthenticator(config=c)
+
+    # concurrent logins, the last one is not in an allowed group
+    usernames = ["fry", "leela", "bender", "zoidberg"]
+    authorized = await asyncio.gather(
+        *(
+            authenticator.get_authenticated_user(
+                None, {"username": username, "password": username}
+            )
+            for username in usernames
+        )
+    )
+    assert [a and a["name"] for a in authorized] == ["fry", "leela", "bender", None]
+
+
+async def test_ldap_auth_executor_queue_size(c):
+    c.LDAPAuthenticator.executor_threads = 1
+    c.LDAPAuthenticator.executor_queue_size = 1
+    authenticator = LDAPAuthenticator(config=c)
+
+    # one login is run, one login waits, and the third login is refused
+    authorized = await asyncio.gather(
+        *(
+            authenticator.get_authenticated_user(
+                None, {"username": "fry", "password": "fry"}
+            )
+            for _ in range(3)
+        ),
+        return_exceptions=True,
+    )
+    assert authorized[0]["name"] == "fry"
+    assert authorized[1]["name"] == "fry"
+    assert isinstance(authorized[2], web.HTTPError)
+    assert authorized[2].status_code == 503
+
+
+async def test_ldap_auth_connections_closed(c):
+    c.LDAPAuthenticator.lookup_dn_search_user = "cn=admin,dc=planetexpress,dc=com"
+    c.LDAPAuthenticator.lookup_dn_search_password = "GoodNewsEveryone"
+    authenticator = LDAPAuthenticator(config=c)
+    assert authenticator._get_server_pool().servers[0].connect_timeout == 10
+
+    connections = []
+    connect = authenticator._connect
+
+    def recording_connect(server, userdn, password):
+        conn = connect(server, userdn, password)
+        assert conn.receive_timeout == 30
+        connections.append(conn)
+        return conn
+
+    authenticator._connect = recording_connect
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+
+    # the lookup and the user's connection are unbound, the latter in the
+    # executor
+    authenticator.executor.shutdown(wait=True)
+    assert len(connections) == 2
+    assert all(conn.closed for conn in connections)
+
+
+async def test_ldap_auth_login_timeout(c):
+    c.LDAPAuthenticator.login_timeout = 0.1
+    authenticator = LDAPAuthenticator(config=c)
+    lookup_user = authenticator._lookup_user_async
+
+    async def slow_lookup_user(username):
+        await asyncio.sleep(1)
+        return await lookup_user(username)
+
+    authenticator._lookup_user_async = slow_lookup_user
+    with pytest.raises(web.HTTPError) as exc:
+        await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+    assert exc.value.status_code == 503
+    assert authenticator._pending_logins == 0
+
+
+async def test_ldap_auth_coalesced_lookups(c):
+    c.LDAPAuthenticator.allowed_groups = [
+        "cn=ship_crew,ou=people,dc=planetexpress,dc=com"
+    ]
+    c.LDAPAuthenticator.auth_state_attributes = ["employeeType"]
+    authenticator = LDAPAuthenticator(config=c)
+
+    calls = Counter()
+
+    def counting(name, func):
+        async def wrapper(*args):
+            calls[name] += 1
+            # let the concurrent logins catch up
+            await asyncio.sleep(0.1)
+            return await func(*args)
+
+        return wrapper
+
+    authenticator._lookup_user_async = counting(
+        "lookup", authenticator._lookup_user_async
+    )
+    authenticator._bind_user = counting("bind", authenticator._bind_user)
+    authenticator._get_ldap_groups_async = counting(
+        "groups", authenticator._get_ldap_groups_async
+    )
+    authenticator._get_user_attributes_async = counting(
+        "attributes", authenticator._get_user_attributes_async
+    )
+
+    results = await asyncio.gather(
+        *(
+            authenticator.get_authenticated_user(
+                None, {"username": "fry", "password": password}
+            )
+            for password in ["fry", "fry", "fry", "raw"]
+        )
+    )
+    assert [bool(r) for r in results] == [True, True, True, False]
+    assert results[0]["auth_state"] == results[1]["auth_state"]
+    assert results[0]["auth_state"]["ldap_groups"] == [
+        "cn=ship_crew,ou=people,dc=planetexpress,dc=com"
+    ]
+    assert results[0]["auth_state"]["ldap_groups"] is not (
+        results[1]["auth_state"]["ldap_groups"]
+    )
+    # the password is checked by every login
+    assert calls == {"lookup": 1, "bind": 4, "groups": 1, "attributes": 1}
+    assert not authenticator._lookups_in_flight
+
+    # lookups aren't shared once completed
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    assert calls == {"lookup": 2, "bind": 5, "groups": 2, "attributes": 2}
+
+
+async def test_ldap_auth_coalesced_lookup_cancelled(c):
+    c.LDAPAuthenticator.allowed_groups = [
+        "cn=ship_crew,ou=people,dc=planetexpress,dc=com"
+    ]
+    authenticator = LDAPAuthenticator(config=c)
+
+    closed = []
+    close_connection = authenticator._close_connection
+
+    def recording_close_connection(conn):
+        closed.append(conn)
+        close_connection(conn)
+
+    authenticator._close_connection = recording_close_connection
+
+    started = asyncio.Event()
+    release = asyncio.Event()
+    get_ldap_groups = authenticator._get_ldap_groups_async
+
+    calls = Counter()
+
+    async def blocking_get_ldap_groups(conn, *args):
+        calls["groups"] += 1
+        started.set()
+        await release.wait()
+        # the connection of the cancelled login is still open
+        assert conn not in closed
+        return await get_ldap_groups(conn, *args)
+
+    authenticator._get_ldap_groups_async = blocking_get_ldap_groups
+
+    joined = asyncio.Event()
+    coalesce = authenticator._coalesce
+
+    async def recording_coalesce(key, *args):
+        if key in authenticator._lookups_in_flight:
+            joined.set()
+        return await coalesce(key, *args)
+
+    authenticator._coalesce = recording_coalesce
+
+    def login():
+        return asyncio.ensure_future(
+            authenticator.get_authenticated_user(
+                None, {"username": "fry", "password": "fry"}
+            )
+        )
+
+    first = login()
+    await started.wait()
+    second = login()
+    await joined.wait()
+    # cancelling the login that started the groups lookup leaves its
+    # connection open for the login waiting for the lookup
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    release.set()
+    authorized = await second
+    assert authorized["auth_state"]["ldap_groups"] == [
+        "cn=ship_crew,ou=people,dc=planetexpress,dc=com"
+    ]
+    assert calls == {"groups": 1}
+    # and closes it once the lookup is done
+    await asyncio.gather(*authenticator._background_tasks)
+    assert len(closed) == 2
+
+
+async def test_ldap_auth_login_throttle(c):
+    c.LDAPAuthenticator.login_throttle_user_burst = 2
+    c.LDAPAuthenticator.login_throttle_ip_burst = 3
+    authenticator = LDAPAuthenticator(config=c)
+
+    def handler(remote_ip):
+        return SimpleNamespace(request=SimpleNamespace(remote_ip=remote_ip))
+
+    # a successful login resets the failed logins of the username
+    for password in ["raw", "fry", "raw", "fry"]:
+        authorized = await authenticator.get_authenticated_user(
+            handler("10.0.0.1"), {"username": "fry", "password": password}
+        )
+        assert bool(authorized) == (password == "fry")
+
+    # the username is refused once its failed logins are used up, even with
+    # the right password
+    for _ in range(2):
+        authorized = await authenticator.get_authenticated_user(
+            handler("10.0.0.2"), {"username": "fry", "password": "raw"}
+        )
+        assert authorized is None
+    with pytest.raises(web.HTTPError) as exc:
+        await authenticator.get_authenticated_user(
+            handler("10.0.0.2"), {"username": "fry", "password": "fry"}
+        )
+    assert exc.value.status_code == 429
+
+    # the client IP is refused once its failed logins are used up, whatever
+    # the username, and successful logins don't reset them
+    authorized = await authenticator.get_authenticated_user(
+        handler("10.0.0.1"), {"username": "zoidberg", "password": "raw"}
+    )
+    assert authorized is None
+    with pytest.raises(web.HTTPError) as exc:
+        await authenticator.get_authenticated_user(
+            handler("10.0.0.1"), {"username": "leela", "password": "leela"}
+        )
+    assert exc.value.status_code == 429
+
+
+async def test_ldap_auth_login_throttle_concurrent(c, search_bases):
+    c.LDAPAuthenticator.login_throttle_user_burst = 2
+    c.LDAPAuthenticator.login_throttle_ip_burst = 2
+    authenticator = LDAPAuthenticator(config=c)
+    handler = SimpleNamespace(request=SimpleNamespace(remote_ip="10.0.0.1"))
+
+    # concurrent failed logins can't get past the limit, those beyond it are
+    # refused without contacting the LDAP server
+    results = await asyncio.gather(
+        *(
+            authenticator.get_authenticated_user(
+                handler, {"username": "fry", "password": "raw"}
+            )
+            for _ in range(10)
+        ),
+        return_exceptions=True,
+    )
+    refused = [r for r in results if isinstance(r, web.HTTPError)]
+    assert [r.status_code for r in refused] == [429] * 8
+    assert results.count(None) == 2
+    assert len(search_bases) <= 2
+
+
+async def test_ldap_auth_unknown_user_cache(c, search_bases):
+    c.LDAPAuthenticator.unknown_user_cache_ttl = 60
+    authenticator = LDAPAuthenticator(config=c)
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "nobody", "password": "nobody"}
+    )
+    assert authorized is None
+    assert search_bases == ["ou=people,dc=planetexpress,dc=com"]
+
+    # the unknown username is refused without looking it up again
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "nobody", "password": "nobody"}
+    )
+    assert authorized is None
+    assert search_bases == ["ou=people,dc=planetexpress,dc=com"]
+    assert "nobody" in authenticator._unknown_user_cache
+
+
+@pytest.mark.parametrize("backend", ["threads", "asyncio"])
+async def test_ldap_auth_unknown_user_cache_search_error(c, ldap_server, backend):
+    c.LDAPAuthenticator.server_address = ldap_server.host
+    c.LDAPAuthenticator.server_port = ldap_server.port
+    c.LDAPAuthenticator.backend = backend
+    c.LDAPAuthenticator.unknown_user_cache_ttl = 60
+    authenticator = LDAPAuthenticator(config=c)
+
+    # a failed lookup isn't remembered as an unknown user
+    ldap_server.fail(
+        "search",
+        ldapserver.BUSY,
+        times=1,
+        match=lambda r: r["base"] == ldapserver.PEOPLE_DN,
+    )
+    with pytest.raises(LDAPOperationResult):
+        await authenticator.get_authenticated_user(
+            None, {"username": "leela", "password": "leela"}
+        )
+    assert "leela" not in authenticator._unknown_user_cache
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "leela", "password": "leela"}
+    )
+    assert authorized["name"] == "leela"
+
+
+async def test_ldap_auth_lookup_dn_cache(c):
+    c.LDAPAuthenticator.lookup_dn_cache_ttl = 60
+    c.LDAPAuthenticator.bind_dn_template = []
+    authenticator = LDAPAuthenticator(config=c)
+
+    lookups = []
+    lookup_user = authenticator._lookup_user_async
+
+    async def counting_lookup_user(username):
+        lookups.append(username)
+        return await lookup_user(username)
+
+    authenticator._lookup_user_async = counting_lookup_user
+
+    fry = ("Philip J. Fry", "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com")
+    for _ in range(2):
+        authorized = await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+        assert authorized["name"] == "fry"
+    # the returning user isn't looked up again
+    assert lookups == ["fry"]
+    assert authenticator.resolve_username("fry") == fry
+
+    # a remembered DN that can't be bound with is looked up again
+    authenticator._lookup_dn_cache.set(
+        "fry", ("Philip J. Fry", "cn=Philip J. Fry,ou=moved,dc=planetexpress,dc=com")
+    )
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    assert authorized["auth_state"]["user_dn"] == fry[1]
+    assert lookups == ["fry", "fry"]
+    assert authenticator._lookup_dn_cache.get("fry") == fry
+
+
+async def test_ldap_auth_lookup_dn_pool(c):
+    c.LDAPAuthenticator.lookup_dn_pool_size = 1
+    authenticator = LDAPAuthenticator(config=c)
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    pool = authenticator._lookup_dn_pool
+    assert len(pool._idle) == 1
+    conn = pool._idle[0][0]
+
+    # the pooled connection is reused
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "leela", "password": "leela"}
+    )
+    assert authorized["name"] == "leela"
+    assert pool._idle[0][0] is conn
+
+    # a connection closed by the server is replaced
+    conn.unbind()
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    assert len(pool._idle) == 1
+    assert pool._idle[0][0] is not conn
+
+
+@pytest.mark.parametrize("backend", ["threads", "asyncio"])
+async def test_ldap_auth_bind_pool(c, backend):
+    c.LDAPAuthenticator.bind_pool_size = 1
+    c.LDAPAuthenticator.backend = backend
+    authenticator = LDAPAuthenticator(config=c)
+    pool = authenticator._bind_pool
+
+    async def login(username, password):
+        authorized = await authenticator.get_authenticated_user(
+            None, {"username": username, "password": password}
+        )
+        # the connection is returned to the pool in the background
+        for _ in range(100):
+            if pool._idle:
+                break
+            await asyncio.sleep(0.01)
+        return authorized
+
+    assert (await login("fry", "fry"))["name"] == "fry"
+    assert len(pool._idle) == 1
+    conn = pool._idle[0][0]
+    assert conn.bound
+    assert not conn.user
+
+    # the pooled connection is bound as the next user, also after a failed bind
+    assert await login("leela", "wrong") is None
+    assert pool._idle[0][0] is conn
+    authorized = await login("leela", "leela")
+    assert authorized["name"] == "leela"
+    assert "leela" in authorized["auth_state"]["user_dn"].lower()
+    assert pool._idle[0][0] is conn
+
+    # a connection closed by the server is replaced
+    conn.unbind()
+    assert (await login("fry", "fry"))["name"] == "fry"
+    assert len(pool._idle) == 1
+    assert pool._idle[0][0] is not conn
+
+
+@pytest.mark.parametrize("backend", ["threads", "asyncio"])
+async def test_ldap_auth_warm_up(c, backend):
+    c.LDAPAuthenticator.warm_up = True
+    c.LDAPAuthenticator.backend = backend
+    c.LDAPAuthenticator.lookup_dn_search_user = "cn=admin,dc=planetexpress,dc=com"
+    c.LDAPAuthenticator.lookup_dn_search_password = "GoodNewsEveryone"
+    c.LDAPAuthenticator.lookup_dn_pool_size = 1
+    c.LDAPAuthenticator.bind_pool_size = 1
+    authenticator = LDAPAuthenticator(config=c)
+    await authenticator._warm_up_task
+    assert len(authenticator._lookup_dn_pool._idle) == 1
+    assert len(authenticator._bind_pool._idle) == 1
+
+    connections = []
+    connect = authenticator._connect
+    connect_native = authenticator._connect_native
+
+    def recording_connect(server, userdn, password):
+        connections.append(userdn)
+        return connect(server, userdn, password)
+
+    async def recording_connect_native(server, userdn, password):
+        connections.append(userdn)
+        return await connect_native(server, userdn, password)
+
+    authenticator._connect = recording_connect
+    authenticator._connect_native = recording_connect_native
+
+    # the first login uses the connections established while warming up
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    assert connections == []
+
+
+@pytest.mark.parametrize("tls_strategy", ["before_bind", "on_connect", "insecure"])
+async def test_ldap_auth_asyncio_backend(c, ldap_address, tls_strategy):
+    c.LDAPAuthenticator.backend = "asyncio"
+    c.LDAPAuthenticator.tls_strategy = tls_strategy
+    if tls_strategy == "on_connect":
+        c.LDAPAuthenticator.server_port = ldap_address.ssl_port
+    c.LDAPAuthenticator.auth_state_attributes = ["employeeType"]
+    authenticator = LDAPAuthenticator(config=c)
+
+    # concurrent logins, zoidberg is not in an allowed group and bender uses an
+    # incorrect password
+    logins = [("fry", "fry"), ("leela", "leela"), ("zoidberg", "zoidberg")]
+    logins += [("bender", "raw")]
+    authorized = await asyncio.gather(
+        *(
+            authenticator.get_authenticated_user(
+                None, {"username": username, "password": password}
+            )
+            for username, password in logins
+        )
+    )
+    assert [a and a["name"] for a in authorized] == ["fry", "leela", None, None]
+    assert authorized[0]["auth_state"] == {
+        "ldap_groups": ["cn=ship_crew,ou=people,dc=planetexpress,dc=com"],
+        "user_attributes": {"employeeType": ["Delivery boy"]},
+        "user_dn": "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com",
+    }
+
+
+async def test_ldap_auth_asyncio_backend_lookup_dn_pool(c):
+    c.LDAPAuthenticator.backend = "asyncio"
+    c.LDAPAuthenticator.lookup_dn_pool_size = 1
+    authenticator = LDAPAuthenticator(config=c)
+
+    for username in ["fry", "leela"]:
+        authorized = await authenticator.get_authenticated_user(
+            None, {"username": username, "password": username}
+        )
+        assert authorized["name"] == username
+    pool = authenticator._lookup_dn_pool
+    assert len(pool._idle) == 1
+    conn = pool._idle[0][0]
+
+    # a connection closed by the server is replaced
+    conn.unbind()
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    assert pool._idle[0][0] is not conn
+
+
+@pytest.mark.parametrize("group_lookup_strategy", ["per_group", "subtree", "member_of"])
+async def test_ldap_auth_group_lookup_strategy(c, group_lookup_strategy):
+    c.LDAPAuthenticator.group_lookup_strategy = group_lookup_strategy
+    authenticator = LDAPAuthenticator(config=c)
+
+    # proper username and password in allowed group
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    assert authorized["auth_state"]["ldap_groups"] == [
+        "cn=ship_crew,ou=people,dc=planetexpress,dc=com"
+    ]
+
+    # proper username and password but not in allowed group
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "zoidberg", "password": "zoidberg"}
+    )
+    assert authorized is None
+
+
+@pytest.mark.parametrize("group_lookup_strategy", ["subtree", "member_of"])
+async def test_ldap_auth_nested_group_lookup(c, group_lookup_strategy):
+    c.LDAPAuthenticator.group_lookup_strategy = group_lookup_strategy
+    c.LDAPAuthenticator.nested_group_lookup = "walk"
+    authenticator = LDAPAuthenticator(config=c)
+    people = "ou=people,dc=planetexpress,dc=com"
+    ship_crew = f"cn=ship_crew,{people}"
+
+    # direct members of allowed_groups are still members
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["auth_state"]["ldap_groups"] == [ship_crew]
+
+    # the test directory has no nested groups, so the searches are answered
+    # from a group graph where fry and leela are members of ship_crew through
+    # the groups delivery and crew
+    fry_dn = f"cn=Philip J. Fry,{people}"
+    leela_dn = f"cn=Turanga Leela,{people}"
+    parents = {
+        fry_dn: [f"cn=delivery,{people}"],
+        leela_dn: [f"cn=delivery,{people}"],
+        f"cn=delivery,{people}": [f"cn=crew,{people}"],
+        f"cn=crew,{people}": [ship_crew],
+        ship_crew: [],
+    }
+
+    def run(searches):
+        searched = []
+        try:
+            search = next(searches)
+            while True:
+                searched.append(search["search_base"])
+                if search["search_scope"] == ldap3.BASE:
+                    dn = search["search_base"]
+                    attributes = {"memberOf": parents[dn]}
+                    entries = [
+                        SimpleNamespace(
+                            entry_dn=dn, entry_attributes_as_dict=attributes
+                        )
+                    ]
+                else:
+                    entries = [
+                        SimpleNamespace(entry_dn=parent)
+                        for child, dns in parents.items()
+                        if f"={child})" in search["search_filter"]
+                        for parent in dns
+                    ]
+                search = searches.send(entries)
+        except StopIteration as e:
+            return e.value, searched
+
+    ldap_groups, searched = run(authenticator._ldap_groups_searches(fry_dn, "fry"))
+    assert ldap_groups == [ship_crew]
+    # fry, delivery and crew, ship_crew's parents are cached since the login
+    assert len(searched) == 3
+    # the parent groups found walking fry's groups are cached
+    ldap_groups, searched = run(authenticator._ldap_groups_searches(leela_dn, "leela"))
+    assert ldap_groups == [ship_crew]
+    assert len(searched) == 1
+
+    # Active Directory matches the chain of nested groups itself
+    authenticator.nested_group_lookup = "in_chain"
+    search = next(authenticator._ldap_groups_searches(fry_dn, "fry"))
+    if group_lookup_strategy == "member_of":
+        assert search["search_base"] == fry_dn
+        assert search["search_filter"] == (
+            f"(memberOf:1.2.840.113556.1.4.1941:=cn=admin_staff,{people})"
+        )
+    else:
+        assert search["search_filter"] == (
+            f"(member:1.2.840.113556.1.4.1941:={fry_dn})"
+        )
+
+
+async def test_ldap_auth_metrics(c):
+    c.LDAPAuthenticator.group_cache_ttl = 60
+    authenticator = LDAPAuthenticator(config=c)
+    server = authenticator.server_address
+
+    def sample(name, **labels):
+        value = REGISTRY.get_sample_value(f"{metrics_prefix}_ldap_{name}", labels)
+        return value or 0
+
+    def samples():
+        return {
+            "bind": sample(
+                "bind_duration_seconds_count", server=server, status="success"
+            ),
+            "bind_rejected": sample(
+                "bind_duration_seconds_count", server=server, status="rejected"
+            ),
+            "lookup": sample(
+                "search_duration_seconds_count",
+                server=server,
+                phase="lookup",
+                status="success",
+            ),
+            "groups": sample(
+                "search_duration_seconds_count",
+                server=server,
+                phase="groups",
+                status="success",
+            ),
+            "group_cache_hit": sample(
+                "cache_requests_total", cache="group", status="hit"
+            ),
+            "group_cache_miss": sample(
+                "cache_requests_total", cache="group", status="miss"
+            ),
+        }
+
+    before = samples()
+    for _ in range(2):
+        authorized = await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+        assert authorized["name"] == "fry"
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "raw"}
+    )
+    assert authorized is None
+    after = samples()
+    assert {k: after[k] - before[k] for k in before} == {
+        # the lookup binds and fry's binds
+        "bind": 5,
+        "bind_rejected": 1,
+        "lookup": 3,
+        "groups": 2,
+        "group_cache_hit": 1,
+        "group_cache_miss": 1,
+    }
+
+
+async def test_ldap_auth_tracing(c):
+    trace = pytest.importorskip("opentelemetry.trace")
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+
+    if not isinstance(trace.get_tracer_provider(), sdk_trace.TracerProvider):
+        trace.set_tracer_provider(sdk_trace.TracerProvider())
+    exporter = InMemorySpanExporter()
+    trace.get_tracer_provider().add_span_processor(SimpleSpanProcessor(exporter))
+
+    authenticator = LDAPAuthenticator(config=c)
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    root = spans["ldap.authenticate"]
+    assert root.attributes["ldap.authenticated"] is True
+    # spans run in the executor are children of the login's span
+    for name in ["ldap.resolve_username", "ldap.bind_user", "ldap.groups"]:
+        assert spans[name].context.trace_id == root.context.trace_id
+    assert spans["ldap.bind"].attributes["ldap.server"] == authenticator.server_address
+    assert spans["ldap.bind"].attributes["ldap.status"] == "success"
+    assert spans["ldap.bind_user"].attributes["ldap.attempts"] == 1
+    assert "ldap.entries" in spans["ldap.search"].attributes
+    assert spans["ldap.connect"].context.trace_id == root.context.trace_id
+
+
+@pytest.mark.parametrize("group_lookup_strategy", ["subtree", "member_of"])
+async def test_ldap_auth_nested_group_cache_search_error(
+    c, ldap_server, group_lookup_strategy
+):
+    c.LDAPAuthenticator.server_address = ldap_server.host
+    c.LDAPAuthenticator.server_port = ldap_server.port
+    c.LDAPAuthenticator.group_lookup_strategy = group_lookup_strategy
+    c.LDAPAuthenticator.nested_group_lookup = "walk"
+    authenticator = LDAPAuthenticator(config=c)
+    ship_crew = f"cn=ship_crew,{ldapserver.PEOPLE_DN}"
+
+    # the parents of a group whose search failed aren't cached
+    ldap_server.fail(
+        "search",
+        ldapserver.BUSY,
+        times=1,
+        match=lambda r: "ship_crew" in str(r["filter"]) + r["base"],
+    )
+    with pytest.raises(LDAPOperationResult):
+        await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+    assert normalize_dn(ship_crew) not in authenticator._group_parents_cache
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["auth_state"]["ldap_groups"] == [ship_crew]
+    assert authenticator._group_parents_cache.get(normalize_dn(ship_crew)) == ()
+
+
+async def test_ldap_auth_group_cache(c):
+    c.LDAPAuthenticator.group_cache_ttl = 60
+    authenticator = LDAPAuthenticator(config=c)
+    fry_dn = "cn=Philip J. Fry,ou=people,dc=planetexpress,dc=com"
+    ship_crew = "cn=ship_crew,ou=people,dc=planetexpress,dc=com"
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["auth_state"]["ldap_groups"] == [ship_crew]
+
+    # the cached group memberships are used, and the password is still checked
+    authenticator._group_cache.set(normalize_dn(fry_dn), ())
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized is None
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "raw"}
+    )
+    assert authorized is None
+
+    # invalidating the cache makes the groups be looked up again
+    authenticator.invalidate_group_cache(fry_dn)
+    assert normalize_dn(fry_dn) not in authenticator._group_cache
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["auth_state"]["ldap_groups"] == [ship_crew]
+
+
+async def test_ldap_auth_group_cache_search_error(c, ldap_server):
+    c.LDAPAuthenticator.server_address = ldap_server.host
+    c.LDAPAuthenticator.server_port = ldap_server.port
+    c.LDAPAuthenticator.group_cache_ttl = 60
+    authenticator = LDAPAuthenticator(config=c)
+    fry_dn = f"cn=Philip J. Fry,{ldapserver.PEOPLE_DN}"
+    ship_crew = f"cn=ship_crew,{ldapserver.PEOPLE_DN}"
+
+    # the groups of a lookup whose search failed aren't cached
+    ldap_server.fail(
+        "search",
+        ldapserver.BUSY,
+        times=1,
+        match=lambda r: normalize_dn(r["base"]) == normalize_dn(ship_crew),
+    )
+    with pytest.raises(LDAPOperationResult):
+        await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+    assert normalize_dn(fry_dn) not in authenticator._group_cache
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["auth_state"]["ldap_groups"] == [ship_crew]
+
+
+@pytest.mark.parametrize("concurrent", [False, True])
+async def test_ldap_auth_bind_dn_template_order(c, concurrent):
+    c.LDAPAuthenticator.bind_dn_template = [
+        "cn={username},ou=robots,dc=planetexpress,dc=com",
+        "cn={username},ou=aliens,dc=planetexpress,dc=com",
+        "cn={username},ou=people,dc=planetexpress,dc=com",
+    ]
+    c.LDAPAuthenticator.bind_dn_template_cache_size = 10
+    c.LDAPAuthenticator.bind_dn_template_reorder = True
+    c.LDAPAuthenticator.bind_dn_template_concurrent = concurrent
+    authenticator = LDAPAuthenticator(config=c)
+
+    bound_dns = []
+    get_connection = authenticator.get_connection
+
+    def recording_get_connection(userdn, password):
+        if userdn:
+            bound_dns.append(userdn.split(",")[1])
+        return get_connection(userdn, password)
+
+    authenticator.get_connection = recording_get_connection
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    assert sorted(bound_dns) == ["ou=aliens", "ou=people", "ou=robots"]
+
+    # the template fry was bound with is remembered and tried first
+    bound_dns.clear()
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    assert bound_dns == ["ou=people"]
+
+    # other users try the template most logins succeeded with first
+    bound_dns.clear()
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "leela", "password": "leela"}
+    )
+    assert authorized["name"] == "leela"
+    assert bound_dns == ["ou=people"]
+
+    # all templates are still tried if the bind fails
+    bound_dns.clear()
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "raw"}
+    )
+    assert authorized is None
+    assert sorted(bound_dns) == ["ou=aliens", "ou=people", "ou=robots"]
+
+
+@pytest.mark.parametrize("group_lookup_strategy", ["per_group", "member_of"])
+async def test_ldap_auth_group_index(c, search_bases, group_lookup_strategy):
+    c.LDAPAuthenticator.group_lookup_strategy = group_lookup_strategy
+    c.LDAPAuthenticator.group_index_interval = 60
+    c.LDAPAuthenticator.group_index_page_size = 2
+    authenticator = LDAPAuthenticator(config=c)
+    people = "ou=people,dc=planetexpress,dc=com"
+    admin_staff, ship_crew = authenticator.allowed_groups
+
+    await authenticator._build_group_index()
+    index = authenticator._get_group_index()
+    assert index.get_groups(normalize_dn(f"cn=Philip J. Fry,{people}")) == [ship_crew]
+    assert index.get_groups(normalize_dn(f"cn=Hermes Conrad,{people}")) == [admin_staff]
+    if group_lookup_strategy == "member_of":
+        # the members of both groups are read in 2 pages of up to 2 entries
+        assert search_bases == [people] * 4
+    else:
+        assert search_bases == [admin_staff, ship_crew]
+
+    # logins look up groups in the index instead of searching for them
+    search_bases.clear()
+    authenticator._group_index_refresh = object()
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["auth_state"]["ldap_groups"] == [ship_crew]
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "zoidberg", "password": "zoidberg"}
+    )
+    assert authorized is None
+    assert search_bases == [people] * 2
+
+    # the index isn't used once changed config makes it outdated
+    authenticator._group_index_refresh = None
+    authenticator.allowed_groups = [ship_crew]
+    assert authenticator._get_group_index() is None
+
+
+@pytest.mark.parametrize("group_lookup_strategy", ["per_group", "member_of"])
+async def test_ldap_auth_group_index_search_error(
+    c, ldap_server, group_lookup_strategy
+):
+    c.LDAPAuthenticator.server_address = ldap_server.host
+    c.LDAPAuthenticator.server_port = ldap_server.port
+    c.LDAPAuthenticator.group_lookup_strategy = group_lookup_strategy
+    c.LDAPAuthenticator.group_index_interval = 60
+    authenticator = LDAPAuthenticator(config=c)
+    ship_crew = authenticator.allowed_groups[1]
+    fry_dn = normalize_dn(f"cn=Philip J. Fry,{ldapserver.PEOPLE_DN}")
+
+    await authenticator._build_group_index()
+    index = authenticator._get_group_index()
+    assert index.get_groups(fry_dn) == [ship_crew]
+
+    # a search answered with an error fails the build instead of leaving the
+    # group's members out, and the previous index is kept
+    if group_lookup_strategy == "member_of":
+        ldap_server.fail("search", ldapserver.BUSY, times=1)
+    else:
+        ldap_server.fail(
+            "search",
+            ldapserver.BUSY,
+            times=1,
+            match=lambda r: normalize_dn(r["base"]) == normalize_dn(ship_crew),
+        )
+    await authenticator._build_group_index()
+    assert authenticator._get_group_index() is index
+    assert index.get_groups(fry_dn) == [ship_crew]
+
+
+async def test_ldap_auth_refresh_user(c, search_bases):
+    c.LDAPAuthenticator.refresh_user_interval = 60
+    c.LDAPAuthenticator.auth_state_attributes = ["employeeType"]
+    authenticator = LDAPAuthenticator(config=c)
+    people = "ou=people,dc=planetexpress,dc=com"
+    ship_crew = f"cn=ship_crew,{people}"
+
+    def user(name, auth_state):
+        async def get_auth_state():
+            return auth_state
+
+        return SimpleNamespace(name=name, get_auth_state=get_auth_state)
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    fry = user("fry", dict(authorized["auth_state"], ldap_groups=[]))
+    assert authorized["auth_state"]["user_dn"] == f"cn=Philip J. Fry,{people}"
+
+    # users aren't refreshed within refresh_user_interval of logging in
+    search_bases.clear()
+    assert await authenticator.refresh_user(fry) is True
+    assert search_bases == []
+
+    # users are refreshed together, users that no longer exist or are no
+    # longer allowed have to log in again
+    authenticator._refreshed_users.clear()
+    refreshed = await asyncio.gather(
+        authenticator.refresh_user(fry),
+        authenticator.refresh_user(
+            user("leela", {"user_dn": f"cn=Turanga Leela,{people}"})
+        ),
+        authenticator.refresh_user(
+            user("zoidberg", {"user_dn": f"cn=John A. Zoidberg,{people}"})
+        ),
+        authenticator.refresh_user(user("flexo", {"user_dn": f"cn=Flexo,{people}"})),
+    )
+    assert refreshed[0]["auth_state"] == {
+        "ldap_groups": [ship_crew],
+        "user_attributes": {"employeeType": ["Delivery boy"]},
+        "user_dn": f"cn=Philip J. Fry,{people}",
+    }
+    assert refreshed[1]["auth_state"]["ldap_groups"] == [ship_crew]
+    assert refreshed[2:] == [False, False]
+    # one search for the users, one for the user not found, and one per group
+    assert search_bases == [
+        people,
+        f"cn=Flexo,{people}",
+        *authenticator.allowed_groups,
+    ]
+
+
+@pytest.mark.parametrize("backend", ["threads", "asyncio"])
+async def test_ldap_auth_refresh_user_search_error(c, ldap_server, backend):
+    c.LDAPAuthenticator.server_address = ldap_server.host
+    c.LDAPAuthenticator.server_port = ldap_server.port
+    c.LDAPAuthenticator.backend = backend
+    c.LDAPAuthenticator.refresh_user_interval = 60
+    authenticator = LDAPAuthenticator(config=c)
+    fry_dn = f"cn=Philip J. Fry,{ldapserver.PEOPLE_DN}"
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+
+    async def get_auth_state():
+        return authorized["auth_state"]
+
+    fry = SimpleNamespace(name="fry", get_auth_state=get_auth_state)
+
+    # users aren't logged out if the LDAP server answers with errors, only if
+    # their entry no longer exists
+    ldap_server.fail("search", ldapserver.BUSY)
+    assert await authenticator._refresh_user_entry(fry_dn, "fry") is None
+    authenticator._refreshed_users.clear()
+    assert await authenticator.refresh_user(fry) is True
+
+    ldap_server.reset()
+    del ldap_server.entries[ldapserver.normalize_dn(fry_dn)]
+    assert await authenticator._refresh_user_entry(fry_dn, "fry") is False
+
+
+async def test_ldap_server_reuse(c):
+    authenticator = LDAPAuthenticator(config=c)
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    server_pool = authenticator._server_pool
+    assert server_pool is not None
+
+    # the server and its TLS configuration is reused
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "leela", "password": "leela"}
+    )
+    assert authorized["name"] == "leela"
+    assert authenticator._server_pool is server_pool
+
+    # the server is recreated when relevant config changes
+    authenticator.tls_kwargs = {"ciphers": "HIGH"}
+    assert authenticator._server_pool is None
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    assert authenticator._server_pool.servers[0].tls.ciphers == "HIGH"
+
+
+@pytest.mark.parametrize("server_pool_strategy", ["first", "round_robin", "random"])
+async def test_ldap_auth_server_failover(c, monkeypatch, server_pool_strategy):
+    c.LDAPAuthenticator.server_address = [
+        "unreachable.invalid",
+        c.LDAPAuthenticator.server_address,
+    ]
+    c.LDAPAuthenticator.server_pool_strategy = server_pool_strategy
+    # the random strategy tries the unreachable server first
+    monkeypatch.setattr("random.shuffle", lambda servers: None)
+    authenticator = LDAPAuthenticator(config=c)
+
+    # the unreachable server is failed over from, and marked down
+    for _ in range(2):
+        authorized = await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+        assert authorized["name"] == "fry"
+    server_pool = authenticator._server_pool
+    unreachable_server, server = server_pool.servers
+    assert server_pool.is_down(unreachable_server)
+    assert not server_pool.is_down(server)
+
+    # servers marked down are skipped
+    assert server_pool.get_servers() == [server]
+
+    # health checks marks servers down or up
+    server_pool.mark_up(unreachable_server)
+    await authenticator._check_servers_health()
+    assert server_pool.is_down(unreachable_server)
+    assert not server_pool.is_down(server)
+
+
+async def test_ldap_auth_circuit_breaker(c):
+    server_address = c.LDAPAuthenticator.server_address
+    c.LDAPAuthenticator.server_address = "unreachable.invalid"
+    c.LDAPAuthenticator.circuit_breaker_threshold = 2
+    c.LDAPAuthenticator.circuit_breaker_cooldown = 0
+    authenticator = LDAPAuthenticator(config=c)
+
+    # failing to connect opens the circuit breaker
+    for _ in range(2):
+        with pytest.raises(LDAPSocketOpenError):
+            await authenticator.get_authenticated_user(
+                None, {"username": "fry", "password": "fry"}
+            )
+    assert authenticator._circuit_breaker.state == "open"
+
+    # logins then fail right away, while the server is probed
+    with pytest.raises(web.HTTPError) as exc:
+        await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+    assert exc.value.status_code == 503
+    probe = authenticator._circuit_breaker_probe
+    assert probe is not None
+
+    # once the server accepts connections, logins are let through again
+    authenticator.server_address = server_address
+    await probe
+    assert authenticator._circuit_breaker.state == "closed"
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+
+
+@pytest.mark.parametrize("backend", ["threads", "asyncio"])
+async def test_ldap_auth_circuit_breaker_receive_timeout(c, ldap_server, backend):
+    c.LDAPAuthenticator.server_address = ldap_server.host
+    c.LDAPAuthenticator.server_port = ldap_server.port
+    c.LDAPAuthenticator.backend = backend
+    c.LDAPAuthenticator.receive_timeout = 1
+    c.LDAPAuthenticator.circuit_breaker_threshold = 1
+    authenticator = LDAPAuthenticator(config=c)
+
+    # a server that hangs opens the circuit breaker like an unreachable one
+    ldap_server.latency = {"bind": 2}
+    with pytest.raises(LDAPSocketReceiveError):
+        await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+    assert authenticator._circuit_breaker.state == "open"
+
+    with pytest.raises(web.HTTPError) as exc:
+        await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+    assert exc.value.status_code == 503
+    probe = authenticator._circuit_breaker_probe
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+
+
+async def test_ldap_auth_credential_cache(c):
+    c.LDAPAuthenticator.credential_cache_ttl = 60
+    c.LDAPAuthenticator.credential_cache_outage_grace = 300
+    authenticator = LDAPAuthenticator(config=c)
+
+    connects = []
+    connect = authenticator._connect
+
+    def counting_connect(server, userdn, password):
+        connects.append(userdn)
+        return connect(server, userdn, password)
+
+    authenticator._connect = counting_connect
+
+    async def login(password):
+        authorized = await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": password}
+        )
+        # the login is remembered in the background
+        await asyncio.gather(*authenticator._background_tasks)
+        return authorized
+
+    authorized = await login("fry")
+    assert authorized["name"] == "fry"
+    n_connects = len(connects)
+
+    # logging in again doesn't contact the LDAP server
+    remembered = await login("fry")
+    assert remembered == authorized
+    assert len(connects) == n_connects
+
+    # other passwords are verified with the LDAP server
+    assert await login("raw") is None
+    assert len(connects) > n_connects
+
+    # once expired, remembered logins are only used if the LDAP server is
+    # unavailable
+    authenticator._credential_cache.ttl = 0
+    n_connects = len(connects)
+    assert (await login("fry"))["name"] == "fry"
+    assert len(connects) > n_connects
+
+    # logins refused as too many are in progress aren't an outage
+    authenticator.executor_queue_size = 1
+    authenticator._pending_logins = authenticator.executor_threads + 1
+    with pytest.raises(web.HTTPError) as exc:
+        await login("fry")
+    assert exc.value.status_code == 503
+    authenticator._pending_logins = 0
+
+    def failing_connect(server, userdn, password):
+        raise LDAPSocketOpenError("unreachable")
+
+    authenticator._connect = failing_connect
+    assert (await login("fry"))["name"] == "fry"
+    with pytest.raises(LDAPSocketOpenError):
+        await login("raw")
+
+    # or is considered unavailable
+    authenticator.circuit_breaker_threshold = 1
+    authenticator._circuit_breaker.failed()
+    remembered = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert remembered["name"] == "fry"
+    probe = authenticator._circuit_breaker_probe
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+    authenticator.circuit_breaker_threshold = 0
+
+    authenticator.invalidate_credential_cache("fry")
+    with pytest.raises(LDAPSocketOpenError):
+        await login("fry")
+
+
+@pytest.mark.parametrize(
+    "lookup_dn_fetch_auth_state_attributes, search_filter, expected_searches",
+    [
+        (False, "", 2),
+        (True, "", 1),
+        (False, "(&(objectClass=inetOrgPerson)(cn={username}))", 2),
+        (True, "(&(objectClass=inetOrgPerson)(cn={username}))", 2),
+    ],
+)
+async def test_ldap_auth_state_attributes_searches(
+    c,
+    search_bases,
+    lookup_dn_fetch_auth_state_attributes,
+    search_filter,
+    expected_searches,
+):
+    c.LDAPAuthenticator.allowed_groups = []
+    c.LDAPAuthenticator.allow_all = True
+    c.LDAPAuthenticator.search_filter = search_filter
+    c.LDAPAuthenticator.auth_state_attributes = ["employeeType"]
+    c.LDAPAuthenticator.lookup_dn_fetch_auth_state_attributes = (
+        lookup_dn_fetch_auth_state_attributes
+    )
+    authenticator = LDAPAuthenticator(config=c)
+
+    # the user entry is read once, unless looked up by lookup_dn_search_user
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+    assert authorized["auth_state"]["user_attributes"] == {
+        "employeeType": ["Delivery boy"]
+    }
+    assert len(search_bases) == expected_searches
+
+
+@pytest.mark.parametrize(
+    "lookup_dn_fetch_auth_state_attributes, search_filter",
+    [
+        (True, ""),
+        (False, "(&(objectClass=inetOrgPerson)(cn={username}))"),
+    ],
+)
+async def test_ldap_auth_state_attributes_wildcard(
+    c, lookup_dn_fetch_auth_state_attributes, search_filter
+):
+    c.LDAPAuthenticator.allowed_groups = []
+    c.LDAPAuthenticator.allow_all = True
+    c.LDAPAuthenticator.search_filter = search_filter
+    c.LDAPAuthenticator.auth_state_attributes = ["*"]
+    c.LDAPAuthenticator.lookup_dn_fetch_auth_state_attributes = (
+        lookup_dn_fetch_auth_state_attributes
+    )
+    c.LDAPAuthenticator.refresh_user_interval = 60
+    authenticator = LDAPAuthenticator(config=c)
+
+    # all user attributes are read, not only those requested by name
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    user_attributes = authorized["auth_state"]["user_attributes"]
+    assert user_attributes["employeeType"] == ["Delivery boy"]
+    assert user_attributes["uid"] == ["fry"]
+
+    # also when refreshing the user
+    async def get_auth_state():
+        return authorized["auth_state"]
+
+    authenticator._refreshed_users.clear()
+    refreshed = await authenticator.refresh_user(
+        SimpleNamespace(name="fry", get_auth_state=get_auth_state)
+    )
+    assert refreshed["auth_state"]["user_attributes"] == user_attributes
+
+
+async def test_loadtest(c, tmp_path):
+    config_file = tmp_path / "jupyterhub_config.py"
+    config_file.write_text(
+        "\n".join(
+            f"c.LDAPAuthenticator.{key} = {value!r}"
+            for key, value in c.LDAPAuthenticator.items()
+        )
+    )
+    credentials_file = tmp_path / "users.csv"
+    credentials_file.write_text("fry,fry\nleela,leela\n")
+
+    authenticator = LDAPAuthenticator(config=loadtest.load_config(str(config_file)))
+    logins, phases, errors = await loadtest.run_loadtest(
+        authenticator,
+        loadtest.load_credentials(str(credentials_file)),
+        loadtest.parse_mix("good=1,bad=1,unknown=1"),
+        rate=100,
+        concurrency=5,
+        duration=0.3,
+        seed=0,
+    )
+    assert errors == {}
+    results = {row["credentials"]: row for row in logins}
+    assert sum(row["logins"] for row in logins) == 30
+    assert results["good"]["accepted"] == results["good"]["logins"]
+    assert results["bad"]["denied"] == results["bad"]["logins"]
+    assert results["unknown"]["denied"] == results["unknown"]["logins"]
+    assert {"bind", "search:lookup", "search:groups"} <= {
+        row["phase"] for row in phases
+    }
+    for row in phases:
+        assert 0 <= row["~p50 ms"] <= row["~p99 ms"]
+
+
+def test_loadtest_main(c, tmp_path, capsys):
+    c.LDAPAuthenticator.allowed_groups = []
+    c.LDAPAuthenticator.allowed_users = {"fry"}
+    c.LDAPAuthenticator.executor_threads = 0
+    config_file = tmp_path / "jupyterhub_config.py"
+    config_file.write_text(
+        "\n".join(
+            f"c.LDAPAuthenticator.{key} = {value!r}"
+            for key, value in c.LDAPAuthenticator.items()
+        )
+    )
+    credentials_file = tmp_path / "users.csv"
+    credentials_file.write_text("fry,fry\nleela,leela\n")
+    argv = ["--config", str(config_file), "--credentials", str(credentials_file)]
+
+    with pytest.raises(SystemExit):
+        loadtest.main([*argv, "--rate", "0"])
+    assert "must be greater than 0" in capsys.readouterr().err
+
+    loadtest.main(
+        [*argv, "--mix", "good=1", "--rate", "100", "--duration", "0.2", "--seed", "0"]
+    )
+    header, good = capsys.readouterr().out.splitlines()[:2]
+    # columns are separated by two spaces at least
+    results = dict(
+        zip(re.split(" {2,}", header.strip()), re.split(" {2,}", good.strip()))
+    )
+    # logins not allowed, as leela's, are denied
+    assert int(results["accepted"]) + int(results["denied"]) == int(results["logins"])
+    assert int(results["accepted"]) > 0
+    assert int(results["denied"]) > 0
+
+
+def test_ldap_server(ldap_server):
+    people = ldapserver.PEOPLE_DN
+    ship_crew = f"cn=ship_crew,{people}"
+    server = ldap3.Server(ldap_server.host, port=ldap_server.port)
+    conn = ldap3.Connection(server, ldapserver.ADMIN_DN, ldapserver.ADMIN_PASSWORD)
+    conn.open()
+    assert conn.start_tls()
+    assert conn.bind()
+    assert server.schema is not None
+
+    # filters are matched like OpenLDAP does, including in chain matches
+    conn.search(people, "(&(objectClass=inetOrgPerson)(ou= delivering  CREW))")
+    assert len(conn.entries) == 3
+    conn.search(people, f"(memberOf:1.2.840.113556.1.4.1941:={ship_crew})")
+    assert len(conn.entries) == 3
+    conn.search(people, "(cn=*J. Fr*)", attributes=["uid", "userPassword"])
+    # userPassword is never returned
+    assert [r["raw_attributes"] for r in conn.response] == [
+        {"uid": [b"fry"], "userPassword": []}
+    ]
+
+    # paged searches return pages until one isn't full
+    pages = []
+    cookie = None
+    while cookie != b"":
+        conn.search(people, "(uid=*)", paged_size=3, paged_cookie=cookie)
+        pages.append(len(conn.entries))
+        cookie = conn.result["controls"][ldapserver.PAGED_RESULTS_OID]["value"][
+            "cookie"
+        ]
+    assert pages == [3, 3, 1]
+
+    assert conn.compare(ship_crew, "member", f"cn=Philip J. Fry,{people}")
+    assert not conn.compare(ship_crew, "member", f"cn=John A. Zoidberg,{people}")
+    conn.unbind()
+    assert ldap_server.counts["start_tls"] == 1
+    assert ldap_server.counts["compare"] == 2
+
+
+@pytest.mark.parametrize("backend", ["threads", "asyncio"])
+@pytest.mark.parametrize("search_filter", ["", "(cn={username})"])
+async def test_ldap_auth_search_errors(c, ldap_server, backend, search_filter):
+    c.LDAPAuthenticator.server_address = ldap_server.host
+    c.LDAPAuthenticator.server_port = ldap_server.port
+    c.LDAPAuthenticator.backend = backend
+    c.LDAPAuthenticator.search_filter = search_filter
+    authenticator = LDAPAuthenticator(config=c)
+
+    # a search answered with an error isn't taken for one finding no entries,
+    # whether the user's lookup or the search_filter search following it
+    searches = []
+
+    def match(request):
+        if request["base"] == ldapserver.PEOPLE_DN:
+            searches.append(request)
+        return len(searches) == (2 if search_filter else 1)
+
+    ldap_server.fail("search", ldapserver.BUSY, times=1, match=match)
+    with pytest.raises(LDAPOperationResult) as exc:
+        await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+    assert exc.value.result == ldapserver.BUSY
+
+    authorized = await authenticator.get_authenticated_user(
+        None, {"username": "fry", "password": "fry"}
+    )
+    assert authorized["name"] == "fry"
+
+
+@pytest.mark.parametrize("backend", ["threads", "asyncio"])
+async def test_ldap_auth_server_faults(c, ldap_server, backend):
+    c.LDAPAuthenticator.server_address = ldap_server.host
+    c.LDAPAuthenticator.server_port = ldap_server.port
+    c.LDAPAuthenticator.backend = backend
+    c.LDAPAuthenticator.bind_pool_size = 1
+    authenticator = LDAPAuthenticator(config=c)
+    pool = authenticator._bind_pool
+    fry_dn = f"cn=Philip J. Fry,{ldapserver.PEOPLE_DN}"
+
+    async def login():
+        authorized = await authenticator.get_authenticated_user(
+            None, {"username": "fry", "password": "fry"}
+        )
+        # the connection is returned to the pool in the background
+        for _ in range(100):
+            if pool._idle:
+                break
+            await asyncio.sleep(0.01)
+        return authorized
+
+    assert (await login())["name"] == "fry"
+    assert len(pool._idle) == 1
+
+    # a pooled connection dropped by the server is replaced
+    ldap_server.disconnect("bind", times=1, match=lambda r: r["name"] == fry_dn)
+    connections = ldap_server.counts["connections"]
+    assert (await login())["name"] == "fry"
+    # one connection to look up fry, and one to replace the pooled one
+    assert ldap_server.counts["connections"] == connections + 2
+    assert len(pool._idle) == 1
+
+    # binds refused by the server fail logins
+    ldap_server.fail("bind", ldapserver.BUSY, times=1, match=lambda r: r["name"])
+    assert await login() is None
+
+    # slow responses fail logins after login_timeout
+    ldap_server.latency = {"search": 0.5}
+    authenticator.login_timeout = 0.1
+    with pytest.raises(web.HTTPError) as exc:
+        await login()
+    assert exc.value.status_code == 503
+    # the lookup started by the cancelled login completes regardless
+    await asyncio.gather(*authenticator._lookups_in_flight.values())
+
+    # a server that drops connections fails logins
+    ldap_server.reset()
+    ldap_server.disconnect("connect")
+    with pytest.raises(LDAPCommunicationError):
+        await login()
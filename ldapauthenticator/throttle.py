@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class FailureThrottle:
+    """
+    A thread safe throttle of failed attempts per key, such as a username or a
+    client IP, holding state for at most `maxsize` keys, evicting the least
+    recently used key when full.
+
+    Every key has a token bucket holding up to `burst` tokens, refilled with
+    one token every `interval` seconds. An attempt takes a token, given back
+    unless the attempt fails, and a failure taking the last token blocks the
+    key for `interval` seconds, doubled for every further such failure up to
+    `max_backoff` seconds. The backoff starts
+    over once the bucket is full again, or the key is reset.
+    """
+
+    def __init__(self, burst, interval, max_backoff, maxsize):
+        self.burst = burst
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.maxsize = maxsize
+        # key -> [tokens, last refill, backoff doublings, blocked until]
+        self._state = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._state)
+
+    def _refill(self, state, now):
+        if self.interval > 0:
+            state[0] = min(self.burst, state[0] + (now - state[1]) / self.interval)
+        else:
+            state[0] = self.burst
+        state[1] = now
+        if state[0] >= self.burst:
+            state[2] = 0
+
+    def try_acquire(self, key):
+        """
+        Takes a token for an attempt for key, returning 0 if the attempt is
+        allowed, or otherwise the number of seconds until an attempt is
+        allowed again, without taking a token.
+
+        Taking the token before the attempt is made keeps concurrent attempts
+        from exceeding the burst. The token is given back with `release` or
+        `reset` if the attempt didn't fail, and `failed` records that it did.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None:
+                state = self._state[key] = [self.burst, now, 0, 0]
+            self._state.move_to_end(key)
+            self._refill(state, now)
+            wait = max(state[3] - now, 0)
+            if state[0] < 1 and self.interval > 0:
+                wait = max(wait, (1 - state[0]) * self.interval)
+            if wait > 0:
+                return wait
+            state[0] -= 1
+            while len(self._state) > self.maxsize:
+                self._state.popitem(last=False)
+            return 0
+
+    def failed(self, key):
+        """
+        Records that an attempt for key, whose token was taken with
+        `try_acquire`, failed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None:
+                return
+            if state[0] < 1:
+                backoff = min(self.interval * 2 ** state[2], self.max_backoff)
+                state[3] = now + backoff
+                state[2] += 1
+
+    def release(self, key):
+        """
+        Gives back the token taken with `try_acquire` for an attempt for key
+        that didn't fail.
+        """
+        with self._lock:
+            state = self._state.get(key)
+            if state is not None:
+                state[0] = min(state[0] + 1, self.burst)
+
+    def reset(self, key):
+        """
+        Forgets the failed attempts for key.
+        """
+        with self._lock:
+            self._state.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._state.clear()
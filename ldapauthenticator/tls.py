@@ -0,0 +1,132 @@
+import ssl
+import threading
+from functools import partial
+
+from ldap3.core.tls import Tls, check_hostname
+
+
+class SessionSavingSSLSocket(ssl.SSLSocket):
+    """
+    A SSLSocket passing its TLS session to `save_session` before it is shut
+    down or closed. With TLS 1.3 the session ticket needed to resume a session
+    is received after the handshake, so the session is only resumable later.
+    """
+
+    save_session = None
+
+    def _save_session(self):
+        if self.save_session is not None and self.session is not None:
+            self.save_session(self.session)
+
+    def shutdown(self, how):
+        self._save_session()
+        super().shutdown(how)
+
+    def close(self):
+        self._save_session()
+        super().close()
+
+
+class ReusableTls(Tls):
+    """
+    A ldap3 Tls object that creates its SSLContext, including loading the CA
+    certificates, once instead of for every connection. It also offers the
+    TLS session of a previous connection to the same server when a new
+    connection is established, so that the server can resume it with an
+    abbreviated handshake.
+
+    Accepts the same arguments as ldap3's Tls object.
+
+    ldap3 Tls ref: https://github.com/cannatag/ldap3/blob/v2.9.1/ldap3/core/tls.py
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._ssl_context = None
+        # per server (host, port), the most recent TLS session that can be
+        # offered for resumption
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _create_ssl_context(self):
+        """
+        Creates a SSLContext just like ldap3's Tls.wrap_socket does.
+        """
+        if self.version is None:
+            ssl_context = ssl.create_default_context(
+                purpose=ssl.Purpose.SERVER_AUTH,
+                cafile=self.ca_certs_file,
+                capath=self.ca_certs_path,
+                cadata=self.ca_certs_data,
+            )
+        else:
+            ssl_context = ssl.SSLContext(self.version)
+            if self.ca_certs_file or self.ca_certs_path or self.ca_certs_data:
+                ssl_context.load_verify_locations(
+                    self.ca_certs_file, self.ca_certs_path, self.ca_certs_data
+                )
+            elif self.validate != ssl.CERT_NONE:
+                ssl_context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+
+        if self.certificate_file:
+            ssl_context.load_cert_chain(
+                self.certificate_file,
+                keyfile=self.private_key_file,
+                password=self.private_key_password,
+            )
+        ssl_context.sslsocket_class = SessionSavingSSLSocket
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = self.validate
+        for option in self.ssl_options:
+            ssl_context.options |= option
+
+        if self.ciphers:
+            try:
+                ssl_context.set_ciphers(self.ciphers)
+            except ssl.SSLError:
+                pass
+        return ssl_context
+
+    @property
+    def ssl_context(self):
+        with self._lock:
+            if self._ssl_context is None:
+                self._ssl_context = self._create_ssl_context()
+            return self._ssl_context
+
+    def _save_session(self, key, session):
+        if session.has_ticket or session.id:
+            with self._lock:
+                self._sessions[key] = session
+
+    def wrap_socket(self, connection, do_handshake=False):
+        """
+        Adds TLS to the connection socket
+        """
+        key = (connection.server.host, connection.server.port)
+        with self._lock:
+            session = self._sessions.get(key)
+        try:
+            wrapped_socket = self.ssl_context.wrap_socket(
+                connection.socket,
+                server_side=False,
+                do_handshake_on_connect=do_handshake,
+                server_hostname=self.sni or None,
+                session=session,
+            )
+        except ValueError:
+            # the session was rejected for this connection, retry without it
+            with self._lock:
+                self._sessions.pop(key, None)
+            wrapped_socket = self.ssl_context.wrap_socket(
+                connection.socket,
+                server_side=False,
+                do_handshake_on_connect=do_handshake,
+                server_hostname=self.sni or None,
+            )
+
+        if do_handshake and self.validate in (ssl.CERT_REQUIRED, ssl.CERT_OPTIONAL):
+            check_hostname(wrapped_socket, connection.server.host, self.valid_names)
+
+        wrapped_socket.save_session = partial(self._save_session, key)
+        connection.socket = wrapped_socket
@@ -0,0 +1,101 @@
+"""
+OpenTelemetry tracing of logins
+
+Spans are recorded if the optional opentelemetry-api package is installed and
+a tracer provider has been configured, such as by running JupyterHub with
+`opentelemetry-instrument`. Otherwise, tracing costs nothing but a check for
+the provider, as no spans are created.
+
+Spans are named after the operation, like `ldap.bind`, and carry the labels
+of the corresponding metrics as attributes prefixed with `ldap.`, like
+`ldap.server`.
+"""
+
+from contextlib import nullcontext
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+# yields None, standing in for a span when not tracing
+_no_span = nullcontext()
+
+# (provider, tracer) of the last configured tracer provider
+_tracer = (None, None)
+
+
+def get_tracer():
+    """
+    Returns the tracer to record spans with, or None if there is no tracer
+    provider configured.
+    """
+    global _tracer
+    if trace is None:
+        return None
+    provider = trace.get_tracer_provider()
+    if isinstance(provider, (trace.ProxyTracerProvider, trace.NoOpTracerProvider)):
+        return None
+    if _tracer[0] is not provider:
+        _tracer = (provider, provider.get_tracer(__name__))
+    return _tracer[1]
+
+
+def start_span(name, **attributes):
+    """
+    Returns a context manager recording a span as the current span, yielding
+    the span, or yielding None if not tracing.
+
+    Attributes are prefixed with `ldap.`, and those that are None are left
+    out.
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        return _no_span
+    return tracer.start_as_current_span(
+        name,
+        attributes={
+            f"ldap.{key}": (
+                value if isinstance(value, (bool, int, float)) else str(value)
+            )
+            for key, value in attributes.items()
+            if value is not None
+        },
+    )
+
+
+def set_attributes(span, **attributes):
+    """
+    Sets attributes of a span yielded by `start_span`, if tracing, like
+    `start_span` does.
+    """
+    if span is None:
+        return
+    for key, value in attributes.items():
+        if value is not None:
+            if not isinstance(value, (bool, int, float)):
+                value = str(value)
+            span.set_attribute(f"ldap.{key}", value)
+
+
+def set_result(span, conn, search=None):
+    """
+    Sets the result of the last operation of a connection as attributes of a
+    span, if tracing. For a search, given its keyword arguments, also sets its
+    base, filter and the number of entries found.
+    """
+    if span is None:
+        return
+    result = conn.result or {}
+    set_attributes(
+        span,
+        result_code=result.get("result"),
+        result=result.get("description"),
+    )
+    if search is not None:
+        set_attributes(
+            span,
+            search_base=search.get("search_base"),
+            search_filter=search.get("search_filter"),
+            entries=len(conn.entries),
+        )
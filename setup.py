@@ -19,9 +19,14 @@ setup(
     ],
     extras_require={
         "test": [
+            "cryptography",
             "pytest",
             "pytest-asyncio",
             "pytest-cov",
+            "opentelemetry-sdk",
+        ],
+        "tracing": [
+            "opentelemetry-api",
         ],
     },
     entry_points={